@@ -0,0 +1,592 @@
+import argparse
+import codecs
+import io
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+import numpy as np
+
+from annotation_store import StoreFile
+from archive_io import ArchiveWriter
+from archive_io import file_name
+from archive_io import is_archive
+from archive_io import is_archive_name
+from archive_io import iter_members
+from archive_io import member_path
+from async_io import iter_reads
+from coordinate_transforms import ROUNDING
+from coordinate_transforms import CoordinateTransform
+from coordinate_transforms import parse_size
+from json_stream import JsonArrayWriter
+from json_stream import iter_dataloop_items
+from polygon_geometry import areas
+from polygon_geometry import bounding_boxes
+from polygon_geometry import out_of_bounds
+from polygon_geometry import pack
+from polygon_geometry import self_intersecting
+from polygon_geometry import simplify
+from polygon_geometry import unpack
+from voc_reader import ClassTable
+from voc_reader import read_voc
+
+OBJECTS_JSON_SUFFIX = '___objects.json'
+DEFAULT_CLASS_ID = 12698
+DATALOOP_EXPORT_FILE = 'dataloop_export.json'
+
+
+class ImageAnnotation:
+    """
+    The intermediate representation every format is read into and written from: one image and its boxes.
+
+    ``coords`` is an (N, 4) float64 array of x1, y1, x2, y2 with the origin on the top left corner, ``class_ids``
+    index into the shared ``classes`` table and ``polygons`` maps a box index to the (K, 2) float64 vertices the box
+    was derived from. Float64 keeps the coordinates of a source file exact, so a conversion only changes what a
+    transform or simplification changed.
+    """
+
+    __slots__ = ('filename', 'width', 'height', 'classes', 'class_ids', 'coords', 'polygons')
+
+    def __init__(self, filename, width, height, classes, class_ids, coords, polygons=None):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.classes = classes
+        self.class_ids = np.asarray(class_ids, dtype=np.int32)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 4)
+        self.polygons = polygons or {}
+
+    def names(self):
+        return [self.classes.names[c] for c in self.class_ids]
+
+    def stem(self):
+        return os.path.splitext(os.path.basename(self.filename or ''))[0]
+
+
+def shape_boxes(coords, shapes):
+    """
+    ``coords`` as an (N, 4) array, with the rows in ``shapes`` (row: vertices, None in ``coords``) set to the bounding
+    boxes of their vertices; one bounding_boxes call for the whole document instead of one min/max per shape.
+    """
+    boxes = np.array([box if box is not None else (np.nan,) * 4 for box in coords], dtype=np.float64).reshape(-1, 4)
+    if shapes:
+        rows = list(shapes)
+        boxes[rows] = bounding_boxes(*pack([shapes[row] for row in rows], dtype=np.float64))
+    return boxes
+
+
+def simplify_annotation(ann, tolerance):
+    """ Douglas-Peucker every polygon of ``ann`` in place and refit the boxes derived from them. """
+    if ann.polygons:
+        rows = sorted(ann.polygons)
+        vertices, offsets = simplify(*pack([ann.polygons[i] for i in rows], dtype=np.float64), tolerance)
+        ann.coords[rows] = bounding_boxes(vertices, offsets)
+        ann.polygons = dict(zip(rows, unpack(vertices, offsets)))
+    return ann
+
+
+def polygon_problems(ann, tolerance=0.05):
+    """
+    {problem: number of polygons} of the polygons of ``ann`` that enclose no area, cross themselves or leave the image
+    by more than ``tolerance`` of its size; an image of unknown size is never left.
+    """
+    if not ann.polygons:
+        return OrderedDict()
+    vertices, offsets = pack(list(ann.polygons.values()), dtype=np.float64)
+    checks = OrderedDict([('zero area', areas(vertices, offsets) <= 0),
+                          ('self intersection', self_intersecting(vertices, offsets))])
+    if ann.width and ann.height:
+        checks['out of bounds'] = out_of_bounds(vertices, offsets, ann.width, ann.height, tolerance)
+    return OrderedDict((problem, int(bad.sum())) for problem, bad in checks.items() if bad.any())
+
+
+def report_polygons(ann):
+    """ Print the polygon problems of ``ann``, one line each, and pass it on. """
+    for problem, n in polygon_problems(ann).items():
+        print(f'polygon {problem}: ', file_name(ann.filename or ''), f'{n} of {len(ann.polygons)}')
+    return ann
+
+
+def list_files(path, suffix):
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(suffix)]
+    return [path]
+
+
+def iter_inputs(path, suffix, io_concurrency=None):
+    """
+    (file, bytes) of the input files of a reader: the members of a zip or tar, as archive!member paths, or the files
+    of a directory or a single file, whose bytes are None unless they were read ahead.
+    """
+    if is_archive(path):
+        for name, f in iter_members(path, (suffix,)):
+            yield member_path(path, name), f.read()
+    else:
+        yield from iter_file_data(list_files(path, suffix), io_concurrency)
+
+
+def iter_file_data(files, io_concurrency=None):
+    """ (file, bytes) of every file, read ahead asynchronously with ``io_concurrency``; bytes are None without. """
+    if not io_concurrency:
+        return ((file, None) for file in files)
+    reads = iter_reads((((file, None),) for file in files), io_concurrency)
+    return ((file, data) for file, (data,) in zip(files, reads))
+
+
+# Readers: each yields ImageAnnotations from a file, a directory of files or a zip/tar of them. ``io_concurrency``
+# reads the files of a directory ahead, for slow network storage.
+
+def read_voc_annotations(path, classes=None, io_concurrency=None):
+    classes = classes if classes is not None else ClassTable()
+    for file, data in iter_inputs(path, '.xml', io_concurrency):
+        yield voc_annotation(io.BytesIO(data) if data is not None else file, classes, name=file_name(file))
+
+
+def voc_annotation(source, classes, name=None):
+    """ ImageAnnotation from one VOC xml, given as a path or binary file object. """
+    ann = read_voc(source, classes)
+    filename = ann.filename
+    if not filename:
+        name = name or (source if isinstance(source, str) else 'image.xml')
+        filename = os.path.splitext(os.path.basename(name))[0] + '.jpg'
+    return ImageAnnotation(filename, ann.width, ann.height, classes, ann.class_ids, ann.boxes)
+
+
+def read_annotate_online(path, classes=None, io_concurrency=None):
+    classes = classes if classes is not None else ClassTable()
+    for file, data in iter_inputs(path, OBJECTS_JSON_SUFFIX, io_concurrency):
+        if data is None:
+            with open(file, 'rb') as f:
+                data = f.read()
+        objects = json.loads(data)
+        filename = file_name(file)
+        if filename.endswith(OBJECTS_JSON_SUFFIX):
+            filename = filename[:-len(OBJECTS_JSON_SUFFIX)]
+        yield annotate_online_annotation(objects, filename, classes)
+
+
+def annotate_online_annotation(objects, filename, classes):
+    class_ids, coords, polygons = [], [], {}
+    for obj in objects:
+        points = obj.get('points')
+        if obj.get('type') == 'bbox':
+            coords.append((points['x1'], points['y1'], points['x2'], points['y2']))
+        elif obj.get('type') == 'polygon' and points:
+            polygons[len(coords)] = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+            coords.append(None)
+        else:
+            continue
+        class_ids.append(classes.intern(obj.get('className')))
+    return ImageAnnotation(filename, None, None, classes, class_ids, shape_boxes(coords, polygons), polygons)
+
+
+def read_dataloop(path, classes=None, io_concurrency=None):
+    """
+    Dataloop item json: single items, dataset exports (lists of items), json lines, or a directory of them.
+
+    Items are streamed one at a time and their metadata snapshots are skipped, so memory doesn't grow with the export.
+    Reading whole files ahead would undo that, so ``io_concurrency`` is ignored.
+    """
+    classes = classes if classes is not None else ClassTable()
+    if is_archive(path):
+        for _, f in iter_members(path, ('.json',)):
+            # Tar members are forward-only streams, which io.TextIOWrapper refuses.
+            for item in iter_dataloop_items(codecs.getreader('utf-8')(f)):
+                yield dataloop_annotation(item, classes)
+        return
+    for file in list_files(path, '.json'):
+        with open(file) as f:
+            for item in iter_dataloop_items(f):
+                yield dataloop_annotation(item, classes)
+
+
+def dataloop_annotation(item, classes):
+    system = (item.get('itemMetadata') or item.get('metadata') or {}).get('system') or {}
+    class_ids, coords, polygons = [], [], {}
+    for annotation in item.get('annotations', []):
+        class_id, box, vertices = dataloop_geometry(annotation, classes)
+        if class_id is None:
+            continue
+        if vertices is not None:
+            polygons[len(coords)] = vertices
+        coords.append(box)
+        class_ids.append(class_id)
+    filename = os.path.basename(item.get('filename') or '')
+    return ImageAnnotation(filename, system.get('width'), system.get('height'), classes, class_ids,
+                           shape_boxes(coords, polygons), polygons)
+
+
+def dataloop_geometry(annotation, classes):
+    """
+    (class id, box, polygon vertices) of one Dataloop annotation: a box or vertices, the other None. All three are None
+    when it has no geometry.
+    """
+    coordinates = annotation.get('coordinates')
+    annotation_type = annotation.get('type')
+    if not coordinates:
+        # 'class' annotations label the whole item and have no geometry.
+        return None, None, None
+    if annotation_type == 'box':
+        box = (coordinates[0]['x'], coordinates[0]['y'], coordinates[1]['x'], coordinates[1]['y'])
+        return classes.intern(annotation.get('label')), box, None
+    if annotation_type in ('segment', 'polygon', 'polyline'):
+        if isinstance(coordinates[0], list):
+            coordinates = coordinates[0]
+        vertices = np.array([(c['x'], c['y']) for c in coordinates], dtype=np.float64)
+        return classes.intern(annotation.get('label')), None, vertices
+    return None, None, None
+
+
+def read_labelme(path, classes=None, io_concurrency=None):
+    classes = classes if classes is not None else ClassTable()
+    for file, data in iter_inputs(path, '.json', io_concurrency):
+        if data is None:
+            with open(file, 'rb') as f:
+                data = f.read()
+        yield labelme_annotation(json.loads(data), classes)
+
+
+def labelme_annotation(data, classes):
+    class_ids, shapes, polygons = [], {}, {}
+    for shape in data.get('shapes', []):
+        vertices = np.asarray(shape.get('points') or [], dtype=np.float64).reshape(-1, 2)
+        shape_type = shape.get('shape_type') or 'polygon'
+        if not len(vertices) or shape_type not in ('rectangle', 'polygon'):
+            continue
+        # Rectangles are their two corners, so every shape's box comes from its vertices.
+        if shape_type == 'polygon':
+            polygons[len(shapes)] = vertices
+        shapes[len(shapes)] = vertices
+        class_ids.append(classes.intern(shape.get('label')))
+    filename = os.path.basename(data.get('imagePath') or '')
+    return ImageAnnotation(filename, data.get('imageWidth'), data.get('imageHeight'), classes, class_ids,
+                           shape_boxes([None] * len(shapes), shapes), polygons)
+
+
+def read_store(path, classes=None, io_concurrency=None):
+    """
+    ImageAnnotations of an annotation store (see box_table.open_store), sliced from the memory-mapped file.
+
+    Nothing is parsed: every image's boxes and polygon vertices are read straight out of the mapped arrays.
+    """
+    classes = classes if classes is not None else ClassTable()
+    sections = StoreFile(path).sections
+    class_ids = np.array([classes.intern(name) for name in sections['class_names']], dtype=np.int32)
+    boxes = sections['boxes']
+    image_offsets = sections['image_offsets'].tolist()
+    polygon_rows = sections['polygon_rows']
+    polygon_offsets = sections['polygon_offsets']
+    vertices = sections['vertices']
+    for i, filename in enumerate(sections['filenames']):
+        start, end = image_offsets[i], image_offsets[i + 1]
+        rows = boxes[start:end]
+        coords = np.stack([rows['x1'], rows['y1'], rows['x2'], rows['y2']], axis=1)
+        polygons = {}
+        first, last = np.searchsorted(polygon_rows, [start, end])
+        for p in range(first, last):
+            polygons[int(polygon_rows[p]) - start] = vertices[polygon_offsets[p]:polygon_offsets[p + 1]]
+        width = int(sections['widths'][i])
+        height = int(sections['heights'][i])
+        yield ImageAnnotation(filename, width if width >= 0 else None, height if height >= 0 else None, classes,
+                              class_ids[rows['class_id']], coords, polygons)
+
+
+# Writers: each turns one ImageAnnotation into the format's document and writes it to a directory.
+
+def voc_document(ann):
+    annotation = ET.Element('annotation')
+    ET.SubElement(annotation, 'folder')
+    ET.SubElement(annotation, 'filename').text = ann.filename
+    ET.SubElement(annotation, 'path').text = ann.filename
+    source = ET.SubElement(annotation, 'source')
+    ET.SubElement(source, 'database').text = 'Unknown'
+    size = ET.SubElement(annotation, 'size')
+    ET.SubElement(size, 'width').text = str(ann.width or 0)
+    ET.SubElement(size, 'height').text = str(ann.height or 0)
+    ET.SubElement(size, 'depth').text = '3'
+    ET.SubElement(annotation, 'segmented').text = '0'
+    for name, box in zip(ann.names(), np.rint(ann.coords).astype(np.int64).tolist()):
+        obj = ET.SubElement(annotation, 'object')
+        ET.SubElement(obj, 'name').text = name
+        ET.SubElement(obj, 'pose').text = 'Unspecified'
+        ET.SubElement(obj, 'truncated').text = '0'
+        ET.SubElement(obj, 'difficult').text = '0'
+        bndbox = ET.SubElement(obj, 'bndbox')
+        for field, value in zip(('xmin', 'ymin', 'xmax', 'ymax'), box):
+            ET.SubElement(bndbox, field).text = str(value)
+    return ET.tostring(annotation, encoding='unicode')
+
+
+def annotate_online_objects(ann, class_ids=None, default_class_id=DEFAULT_CLASS_ID):
+    class_ids = class_ids or {}
+    objects = []
+    for i, (name, (x1, y1, x2, y2)) in enumerate(zip(ann.names(), _plain(ann.coords))):
+        obj = dict(type='bbox',
+                   classId=class_ids.get(name, default_class_id),
+                   probability=100,
+                   points=dict(x1=x1, x2=x2, y1=y1, y2=y2),
+                   groupId=0,
+                   pointLabels={},
+                   locked=False,
+                   visible=True,
+                   attributes=[],
+                   className=name)
+        if i in ann.polygons:
+            obj['type'] = 'polygon'
+            obj['points'] = _plain(ann.polygons[i].ravel())
+        objects.append(obj)
+    return objects
+
+
+def dataloop_item(ann):
+    annotations = []
+    for i, (name, (x1, y1, x2, y2)) in enumerate(zip(ann.names(), _plain(ann.coords))):
+        if i in ann.polygons:
+            annotations.append(dict(type='segment',
+                                    label=name,
+                                    attributes=[],
+                                    coordinates=[[dict(x=x, y=y) for x, y in _plain(ann.polygons[i])]]))
+        else:
+            annotations.append(dict(type='box',
+                                    label=name,
+                                    attributes=[],
+                                    coordinates=[dict(x=x1, y=y1, z=0), dict(x=x2, y=y2, z=0)]))
+    return dict(filename='/' + (ann.filename or ''),
+                annotations=annotations,
+                itemMetadata=dict(system=dict(width=ann.width, height=ann.height)))
+
+
+def labelme_document(ann):
+    shapes = []
+    for i, (name, (x1, y1, x2, y2)) in enumerate(zip(ann.names(), _plain(ann.coords))):
+        if i in ann.polygons:
+            shapes.append(dict(label=name, points=_plain(ann.polygons[i]), group_id=None, shape_type='polygon',
+                               flags={}))
+        else:
+            shapes.append(dict(label=name, points=[[x1, y1], [x2, y2]], group_id=None, shape_type='rectangle',
+                               flags={}))
+    return dict(version='4.5.5',
+                flags={},
+                shapes=shapes,
+                imagePath=ann.filename,
+                imageData=None,
+                imageHeight=ann.height,
+                imageWidth=ann.width)
+
+
+def _plain(array):
+    """ Python numbers for json, with whole numbers written as ints. """
+    values = np.asarray(array, dtype=np.float64)
+    if np.all(values == np.rint(values)):
+        return values.astype(np.int64).tolist()
+    return values.tolist()
+
+
+# Output files: each gives the (file name, text) of one ImageAnnotation in the format, for a directory or an archive.
+
+def voc_file(ann, **options):
+    return ann.stem() + '.xml', voc_document(ann)
+
+
+def annotate_online_file(ann, class_ids=None, default_class_id=DEFAULT_CLASS_ID, **options):
+    return ann.filename + OBJECTS_JSON_SUFFIX, json.dumps(annotate_online_objects(ann, class_ids, default_class_id))
+
+
+def dataloop_file(ann, **options):
+    return ann.stem() + '.json', json.dumps(dataloop_item(ann))
+
+
+def labelme_file(ann, **options):
+    return ann.stem() + '.json', json.dumps(labelme_document(ann))
+
+
+def write_file(out_dir, name, text):
+    path = os.path.join(out_dir, name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def write_voc(ann, out_dir, **options):
+    return write_file(out_dir, *voc_file(ann, **options))
+
+
+def write_annotate_online(ann, out_dir, class_ids=None, default_class_id=DEFAULT_CLASS_ID, **options):
+    return write_file(out_dir, *annotate_online_file(ann, class_ids, default_class_id))
+
+
+def write_dataloop(ann, out_dir, **options):
+    return write_file(out_dir, *dataloop_file(ann, **options))
+
+
+def write_dataloop_export(annotations, path):
+    """ All items in one Dataloop export file, written item by item. """
+    with open(path, 'w') as f, JsonArrayWriter(f) as writer:
+        for ann in annotations:
+            writer.write(dataloop_item(ann))
+    return writer.count
+
+
+def write_labelme(ann, out_dir, **options):
+    return write_file(out_dir, *labelme_file(ann, **options))
+
+
+READERS = {'voc': read_voc_annotations,
+           'annotate_online': read_annotate_online,
+           'dataloop': read_dataloop,
+           'labelme': read_labelme,
+           'store': read_store}
+
+WRITERS = {'voc': write_voc,
+           'annotate_online': write_annotate_online,
+           'dataloop': write_dataloop,
+           'labelme': write_labelme}
+
+FILES = {'voc': voc_file,
+         'annotate_online': annotate_online_file,
+         'dataloop': dataloop_file,
+         'labelme': labelme_file}
+
+
+def convert(source, source_format, out_dir, target_format, single_file=False, simplify_tolerance=None,
+            io_concurrency=None, transform=None, check_polygons=False, **options):
+    """
+    Convert any supported format to any other in one streamed pass.
+
+    Every image is read into an ImageAnnotation and written out straight away; nothing but the output files touches
+    the disk. ``options`` are passed on to the writer. With ``single_file`` Dataloop output goes to one export file.
+    ``transform`` is a CoordinateTransform (origin flip, rescale, clipping, rounding) applied to every image first.
+    ``simplify_tolerance`` runs Douglas-Peucker over the polygons before they are written, and ``check_polygons``
+    reports the polygons written that enclose no area, cross themselves or leave their image. ``io_concurrency`` reads
+    the input files ahead asynchronously.
+
+    ``source`` may be a zip or tar, read member by member without extracting it, and an ``out_dir`` named like one
+    (.zip, .tar, .tar.gz, ...) is written as that archive in one sequential pass.
+    """
+    to_archive = is_archive_name(out_dir)
+    if not to_archive and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    annotations = READERS[source_format](source, io_concurrency=io_concurrency)
+    if transform is not None and not transform.is_identity():
+        annotations = (transform.apply(ann) for ann in annotations)
+    if simplify_tolerance is not None:
+        annotations = (simplify_annotation(ann, simplify_tolerance) for ann in annotations)
+    if check_polygons:
+        annotations = (report_polygons(ann) for ann in annotations)
+
+    n_converted = 0
+    if single_file and target_format == 'dataloop':
+        if to_archive:
+            # The export is streamed to a temporary file first: tar members need their size up front.
+            with tempfile.TemporaryDirectory() as tmp_dir, ArchiveWriter(out_dir) as archive:
+                export_file = os.path.join(tmp_dir, DATALOOP_EXPORT_FILE)
+                n_converted = write_dataloop_export(annotations, export_file)
+                archive.add_file(DATALOOP_EXPORT_FILE, export_file)
+        else:
+            n_converted = write_dataloop_export(annotations, os.path.join(out_dir, DATALOOP_EXPORT_FILE))
+    elif to_archive:
+        make_file = FILES[target_format]
+        with ArchiveWriter(out_dir) as archive:
+            for ann in annotations:
+                archive.add(*make_file(ann, **options))
+                n_converted += 1
+    else:
+        write = WRITERS[target_format]
+        for ann in annotations:
+            write(ann, out_dir, **options)
+            n_converted += 1
+    print(f'Number of converted files: {n_converted}')
+    return n_converted
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Convert annotations between VOC xml, annotate-online, Dataloop '
+                                                 'and LabelMe json.')
+    parser.add_argument('--input',
+                        action='store',
+                        help='Input file, directory, or zip/tar(.gz) archive.',
+                        required=True)
+    parser.add_argument('--input_format',
+                        action='store',
+                        choices=sorted(READERS),
+                        required=True)
+    parser.add_argument('--out_dir',
+                        action='store',
+                        help='The output directory, or a .zip/.tar/.tar.gz file to write an archive.',
+                        required=True)
+    parser.add_argument('--output_format',
+                        action='store',
+                        choices=sorted(WRITERS),
+                        required=True)
+    parser.add_argument('--class_ids',
+                        action='store',
+                        help='Json file mapping className to classId, for annotate-online output.',
+                        default=None)
+    parser.add_argument('--default_class_id',
+                        action='store',
+                        type=int,
+                        help='classId for class names missing from --class_ids.',
+                        default=DEFAULT_CLASS_ID)
+    parser.add_argument('--single_file',
+                        action='store_true',
+                        help=f'Write Dataloop output as one export file, {DATALOOP_EXPORT_FILE}, instead of one json '
+                             f'per item.')
+    parser.add_argument('--simplify',
+                        action='store',
+                        type=float,
+                        help='Simplify polygons, dropping vertices within this many pixels of the outline.',
+                        default=None)
+    parser.add_argument('--check_polygons',
+                        action='store_true',
+                        help='Report polygons without area, crossing themselves or outside their image.')
+    parser.add_argument('--io_concurrency',
+                        action='store',
+                        type=int,
+                        help='Read input files ahead with this many concurrent reads, for network storage.',
+                        default=None)
+    parser.add_argument('--target_size',
+                        action='store',
+                        type=parse_size,
+                        help='Rescale every image and its annotation to WIDTHxHEIGHT, e.g. for a training export.',
+                        default=None)
+    parser.add_argument('--scale',
+                        action='store',
+                        type=float,
+                        help='Rescale every image and its annotation by this factor.',
+                        default=None)
+    parser.add_argument('--flip_y',
+                        action='store_true',
+                        help='Move the origin of the coordinates between the top left and the bottom left corner.')
+    parser.add_argument('--clip',
+                        action='store_true',
+                        help='Clip boxes and polygons to the image.')
+    parser.add_argument('--rounding',
+                        action='store',
+                        choices=ROUNDING,
+                        help="Round coordinates: 'outward'/'inward' grow/shrink boxes to whole pixels.",
+                        default='float')
+
+    args = parser.parse_args()
+    class_ids = None
+    if args.class_ids:
+        with open(args.class_ids) as f:
+            class_ids = json.load(f)
+    convert(args.input,
+            args.input_format,
+            args.out_dir,
+            args.output_format,
+            single_file=args.single_file,
+            simplify_tolerance=args.simplify,
+            check_polygons=args.check_polygons,
+            io_concurrency=args.io_concurrency,
+            transform=CoordinateTransform(flip_y=args.flip_y, scale=args.scale, target_size=args.target_size,
+                                          clip=args.clip, rounding=args.rounding),
+            class_ids=class_ids,
+            default_class_id=args.default_class_id)
+
+
+if __name__ == "__main__":
+    main()
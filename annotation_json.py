@@ -1,29 +1,22 @@
-import json
+from json_stream import JsonArrayWriter
+from json_stream import iter_items
 
 # input output json file
 
 input_file = open('labelMe.json', 'r')
 output_file = open('dataloop.json', 'w')
-json_decode = json.load(input_file)
-print(json_decode)
-# iterating in input file
-data = []
 
-for item in json_decode.get('shapes'):
-    # my_dict = {}
-    #
-    # my_dict['labels']=item.get('labels')
-    # my_dict['description']=item.get('points')
-    # my_dict['shape_type']=item.get('shape_type')
-    # print(my_dict)
-
-    data.append(item)
-# creating output file
-back_json = json.dumps(data)
-output_file.write(back_json)
+# iterating in input file, one shape at a time, and writing each one out as soon as it is read
+with JsonArrayWriter(output_file) as writer:
+    for item in iter_items(input_file, ['shapes']):
+        # my_dict = {}
+        #
+        # my_dict['labels']=item.get('labels')
+        # my_dict['description']=item.get('points')
+        # my_dict['shape_type']=item.get('shape_type')
+        # print(my_dict)
+
+        writer.write(item)
+print(f'Number of shapes: {writer.count}')
+input_file.close()
 output_file.close()
-
-
-
-
-
@@ -0,0 +1,168 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# One box of a dataset, as box_table.BoxTable holds it in memory and an annotation store holds it on disk.
+BOX_DTYPE = np.dtype([('image_idx', np.int32),
+                      ('class_id', np.int32),
+                      ('x1', np.float32),
+                      ('y1', np.float32),
+                      ('x2', np.float32),
+                      ('y2', np.float32),
+                      ('flags', np.uint8)])
+
+# The box is the bounding box of a polygon whose vertices are kept in BoxTable.vertices.
+FLAG_POLYGON = 1
+
+# A store file is MAGIC, a uint32 version and the uint32 length of a json directory, the directory, then every
+# section as raw array data starting on an ALIGNMENT byte boundary. The directory records the dtype, byte order
+# included, shape and offset of every section.
+MAGIC = b'BOXSTORE'
+# Bump when the layout or the sections of a dataset change; a store of another version is rejected.
+STORE_VERSION = 1
+ALIGNMENT = 64
+STORE_SUFFIX = '.boxstore'
+PREAMBLE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('directory', '<u4')])
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def pack_strings(strings):
+    """ (uint8 utf-8 blob, int64 offsets) of a list of strings; string ``i`` is ``blob[offsets[i]:offsets[i + 1]]``. """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class StringTable:
+    """ A read-only list of strings over a packed blob, decoded one at a time on access. """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def tolist(self):
+        text = bytes(self.blob)
+        offsets = self.offsets.tolist()
+        return [text[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def write_sections(path, sections, meta=None):
+    """
+    Write named arrays, and lists of strings as string tables, to a store file.
+
+    The file is written next to ``path`` and moved over it when complete, so a reader never maps half a file.
+    """
+    arrays = OrderedDict()
+    kinds = OrderedDict()
+    for name, value in sections.items():
+        if isinstance(value, list):
+            arrays[name], arrays[name + '.offsets'] = pack_strings(value)
+            kinds[name] = 'strings'
+        else:
+            arrays[name] = np.ascontiguousarray(value)
+            kinds[name] = 'array'
+
+    entries = []
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        entries.append(OrderedDict([('name', name),
+                                    ('kind', kinds.get(name, 'offsets')),
+                                    ('descr', np.lib.format.dtype_to_descr(array.dtype)),
+                                    ('shape', list(array.shape)),
+                                    ('offset', offset)]))
+        offset += array.nbytes
+    directory = json.dumps(OrderedDict([('meta', meta or {}), ('sections', entries)])).encode('utf-8')
+    data_start = _aligned(PREAMBLE.itemsize + len(directory))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(np.array((MAGIC, STORE_VERSION, len(directory)), dtype=PREAMBLE).tobytes())
+        f.write(directory)
+        for entry, array in zip(entries, arrays.values()):
+            f.write(b'\0' * (data_start + entry['offset'] - f.tell()))
+            f.write(array.reshape(-1).view(np.uint8).data)
+    os.replace(tmp_path, path)
+    return data_start + offset
+
+
+class StoreFile:
+    """
+    A store file mapped into memory; ``sections`` are numpy views straight into the mapping, nothing is read up front.
+
+    The mapping is copy-on-write: arrays can be changed in place, e.g. by a coordinate transform, without the file
+    changing. String sections come back as StringTables.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            preamble = np.frombuffer(f.read(PREAMBLE.itemsize), dtype=PREAMBLE)
+            if len(preamble) != 1 or preamble['magic'][0] != MAGIC:
+                raise ValueError(f'{path} is not an annotation store')
+            if preamble['version'][0] != STORE_VERSION:
+                raise ValueError(f"{path} is a version {preamble['version'][0]} store, expected {STORE_VERSION}")
+            directory = json.loads(f.read(int(preamble['directory'][0])).decode('utf-8'))
+        data_start = _aligned(PREAMBLE.itemsize + int(preamble['directory'][0]))
+        self.meta = directory['meta']
+        self._map = np.memmap(path, dtype=np.uint8, mode='c')
+
+        arrays = OrderedDict()
+        for entry in directory['sections']:
+            dtype = np.lib.format.descr_to_dtype(entry['descr'])
+            shape = tuple(entry['shape'])
+            start = data_start + entry['offset']
+            size = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+            arrays[entry['name']] = (entry['kind'], self._map[start:start + size].view(dtype).reshape(shape))
+        self.sections = OrderedDict()
+        for name, (kind, array) in arrays.items():
+            if kind == 'strings':
+                self.sections[name] = StringTable(array, arrays[name + '.offsets'][1])
+            elif kind == 'array':
+                self.sections[name] = array
+
+    def nbytes(self):
+        return len(self._map)
+
+
+def write_store(path, table, source_sizes=None, source_mtimes=None, meta=None):
+    """
+    Write a box_table.BoxTable to an annotation store, to be mapped back by box_table.open_store.
+
+    Besides the boxes and polygons, every image keeps its filename, size, source file and, when given, the size and
+    mtime (in ns) its source had when it was read, so a reader can tell whether the store is still current.
+    """
+    n_images = len(table.images)
+    width, height = table.image_sizes()
+    sections = OrderedDict([('class_names', list(table.classes.names)),
+                            ('filenames', [h.filename or '' for h in table.images]),
+                            ('sources', [h.source or '' for h in table.images]),
+                            ('widths', width),
+                            ('heights', height),
+                            ('source_sizes', np.zeros(n_images, dtype=np.int64) if source_sizes is None
+                             else np.asarray(source_sizes, dtype=np.int64)),
+                            ('source_mtimes', np.zeros(n_images, dtype=np.int64) if source_mtimes is None
+                             else np.asarray(source_mtimes, dtype=np.int64)),
+                            ('image_offsets', table.image_offsets().astype(np.int64)),
+                            ('boxes', table.boxes),
+                            ('polygon_rows', table.polygon_rows),
+                            ('polygon_offsets', table.polygon_offsets),
+                            ('vertices', table.vertices)])
+    return write_sections(path, sections, meta)
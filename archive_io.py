@@ -0,0 +1,124 @@
+import io
+import os
+import re
+import shutil
+import tarfile
+import time
+import zipfile
+
+# Files inside an archive are referred to as archive!member, like jar: urls.
+ARCHIVE_SEPARATOR = '!'
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+TAR_WRITE_MODES = {'.tar': 'w', '.tar.gz': 'w:gz', '.tgz': 'w:gz', '.tar.bz2': 'w:bz2', '.tbz2': 'w:bz2',
+                   '.tar.xz': 'w:xz', '.txz': 'w:xz'}
+
+_MEMBER_PATH = re.compile(r'^(.*?(?:' + '|'.join(re.escape(suffix) for suffix in ARCHIVE_SUFFIXES) + '))'
+                          + re.escape(ARCHIVE_SEPARATOR) + '(.+)$', re.IGNORECASE)
+
+
+def is_archive(path):
+    """ Whether ``path`` is an existing zip or tar file (compressed or not). """
+    if not os.path.isfile(path):
+        return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def is_archive_name(path):
+    """ Whether ``path`` is named like an archive, for outputs that don't exist yet. """
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def member_path(archive, name):
+    return archive + ARCHIVE_SEPARATOR + name
+
+
+def split_member_path(path):
+    """ (archive, member) of an archive!member path, or (None, path) for a plain one. """
+    match = _MEMBER_PATH.match(path)
+    if match is None:
+        return None, path
+    return match.group(1), match.group(2)
+
+
+def file_name(path):
+    """ The name of a file, also when it is an archive!member path. """
+    return os.path.basename(split_member_path(path)[1])
+
+
+def iter_members(path, suffixes=None):
+    """
+    (member name, binary file object) of every regular file of a zip or tar, in archive order.
+
+    Tars are read as a stream, so each file object is only valid until the next member is asked for; reading part of
+    one (e.g. an image header) skips the rest without decompressing it into memory. ``suffixes`` filters by name.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _wanted(info.filename, suffixes):
+                    continue
+                with archive.open(info) as f:
+                    yield info.filename, f
+    else:
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if not member.isfile() or not _wanted(member.name, suffixes):
+                    continue
+                yield member.name, archive.extractfile(member)
+
+
+def _wanted(name, suffixes):
+    return suffixes is None or name.endswith(tuple(suffixes))
+
+
+class ArchiveWriter:
+    """ Writes files one after another into a new zip or tar, compressed as the extension of ``path`` says. """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+            self.tar = None
+        else:
+            mode = next((mode for suffix, mode in TAR_WRITE_MODES.items() if lower.endswith(suffix)), 'w')
+            self.zip = None
+            self.tar = tarfile.open(path, mode)
+
+    def add(self, name, data):
+        """ Add ``data`` (bytes or str) as member ``name``. """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.zip is not None:
+            self.zip.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+        self.count += 1
+
+    def add_file(self, name, path):
+        """ Add the file at ``path`` as member ``name``, copied in chunks. """
+        if self.zip is not None:
+            with open(path, 'rb') as source, self.zip.open(name, 'w') as target:
+                shutil.copyfileobj(source, target)
+        else:
+            self.tar.add(path, arcname=name)
+        self.count += 1
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        else:
+            self.tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
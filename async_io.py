@@ -0,0 +1,132 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiofiles
+except ImportError:
+    aiofiles = None
+
+# Reads kept in flight at once; network storage wants many, a local SSD is saturated by a few.
+DEFAULT_CONCURRENCY = 32
+# Reads done but not yet taken by the consumer, on top of the ones in flight. Bounds memory when parsing lags.
+DEFAULT_PREFETCH = 256
+
+_DONE = object()
+
+
+def read_file(path, limit=None):
+    """ The bytes of ``path``, or only its first ``limit`` bytes; None when it can't be read. """
+    try:
+        with open(path, 'rb') as f:
+            return f.read() if limit is None else f.read(limit)
+    except OSError:
+        return None
+
+
+def read_job_sync(job):
+    return tuple(read_file(path, limit) if path is not None else None for path, limit in job)
+
+
+async def _read_aiofiles(path, limit=None):
+    if path is None:
+        return None
+    try:
+        async with aiofiles.open(path, 'rb') as f:
+            return await (f.read() if limit is None else f.read(limit))
+    except OSError:
+        return None
+
+
+def iter_reads(jobs, concurrency=DEFAULT_CONCURRENCY, prefetch=DEFAULT_PREFETCH):
+    """
+    Read files ahead of the consumer on an asyncio loop and yield them in the order of ``jobs``.
+
+    Every job is a tuple of ``(path, limit)`` reads (path None for nothing, limit None for the whole file) and
+    comes back as a tuple with the bytes of each, None where a file was missing or unreadable. Up to ``concurrency``
+    jobs are read at once, through aiofiles when it is installed and a thread pool otherwise, and at most ``prefetch``
+    finished jobs wait for the consumer before reading pauses. The loop runs on its own thread, so parsing in the
+    caller overlaps with the reads even on a single core: the threads mostly wait on storage.
+    """
+    results = queue.Queue()
+    # (loop, asyncio.Semaphore) of the reads, set by the loop before it hands over anything.
+    window = []
+    stop = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            asyncio.run(_read_all(jobs, results, window, stop, concurrency, prefetch))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            results.put(_DONE)
+
+    def release():
+        if window:
+            loop, semaphore = window[0]
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                # The loop has finished every read and is closed.
+                pass
+
+    thread = threading.Thread(target=run, name='async-reads', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            release()
+            yield item
+    finally:
+        # The consumer may stop early; let the loop finish the reads it started and exit.
+        stop.set()
+        release()
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+async def _read_all(jobs, results, window, stop, concurrency, prefetch):
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore(concurrency)
+    # Released from the consumer's thread for every result it takes.
+    unclaimed = asyncio.Semaphore(concurrency + prefetch)
+    window.append((loop, unclaimed))
+    executor = None if aiofiles is not None else ThreadPoolExecutor(max_workers=concurrency)
+
+    async def read_job(job):
+        async with in_flight:
+            if executor is not None:
+                # One hop to the pool per job, not per file: the hand-over costs more than a cached read.
+                return await loop.run_in_executor(executor, read_job_sync, job)
+            return tuple(await asyncio.gather(*(_read_aiofiles(path, limit) for path, limit in job)))
+
+    # Tasks are handed over in job order, whatever order their reads finish in.
+    pending = asyncio.Queue()
+
+    async def deliver():
+        while True:
+            task = await pending.get()
+            if task is None:
+                return
+            results.put(await task)
+
+    deliverer = asyncio.ensure_future(deliver())
+    try:
+        for job in jobs:
+            if stop.is_set():
+                break
+            # Backpressure: wait for the consumer to take a result before starting more reads.
+            await unclaimed.acquire()
+            if stop.is_set():
+                break
+            await pending.put(asyncio.ensure_future(read_job(job)))
+        await pending.put(None)
+        await deliverer
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
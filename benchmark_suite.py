@@ -0,0 +1,453 @@
+import argparse
+import atexit
+import contextlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timezone
+
+from synthetic_dataset import SCALES
+from synthetic_dataset import corpus_dirs
+from synthetic_dataset import generate
+from validation_report import peak_rss
+
+RESULTS_FILE = 'benchmark_results.jsonl'
+VALIDATOR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validation_bol_cogito (1).py')
+# Slower than the baseline by more than this share is a regression...
+DEFAULT_THRESHOLD = 0.10
+# ...unless the stage got slower by less than this many seconds, which is noise on small corpora.
+MIN_REGRESSION_S = 0.05
+
+
+def _validator():
+    """ The BOL validator script; its file name is not importable as a module. """
+    spec = importlib.util.spec_from_file_location('validation_bol_cogito', VALIDATOR_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _files(path, suffix):
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(suffix))
+
+
+# Stages: each gets the corpus paths and an empty work directory, runs one step of a pipeline and returns
+# (files, items) it went through. Anything they need but don't measure is done in a setup function first.
+
+def bench_scan(paths, work_dir, setup):
+    from validation_engine import scan_dataset
+    pairs = scan_dataset(paths['bol'], paths['bol'])
+    return len(pairs), len(pairs)
+
+
+def bench_index_build(paths, work_dir, setup):
+    from dataset_index import DatasetIndex
+    index = DatasetIndex(os.path.join(work_dir, 'index.db'), paths['bol'], paths['bol'])
+    index.refresh()
+    index.count_pending()
+    index.close()
+    return len(index.images) + len(index.xmls), len(index.xmls)
+
+
+def bench_parse_voc(paths, work_dir, setup):
+    from voc_reader import read_voc
+    n_boxes = 0
+    for file in setup:
+        n_boxes += len(read_voc(file).boxes)
+    return len(setup), n_boxes
+
+
+def bench_probe_images(paths, work_dir, setup):
+    from image_probe import probe_image_size
+    for file in setup:
+        probe_image_size(file)
+    return len(setup), len(setup)
+
+
+def _check(paths, work_dir, setup, workers, io_concurrency=None):
+    from validation_engine import run_rules
+    pairs, rules = setup
+    run_rules(pairs, rules, workers=workers, io_concurrency=io_concurrency)
+    return len(pairs), len(pairs)
+
+
+def bench_check_rules(paths, work_dir, setup):
+    return _check(paths, work_dir, setup, workers=1)
+
+
+def bench_check_rules_workers(paths, work_dir, setup):
+    return _check(paths, work_dir, setup, workers=os.cpu_count() or 1)
+
+
+def bench_check_rules_async(paths, work_dir, setup):
+    return _check(paths, work_dir, setup, workers=1, io_concurrency=32)
+
+
+def bench_check_vectorized(paths, work_dir, setup):
+    from vectorized_checks import run_vectorized
+    pairs, rules = setup
+    run_vectorized(pairs, rules)
+    return len(pairs), len(pairs)
+
+
+def _triage(paths, work_dir, setup, mode):
+    from triage_output import TriageOutput
+    from validation_engine import write_findings
+    pairs, rules, findings = setup
+    output = TriageOutput(mode=mode, threads=4)
+    write_findings(pairs, rules, findings, work_dir, output=output)
+    return output.linked + output.copied, output.linked + output.copied
+
+
+def bench_triage_copy(paths, work_dir, setup):
+    return _triage(paths, work_dir, setup, 'copy')
+
+
+def bench_triage_hardlink(paths, work_dir, setup):
+    return _triage(paths, work_dir, setup, 'hardlink')
+
+
+def bench_fruit_parse(paths, work_dir, setup):
+    return bench_parse_voc(paths, work_dir, setup)
+
+
+def bench_fruit_data22(paths, work_dir, setup):
+    import data22
+    n_boxes = 0
+    for file in setup:
+        n_boxes += data22.convert(file, os.path.join(work_dir, os.path.basename(file) + '.json'))
+    return len(setup), n_boxes
+
+
+def bench_fruit_duplicates(paths, work_dir, setup):
+    from box_overlap import table_duplicates
+    from box_table import load_voc
+    table = load_voc(paths['fruit'])
+    table_duplicates(table)
+    return len(table.images), len(table.boxes)
+
+
+def bench_rescale_table(paths, work_dir, setup):
+    from box_table import load_voc
+    from coordinate_transforms import CoordinateTransform
+    table = load_voc(paths['bol'])
+    CoordinateTransform(target_size=(1024, 1024), clip=True, rounding='outward').apply_table(table)
+    return len(table.images), len(table.boxes)
+
+
+def bench_rescale_export(paths, work_dir, setup):
+    from annotation_formats import convert
+    from coordinate_transforms import CoordinateTransform
+    transform = CoordinateTransform(target_size=(1024, 1024), clip=True, rounding='outward')
+    n_converted = convert(paths['labelme'], 'labelme', work_dir, 'labelme', transform=transform)
+    return n_converted, n_converted
+
+
+def bench_voc_to_annotate_online(paths, work_dir, setup):
+    from voc_to_annotate_online import convert
+    n_converted, _ = convert(paths['bol'], work_dir, workers=os.cpu_count() or 1)
+    return n_converted, n_converted
+
+
+def bench_box_table_load(paths, work_dir, setup):
+    from box_table import load_voc
+    table = load_voc(paths['bol'])
+    return len(table.images), len(table.boxes)
+
+
+def bench_store_write(paths, work_dir, setup):
+    from annotation_store import write_store
+    write_store(os.path.join(work_dir, 'bol.boxstore'), setup)
+    return len(setup.images), len(setup.boxes)
+
+
+def bench_store_open(paths, work_dir, setup):
+    import numpy as np
+    from box_table import open_store
+    table = open_store(setup)
+    # Counting the classes reads every box, so the pages of the mapping are really loaded.
+    n_boxes = int(np.bincount(table.boxes['class_id']).sum())
+    return len(table.images), n_boxes
+
+
+def bench_dataloop_read(paths, work_dir, setup):
+    from annotation_formats import read_dataloop
+    n_items = 0
+    for _ in read_dataloop(paths['dataloop']):
+        n_items += 1
+    return 1, n_items
+
+
+def bench_dataloop_to_labelme(paths, work_dir, setup):
+    from annotation_formats import convert
+    return 1, convert(paths['dataloop'], 'dataloop', work_dir, 'labelme')
+
+
+def bench_labelme_to_dataloop(paths, work_dir, setup):
+    from annotation_formats import convert
+    n_converted = convert(paths['labelme'], 'labelme', work_dir, 'dataloop', single_file=True)
+    return n_converted, n_converted
+
+
+def setup_bol_xmls(paths):
+    return _files(paths['bol'], '.xml')
+
+
+def setup_bol_images(paths):
+    return _files(paths['bol'], '.jpg')
+
+
+def setup_fruit_xmls(paths):
+    return _files(paths['fruit'], '.xml')
+
+
+def setup_bol_table(paths):
+    from box_table import load_voc
+    return load_voc(paths['bol'])
+
+
+def setup_bol_store(paths):
+    from annotation_store import write_store
+    store_dir = tempfile.mkdtemp(prefix='benchmark_store_')
+    atexit.register(shutil.rmtree, store_dir, True)
+    path = os.path.join(store_dir, 'bol.boxstore')
+    write_store(path, setup_bol_table(paths))
+    return path
+
+
+def setup_check(paths):
+    from validation_engine import scan_dataset
+    return scan_dataset(paths['bol'], paths['bol']), _validator().bol_rules()
+
+
+def setup_triage(paths):
+    from validation_engine import run_rules
+    pairs, rules = setup_check(paths)
+    return pairs, rules, run_rules(pairs, rules)
+
+
+# name: (setup, stage)
+STAGES = OrderedDict([('scan', (None, bench_scan)),
+                      ('index_build', (None, bench_index_build)),
+                      ('parse_voc', (setup_bol_xmls, bench_parse_voc)),
+                      ('probe_images', (setup_bol_images, bench_probe_images)),
+                      ('check_rules', (setup_check, bench_check_rules)),
+                      ('check_rules_workers', (setup_check, bench_check_rules_workers)),
+                      ('check_rules_async', (setup_check, bench_check_rules_async)),
+                      ('check_vectorized', (setup_check, bench_check_vectorized)),
+                      ('triage_copy', (setup_triage, bench_triage_copy)),
+                      ('triage_hardlink', (setup_triage, bench_triage_hardlink)),
+                      ('box_table_load', (None, bench_box_table_load)),
+                      ('store_write', (setup_bol_table, bench_store_write)),
+                      ('store_open', (setup_bol_store, bench_store_open)),
+                      ('fruit_parse', (setup_fruit_xmls, bench_fruit_parse)),
+                      ('fruit_data22', (setup_fruit_xmls, bench_fruit_data22)),
+                      ('fruit_duplicates', (None, bench_fruit_duplicates)),
+                      ('rescale_table', (None, bench_rescale_table)),
+                      ('rescale_export', (None, bench_rescale_export)),
+                      ('voc_to_annotate_online', (None, bench_voc_to_annotate_online)),
+                      ('dataloop_read', (None, bench_dataloop_read)),
+                      ('dataloop_to_labelme', (None, bench_dataloop_to_labelme)),
+                      ('labelme_to_dataloop', (None, bench_labelme_to_dataloop))])
+
+
+def run_stage(name, data_dir, work_dir):
+    """ Run one stage in this process and return its measurements; meant for a fresh process per stage. """
+    setup, stage = STAGES[name]
+    paths = corpus_dirs(data_dir)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        prepared = setup(paths) if setup is not None else None
+        rss_before, _ = peak_rss()
+        times = os.times()
+        start = time.perf_counter()
+        files, items = stage(paths, work_dir, prepared)
+        wall = time.perf_counter() - start
+        end_times = os.times()
+    cpu = sum(end_times[:4]) - sum(times[:4])
+    self_rss, children_rss = peak_rss()
+    return OrderedDict([('wall_s', round(wall, 6)),
+                        ('cpu_s', round(cpu, 6)),
+                        ('files', files),
+                        ('items', items),
+                        ('files_per_s', round(files / wall, 1) if wall else None),
+                        ('items_per_s', round(items / wall, 1) if wall else None),
+                        ('peak_rss_bytes', self_rss),
+                        ('setup_rss_bytes', rss_before),
+                        ('peak_rss_workers_bytes', children_rss)])
+
+
+def measure(name, data_dir, repeat=1):
+    """ Run a stage ``repeat`` times, each in a new process with an empty work directory, and keep the fastest. """
+    best = None
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix=f'benchmark_{name}_')
+        try:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run_stage', name, '--data',
+                                     data_dir, '--work_dir', work_dir],
+                                    check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        result = json.loads(output.strip().splitlines()[-1], object_pairs_hook=OrderedDict)
+        if best is None or result['wall_s'] < best['wall_s']:
+            best = result
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line, object_pairs_hook=OrderedDict) for line in f if line.strip()]
+
+
+def find_baseline(results, run, baseline=None):
+    """ The run ``baseline`` names (a run id or label), or else the latest earlier run on a corpus of the same size. """
+    for previous in reversed(results):
+        if previous['run_id'] == run['run_id']:
+            continue
+        if baseline is not None:
+            if baseline in (previous['run_id'], previous.get('label')):
+                return previous
+        elif previous['scale'] == run['scale']:
+            return previous
+    return None
+
+
+def compare(run, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Print every stage against ``baseline`` and return the names of the stages that regressed. """
+    print(f'Compared to run {baseline["run_id"]} ({baseline.get("label") or baseline["commit"]}, '
+          f'{baseline["started"]}):')
+    regressions = []
+    for name, result in run['stages'].items():
+        old = baseline['stages'].get(name)
+        if old is None:
+            print(f'  {name:<24} {result["wall_s"]:>9.3f}s  (new stage)')
+            continue
+        change = result['wall_s'] / old['wall_s'] - 1 if old['wall_s'] else 0.0
+        slower = result['wall_s'] - old['wall_s'] > MIN_REGRESSION_S and change > threshold
+        rss_change = (result['peak_rss_bytes'] / old['peak_rss_bytes'] - 1
+                      if result.get('peak_rss_bytes') and old.get('peak_rss_bytes') else 0.0)
+        bigger = rss_change > threshold
+        if slower or bigger:
+            regressions.append(name)
+        print(f'  {name:<24} {old["wall_s"]:>9.3f}s -> {result["wall_s"]:>9.3f}s {change:+7.1%}  '
+              f'rss {rss_change:+7.1%}{"  REGRESSION" if slower or bigger else ""}')
+    return regressions
+
+
+def run_suite(data_dir, stages, repeat=1, label=None):
+    with open(os.path.join(data_dir, 'synthetic_dataset.json')) as f:
+        dataset = json.load(f)
+    run = OrderedDict([('run_id', uuid.uuid4().hex[:12]),
+                       ('started', datetime.now(timezone.utc).isoformat()),
+                       ('commit', git_commit()),
+                       ('label', label),
+                       ('scale', dataset['scale']),
+                       ('seed', dataset['seed']),
+                       ('python', sys.version.split()[0]),
+                       ('cpus', os.cpu_count()),
+                       ('stages', OrderedDict())])
+    for name in stages:
+        result = measure(name, data_dir, repeat)
+        run['stages'][name] = result
+        print(f'{name:<24} {result["wall_s"]:>9.3f}s  {result["files_per_s"] or 0:>12.1f} files/s  '
+              f'{result["items_per_s"] or 0:>12.1f} items/s  peak {(result["peak_rss_bytes"] or 0) / 2 ** 20:>8.1f} MiB')
+    return run
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Time every validation and conversion stage on synthetic corpora '
+                                                 'and catch regressions against earlier runs.')
+    parser.add_argument('--data',
+                        action='store',
+                        help='Directory with the synthetic corpora; generated there first if it has none.',
+                        required=True)
+    parser.add_argument('--scale',
+                        action='store',
+                        help=f'Corpus size to generate: one of {", ".join(SCALES)} or a number of files.',
+                        default='1k')
+    parser.add_argument('--stages',
+                        action='store',
+                        nargs='+',
+                        choices=list(STAGES),
+                        help='Stages to run, all by default.',
+                        default=list(STAGES))
+    parser.add_argument('--repeat',
+                        action='store',
+                        type=int,
+                        help='Run every stage this many times and keep the fastest.',
+                        default=1)
+    parser.add_argument('--results',
+                        action='store',
+                        help='Jsonl file every run is appended to.',
+                        default=RESULTS_FILE)
+    parser.add_argument('--label',
+                        action='store',
+                        help='Name for this run, e.g. a branch, to compare against later.',
+                        default=None)
+    parser.add_argument('--compare',
+                        action='store_true',
+                        help='Compare with the previous run on the same scale (or --baseline) and exit with 1 on '
+                             'a regression.')
+    parser.add_argument('--baseline',
+                        action='store',
+                        help='Run id or label to compare with.',
+                        default=None)
+    parser.add_argument('--threshold',
+                        action='store',
+                        type=float,
+                        help='Share a stage may get slower or bigger before it counts as a regression.',
+                        default=DEFAULT_THRESHOLD)
+    parser.add_argument('--run_stage',
+                        action='store',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--work_dir',
+                        action='store',
+                        help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.run_stage:
+        print(json.dumps(run_stage(args.run_stage, args.data, args.work_dir)))
+        return
+
+    if not os.path.isfile(os.path.join(args.data, 'synthetic_dataset.json')):
+        print(f'Generating the {args.scale} corpora in {args.data}')
+        generate(args.data, args.scale)
+
+    run = run_suite(args.data, args.stages, repeat=args.repeat, label=args.label)
+    results = load_results(args.results)
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+    print(f'Run {run["run_id"]} appended to {args.results}')
+
+    if args.compare or args.baseline:
+        baseline = find_baseline(results, run, args.baseline)
+        if baseline is None:
+            print('No earlier run to compare with.')
+            return
+        regressions = compare(run, baseline, args.threshold)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
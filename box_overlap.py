@@ -0,0 +1,176 @@
+import argparse
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from box_table import load
+
+# Boxes of the same class overlapping more than this are taken for one object annotated twice.
+DEFAULT_IOU = 0.9
+
+
+def iou(a, b):
+    """ Intersection over union of the rows of two (N, 4) x1, y1, x2, y2 arrays; 0 where the union is empty. """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    inter_w = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = np.clip(a[:, 2] - a[:, 0], 0, None) * np.clip(a[:, 3] - a[:, 1], 0, None)
+    area_b = np.clip(b[:, 2] - b[:, 0], 0, None) * np.clip(b[:, 3] - b[:, 1], 0, None)
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0.0)
+
+
+def duplicate_pairs(coords, groups, iou_threshold=DEFAULT_IOU, block=1 << 20):
+    """
+    Pairs of boxes of the same group (image and class) whose IoU is above ``iou_threshold``.
+
+    A sort and sweep instead of all pairs: boxes are sorted by group and x1, and a box is only compared with the ones
+    after it whose x1 is close enough for the IoU to still pass. For an IoU of t with box i (width w), the intersection
+    must be at least t times i's area, so a box j starting at or after x1_i has to start before x1_i + (1 - t) * w. With
+    the usual thresholds that window holds a handful of boxes, even in images with hundreds of overlapping ones, and at
+    most ``block`` candidate pairs are held in memory at a time.
+
+    Returns (first, second, iou) arrays with first < second, row indices into ``coords``.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 4)
+    groups = np.asarray(groups, dtype=np.int64)
+    n_boxes = len(coords)
+    if n_boxes < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    x1 = coords[:, 0]
+    width = np.clip(coords[:, 2] - x1, 0, None)
+    order = np.lexsort((x1, groups))
+    sorted_x1 = x1[order]
+    sorted_groups = groups[order]
+    # Groups are laid out one after another along x, so one searchsorted sweeps all of them.
+    group_rank = np.concatenate([[0], np.cumsum(sorted_groups[1:] != sorted_groups[:-1])])
+    span = sorted_x1.max() - sorted_x1.min() + width.max() + 1
+    key = group_rank * span + (sorted_x1 - sorted_x1.min())
+    end = np.searchsorted(key, key + (1 - iou_threshold) * width[order], side='right')
+    counts = end - np.arange(n_boxes) - 1
+    total = np.cumsum(counts)
+
+    first, second, overlaps = [], [], []
+    start = 0
+    while start < n_boxes:
+        done = total[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(total, done + block, side='right')))
+        chunk = counts[start:stop]
+        i = np.repeat(np.arange(start, stop), chunk)
+        j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(chunk) - chunk, chunk)
+        a = order[i]
+        b = order[j]
+        pair_iou = iou(coords[a], coords[b])
+        hit = pair_iou > iou_threshold
+        first.append(np.minimum(a, b)[hit])
+        second.append(np.maximum(a, b)[hit])
+        overlaps.append(pair_iou[hit])
+        start = stop
+    return np.concatenate(first), np.concatenate(second), np.concatenate(overlaps)
+
+
+def duplicate_rows(coords, groups, iou_threshold=DEFAULT_IOU):
+    """ Bool mask of the boxes that duplicate an earlier box of their group; the first of every cluster is kept. """
+    mask = np.zeros(len(groups), dtype=bool)
+    mask[duplicate_pairs(coords, groups, iou_threshold)[1]] = True
+    return mask
+
+
+def table_duplicates(table, iou_threshold=DEFAULT_IOU):
+    """ duplicate_rows over a whole BoxTable, boxes grouped by image and class. """
+    boxes = table.boxes
+    groups = boxes['image_idx'].astype(np.int64) * max(len(table.classes), 1) + boxes['class_id']
+    return duplicate_rows(table.coords(), groups, iou_threshold)
+
+
+def duplicate_rates(table, iou_threshold=DEFAULT_IOU):
+    """ {class: (boxes, duplicates)} over a BoxTable, and the number of duplicates of every image. """
+    boxes = table.boxes
+    duplicates = table_duplicates(table, iou_threshold)
+    n_classes = len(table.classes)
+    n_boxes = np.bincount(boxes['class_id'], minlength=n_classes)
+    n_duplicates = np.bincount(boxes['class_id'][duplicates], minlength=n_classes)
+    rates = OrderedDict((name, (int(n_boxes[i]), int(n_duplicates[i]))) for i, name in enumerate(table.classes.names))
+    per_image = np.bincount(boxes['image_idx'][duplicates], minlength=len(table.images))
+    return rates, per_image
+
+
+def random_boxes(n_images, n_boxes, duplicate_rate, seed=0, size=4000):
+    """ (coords, groups) of crowded images with a share of jittered copies, like stacked fruit boxes. """
+    rng = np.random.default_rng(seed)
+    n = n_images * n_boxes
+    x1 = rng.uniform(0, size, n)
+    y1 = rng.uniform(0, size, n)
+    side = rng.uniform(40, 120, n)
+    coords = np.stack([x1, y1, x1 + side, y1 + side], axis=1)
+    copies = rng.random(n) < duplicate_rate
+    source = rng.integers(0, n_boxes, n) + np.repeat(np.arange(n_images) * n_boxes, n_boxes)
+    coords[copies] = coords[source[copies]] + rng.uniform(-1, 1, (copies.sum(), 4))
+    return coords, np.repeat(np.arange(n_images), n_boxes)
+
+
+def benchmark(n_images, n_boxes, iou_threshold):
+    """ Boxes per second of the sweep, checked against all pairs on the first image. """
+    coords, groups = random_boxes(n_images, n_boxes, duplicate_rate=0.05)
+    start = time.perf_counter()
+    first, second, _ = duplicate_pairs(coords, groups, iou_threshold)
+    elapsed = time.perf_counter() - start
+    print(f'sweep: {len(coords) / elapsed / 1e6:.2f} M boxes/s, {len(first)} duplicate pairs')
+
+    start = time.perf_counter()
+    i, j = np.triu_indices(n_boxes, k=1)
+    naive = iou(coords[i], coords[j]) > iou_threshold
+    elapsed = time.perf_counter() - start
+    print(f'all pairs: {n_boxes / elapsed / 1e6:.4f} M boxes/s on one image of {n_boxes} boxes')
+    in_first = second < n_boxes
+    assert set(zip(first[in_first].tolist(), second[in_first].tolist())) == set(zip(i[naive].tolist(),
+                                                                                       j[naive].tolist()))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Duplicate box rates of a dataset, or a benchmark of the sweep.')
+    parser.add_argument('--input',
+                        action='store',
+                        help='A file or directory of annotations. Without it, random boxes are benchmarked.',
+                        default=None)
+    parser.add_argument('--format',
+                        action='store',
+                        help='Annotation format of --input, as annotation_formats names it.',
+                        default='voc')
+    parser.add_argument('--iou',
+                        action='store',
+                        type=float,
+                        help='Boxes of one class with an IoU above this are duplicates.',
+                        default=DEFAULT_IOU)
+    parser.add_argument('--images',
+                        action='store',
+                        type=int,
+                        help='Number of random images to benchmark.',
+                        default=1000)
+    parser.add_argument('--boxes',
+                        action='store',
+                        type=int,
+                        help='Boxes per random image.',
+                        default=500)
+
+    args = parser.parse_args()
+    if args.input is None:
+        benchmark(args.images, args.boxes, args.iou)
+        return
+    table = load(args.input, args.format)
+    rates, per_image = duplicate_rates(table, args.iou)
+    for name, (n_boxes, n_duplicates) in rates.items():
+        print(f'{name}: {n_duplicates} duplicates in {n_boxes} boxes ({n_duplicates / max(n_boxes, 1):.2%})')
+    flagged = np.flatnonzero(per_image)
+    print(f'{len(flagged)} of {len(table.images)} images have duplicate boxes')
+    for image_idx in flagged[np.argsort(-per_image[flagged], kind='stable')][:10]:
+        print(f'  {table.images[image_idx].filename}: {per_image[image_idx]}')
+
+
+if __name__ == "__main__":
+    main()
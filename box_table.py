@@ -0,0 +1,260 @@
+import argparse
+import time
+
+import numpy as np
+
+from annotation_formats import READERS
+from annotation_store import BOX_DTYPE
+from annotation_store import FLAG_POLYGON
+from annotation_store import StoreFile
+from annotation_store import write_store
+from voc_reader import ClassTable
+
+
+class ImageHeader:
+    """ Per-image fields of a BoxTable; the boxes themselves live in the shared arrays. """
+
+    __slots__ = ('filename', 'width', 'height', 'source')
+
+    def __init__(self, filename, width=None, height=None, source=None):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.source = source
+
+
+class StoreImages:
+    """ The ImageHeaders of a table opened from an annotation store, made on access from the mapped sections. """
+
+    def __init__(self, store):
+        self.filenames = store.sections['filenames']
+        self.sources = store.sections['sources']
+        self.widths = store.sections['widths']
+        self.heights = store.sections['heights']
+
+    def __len__(self):
+        return len(self.widths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        width = int(self.widths[i])
+        height = int(self.heights[i])
+        return ImageHeader(self.filenames[i], width if width >= 0 else None, height if height >= 0 else None,
+                           self.sources[i] or None)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def append(self, header):
+        raise TypeError('A table opened from an annotation store is read-only; load it into a new BoxTable instead')
+
+    def sizes(self):
+        return np.array(self.widths), np.array(self.heights)
+
+
+class BoxTable:
+    """
+    A whole dataset of boxes in a few flat arrays.
+
+    ``boxes`` is a BOX_DTYPE structured array (25 bytes per box) ordered by image, ``images`` holds one ImageHeader per
+    image and ``classes`` interns the class names. Polygons keep their float32 vertices in ``vertices``; polygon ``i``
+    belongs to box row ``polygon_rows[i]`` and spans ``vertices[polygon_offsets[i]:polygon_offsets[i + 1]]``.
+    """
+
+    def __init__(self, classes=None):
+        self.classes = classes if classes is not None else ClassTable()
+        self.images = []
+        self._n_boxes = 0
+        self._box_chunks = []
+        self._boxes = np.zeros(0, dtype=BOX_DTYPE)
+        self._vertex_chunks = []
+        self._vertices = np.zeros((0, 2), dtype=np.float32)
+        self._polygon_rows = []
+        self._polygon_lengths = []
+
+    def add_image(self, filename, width=None, height=None, class_ids=(), coords=(), flags=None, polygons=None,
+                  source=None):
+        """
+        Append one image and all of its boxes.
+
+        ``coords`` is an (N, 4) array of x1, y1, x2, y2. ``polygons`` maps the index of a box within this image to the
+        (K, 2) vertices it was derived from.
+        """
+        image_idx = len(self.images)
+        self.images.append(ImageHeader(filename, width, height, source))
+
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 4)
+        rows = np.zeros(len(coords), dtype=BOX_DTYPE)
+        rows['image_idx'] = image_idx
+        rows['class_id'] = class_ids
+        rows['x1'] = coords[:, 0]
+        rows['y1'] = coords[:, 1]
+        rows['x2'] = coords[:, 2]
+        rows['y2'] = coords[:, 3]
+        if flags is not None:
+            rows['flags'] = flags
+
+        for local_idx, vertices in (polygons or {}).items():
+            vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 2)
+            rows['flags'][local_idx] |= FLAG_POLYGON
+            self._polygon_rows.append(self._n_boxes + local_idx)
+            self._polygon_lengths.append(len(vertices))
+            self._vertex_chunks.append(vertices)
+
+        self._box_chunks.append(rows)
+        self._n_boxes += len(rows)
+        return image_idx
+
+    def _flush(self):
+        if self._box_chunks:
+            self._boxes = np.concatenate([self._boxes] + self._box_chunks)
+            self._box_chunks = []
+        if self._vertex_chunks:
+            self._vertices = np.concatenate([self._vertices] + self._vertex_chunks)
+            self._vertex_chunks = []
+
+    @property
+    def boxes(self):
+        self._flush()
+        return self._boxes
+
+    @property
+    def vertices(self):
+        self._flush()
+        return self._vertices
+
+    @property
+    def polygon_rows(self):
+        return np.array(self._polygon_rows, dtype=np.int64)
+
+    @property
+    def polygon_offsets(self):
+        return np.concatenate([[0], np.cumsum(self._polygon_lengths, dtype=np.int64)])
+
+    def __len__(self):
+        return self._n_boxes
+
+    def image_offsets(self):
+        """ Box rows of image ``i`` are ``boxes[offsets[i]:offsets[i + 1]]``. """
+        return np.searchsorted(self.boxes['image_idx'], np.arange(len(self.images) + 1))
+
+    def image_boxes(self, image_idx):
+        offsets = self.image_offsets()
+        return self.boxes[offsets[image_idx]:offsets[image_idx + 1]]
+
+    def coords(self):
+        """ (N, 4) float32 copy of x1, y1, x2, y2. """
+        boxes = self.boxes
+        return np.stack([boxes['x1'], boxes['y1'], boxes['x2'], boxes['y2']], axis=1)
+
+    def image_sizes(self):
+        """ (width, height) arrays over all images, -1 where the size is unknown. """
+        if isinstance(self.images, StoreImages):
+            return self.images.sizes()
+        width = np.array([-1 if h.width is None else h.width for h in self.images], dtype=np.int32)
+        height = np.array([-1 if h.height is None else h.height for h in self.images], dtype=np.int32)
+        return width, height
+
+    def set_image_sizes(self, width, height, first_image=0):
+        """ Set the sizes of the images from ``first_image`` on from (width, height) arrays, -1 for unknown. """
+        if isinstance(self.images, StoreImages):
+            self.images.widths[first_image:] = width
+            self.images.heights[first_image:] = height
+            return
+        for header, w, h in zip(self.images[first_image:], np.asarray(width).tolist(), np.asarray(height).tolist()):
+            header.width = int(w) if w >= 0 else None
+            header.height = int(h) if h >= 0 else None
+
+    def nbytes(self):
+        return self.boxes.nbytes + self.vertices.nbytes + 16 * len(self._polygon_rows)
+
+
+def add_annotation(table, ann, source=None):
+    """ Append one annotation_formats.ImageAnnotation; its class ids must come from ``table.classes``. """
+    return table.add_image(ann.filename, ann.width, ann.height, ann.class_ids, ann.coords, polygons=ann.polygons,
+                           source=source)
+
+
+def load(path, source_format, table=None):
+    """ Fill a BoxTable from any format annotation_formats can read. """
+    table = table if table is not None else BoxTable()
+    for ann in READERS[source_format](path, table.classes):
+        add_annotation(table, ann)
+    return table
+
+
+def load_voc(path, table=None):
+    """ Fill a BoxTable from a VOC xml file or a directory of them. """
+    return load(path, 'voc', table)
+
+
+def load_annotate_online(path, table=None):
+    """ Fill a BoxTable from annotate-online ``<image>___objects.json`` files. """
+    return load(path, 'annotate_online', table)
+
+
+def load_dataloop(path, table=None):
+    """ Fill a BoxTable from Dataloop item json: single items, a list of items, or a directory of them. """
+    return load(path, 'dataloop', table)
+
+
+def load_labelme(path, table=None):
+    """ Fill a BoxTable from LabelMe json files. """
+    return load(path, 'labelme', table)
+
+
+def open_store(path):
+    """
+    A BoxTable over an annotation store written by annotation_store.write_store, without reading or copying it.
+
+    The box, polygon and vertex arrays are views into the memory-mapped file and image headers are made on access, so
+    opening costs the same for a thousand boxes or a million. The table can't take new images, but its arrays can be
+    changed in place; the file stays as it is.
+    """
+    store = StoreFile(path)
+    sections = store.sections
+    table = BoxTable(ClassTable(sections['class_names'].tolist()))
+    table.images = StoreImages(store)
+    boxes = sections['boxes']
+    # A store written on a machine of the other byte order is converted once.
+    table._boxes = boxes if boxes.dtype == BOX_DTYPE else boxes.astype(BOX_DTYPE)
+    table._n_boxes = len(boxes)
+    table._vertices = sections['vertices'].astype(np.float32, copy=False)
+    table._polygon_rows = sections['polygon_rows']
+    table._polygon_lengths = np.diff(sections['polygon_offsets'])
+    table.store = store
+    return table
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Write a dataset to a memory-mapped annotation store, read back '
+                                                 'with open_store in milliseconds.')
+    parser.add_argument('--input',
+                        action='store',
+                        help='Input file, directory, or zip/tar(.gz) archive.',
+                        required=True)
+    parser.add_argument('--input_format',
+                        action='store',
+                        choices=sorted(READERS),
+                        required=True)
+    parser.add_argument('--store',
+                        action='store',
+                        help='The annotation store file to write.',
+                        required=True)
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+    table = load(args.input, args.input_format)
+    loaded = time.perf_counter()
+    n_bytes = write_store(args.store, table)
+    written = time.perf_counter()
+    table = open_store(args.store)
+    opened = time.perf_counter()
+    print(f'{len(table.images)} images, {len(table)} boxes: read in {loaded - start:.3f}s, {n_bytes} bytes written in '
+          f'{written - loaded:.3f}s, opened in {(opened - written) * 1000:.2f}ms')
+
+
+if __name__ == "__main__":
+    main()
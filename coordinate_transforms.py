@@ -0,0 +1,150 @@
+import numpy as np
+
+from polygon_geometry import pack
+from polygon_geometry import polygon_index
+from polygon_geometry import unpack
+
+# How coordinates end up after a transform: kept as floats, rounded to the nearest pixel, floored, ceiled, or boxes
+# grown ('outward') or shrunk ('inward') to whole pixels. Polygon vertices round to the nearest pixel for the last two.
+ROUNDING = ('float', 'nearest', 'floor', 'ceil', 'outward', 'inward')
+
+
+def parse_size(text):
+    """ (width, height) of a 'WIDTHxHEIGHT' string. """
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+class CoordinateTransform:
+    """
+    Origin flip, rescale, clipping and rounding, applied to whole box and polygon arrays at once.
+
+    The image is scaled by ``scale`` or to ``target_size`` (width, height), then the y axis is flipped between a top
+    left and a bottom left origin with ``flip_y``, coordinates are clipped to the image with ``clip`` and finally
+    rounded as ``rounding`` says. Image sizes are passed per call, as scalars for one image or one value per box for a
+    whole dataset; a size <= 0 means unknown, and coordinates of such images are neither scaled to a target size,
+    flipped nor clipped.
+    """
+
+    def __init__(self, flip_y=False, scale=None, target_size=None, clip=False, rounding='float'):
+        if rounding not in ROUNDING:
+            raise ValueError(f"Unknown rounding {rounding}, expected one of {', '.join(ROUNDING)}")
+        if scale is not None and target_size is not None:
+            raise ValueError('Give either a scale or a target size')
+        self.flip_y = flip_y
+        self.scale = scale
+        self.target_size = tuple(target_size) if target_size is not None else None
+        self.clip = clip
+        self.rounding = rounding
+
+    def is_identity(self):
+        return not self.flip_y and self.scale is None and self.target_size is None and not self.clip and \
+            self.rounding == 'float'
+
+    def sizes(self, width, height):
+        """ (x scale, y scale, new width, new height, known) for image sizes, as float64 arrays. """
+        width = np.asarray(-1 if width is None else width, dtype=np.float64)
+        height = np.asarray(-1 if height is None else height, dtype=np.float64)
+        known = (width > 0) & (height > 0)
+        if self.target_size is not None:
+            target_width, target_height = self.target_size
+            scale_x = np.where(known, target_width / np.where(known, width, 1), 1.0)
+            scale_y = np.where(known, target_height / np.where(known, height, 1), 1.0)
+            return scale_x, scale_y, np.where(known, target_width, width), np.where(known, target_height, height), known
+        scale = 1.0 if self.scale is None else float(self.scale)
+        new_width = np.where(known, np.rint(width * scale), width)
+        new_height = np.where(known, np.rint(height * scale), height)
+        return np.full(width.shape, scale), np.full(height.shape, scale), new_width, new_height, known
+
+    def apply_points(self, points, width, height):
+        """ (M, 2) float64 x, y of ``points`` after the transform; sizes are scalars or one per point. """
+        points = self._move(points, width, height)
+        if self.rounding in ('floor', 'ceil'):
+            return getattr(np, self.rounding)(points)
+        if self.rounding != 'float':
+            return np.rint(points)
+        return points
+
+    def apply_boxes(self, coords, width, height):
+        """
+        (N, 4) float64 x1, y1, x2, y2 of ``coords`` after the transform, and the new (width, height).
+
+        Sizes are scalars or one per box. Boxes stay ordered, y1 <= y2, also across the flip.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 4)
+        n_boxes = len(coords)
+        # Both corners of a box share its image size.
+        point_sizes = [np.repeat(np.broadcast_to(np.asarray(-1 if size is None else size), (n_boxes,)), 2)
+                       for size in (width, height)]
+        boxes = self._move(coords, *point_sizes).reshape(-1, 4)
+        if self.flip_y:
+            boxes[:, [1, 3]] = np.sort(boxes[:, [1, 3]], axis=1)
+        if self.rounding in ('floor', 'ceil'):
+            boxes = getattr(np, self.rounding)(boxes)
+        elif self.rounding == 'nearest':
+            boxes = np.rint(boxes)
+        elif self.rounding == 'outward':
+            boxes[:, :2] = np.floor(boxes[:, :2])
+            boxes[:, 2:] = np.ceil(boxes[:, 2:])
+        elif self.rounding == 'inward':
+            boxes[:, :2] = np.ceil(boxes[:, :2])
+            boxes[:, 2:] = np.floor(boxes[:, 2:])
+        _, _, new_width, new_height, _ = self.sizes(width, height)
+        return boxes, new_width, new_height
+
+    def _move(self, points, width, height):
+        """ Scale, flip and clip (M, 2) points, without rounding. """
+        points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        scale_x, scale_y, new_width, new_height, known = self.sizes(width, height)
+        n_points = len(points)
+        points[:, 0] *= np.broadcast_to(scale_x, (n_points,))
+        points[:, 1] *= np.broadcast_to(scale_y, (n_points,))
+        known = np.broadcast_to(known, (n_points,))
+        new_width = np.broadcast_to(new_width, (n_points,))
+        new_height = np.broadcast_to(new_height, (n_points,))
+        if self.flip_y:
+            points[:, 1] = np.where(known, new_height - points[:, 1], points[:, 1])
+        if self.clip:
+            points[:, 0] = np.where(known, np.clip(points[:, 0], 0, new_width), points[:, 0])
+            points[:, 1] = np.where(known, np.clip(points[:, 1], 0, new_height), points[:, 1])
+        return points
+
+    def apply(self, ann):
+        """ Transform an annotation_formats.ImageAnnotation in place, its polygons and image size included. """
+        coords, new_width, new_height = self.apply_boxes(ann.coords, ann.width, ann.height)
+        if ann.polygons:
+            rows = sorted(ann.polygons)
+            vertices, offsets = pack([ann.polygons[i] for i in rows], dtype=np.float64)
+            vertices = self.apply_points(vertices, ann.width, ann.height)
+            ann.polygons = dict(zip(rows, unpack(vertices, offsets)))
+        ann.coords = coords
+        if ann.width is not None and ann.height is not None and ann.width > 0 and ann.height > 0:
+            ann.width = int(new_width)
+            ann.height = int(new_height)
+        return ann
+
+    def apply_table(self, table, first_image=0):
+        """
+        Transform every box and polygon of a BoxTable in place, in a few array operations over the dataset.
+
+        Only images from ``first_image`` on are touched, for a table that is filled in several goes.
+        """
+        width, height = table.image_sizes()
+        boxes = table.boxes
+        rows = slice(int(np.searchsorted(boxes['image_idx'], first_image)), None)
+        image_idx = boxes['image_idx'][rows]
+        coords, _, _ = self.apply_boxes(table.coords()[rows], width[image_idx], height[image_idx])
+        for i, field in enumerate(('x1', 'y1', 'x2', 'y2')):
+            boxes[field][rows] = coords[:, i]
+
+        vertices = table.vertices
+        if len(vertices):
+            vertex_image = boxes['image_idx'][table.polygon_rows][polygon_index(table.polygon_offsets)]
+            moved = vertex_image >= first_image
+            vertices[moved] = self.apply_points(vertices[moved], width[vertex_image[moved]],
+                                                height[vertex_image[moved]])
+
+        _, _, new_width, new_height, _ = self.sizes(width[first_image:], height[first_image:])
+        table.set_image_sizes(new_width.astype(np.int32), new_height.astype(np.int32), first_image)
+        return table
+
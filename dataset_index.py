@@ -0,0 +1,234 @@
+import argparse
+import os
+import sqlite3
+
+from validation_engine import ANNOTATION_EXTENTION
+from validation_engine import IMAGE_EXTENSION
+from validation_engine import count_names
+from voc_reader import read_voc
+
+# Bump when the schema or what is recorded per file changes; an index of another version is rebuilt.
+INDEX_VERSION = 1
+
+# files.status of xmls: parsed with objects, parsed without any, or not parseable. Images have none, and neither do
+# the xmls whose class counts are still pending.
+XML_OK = 1
+XML_EMPTY = 0
+XML_BROKEN = -1
+
+
+class DatasetIndex:
+    """
+    The image and xml files of a dataset, their size and mtime, and the class counts of every xml, kept in SQLite.
+
+    ``refresh`` lists every directory with a single os.scandir, so keeping the index current costs one directory walk
+    and one stat per file. It parses nothing: the xmls that are new or whose size or mtime changed are pending until
+    their class counts come in through ``record_classes``, from the records a validation run parses anyway, or
+    ``count_pending``. Pairing, the stats the ValidationCache needs and class queries ("files lacking Consignee",
+    "files with more than one SCAC") then come from the index instead of the file system.
+    """
+
+    def __init__(self, path, img_dir, xml_dir):
+        self.path = path
+        self.img_dir = img_dir
+        self.xml_dir = xml_dir
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                stem TEXT,
+                kind TEXT,
+                size INTEGER,
+                mtime INTEGER,
+                status INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS classes (
+                path TEXT,
+                class TEXT,
+                count INTEGER,
+                PRIMARY KEY (path, class)
+            );
+            CREATE INDEX IF NOT EXISTS classes_by_name ON classes (class, count);
+            ''')
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+        expected = {'version': str(INDEX_VERSION), 'img_dir': img_dir, 'xml_dir': xml_dir}
+        if meta != expected:
+            # Another dataset or an old layout: start from scratch.
+            self.connection.executescript('DELETE FROM meta; DELETE FROM files; DELETE FROM classes;')
+            self.connection.executemany('INSERT INTO meta VALUES (?, ?)', expected.items())
+        self.connection.commit()
+        self.images = {}
+        self.xmls = {}
+        self._stats = {}
+        self.pending = set()
+
+    def close(self):
+        self.connection.close()
+
+    def refresh(self):
+        """ Bring the index up to date with the directories; returns the number of (added, changed, removed) files. """
+        known = {row[0]: row[1:] for row in self.connection.execute('SELECT path, stem, kind, size, mtime FROM files')}
+
+        # Images and xmls may share one directory, which is then still listed only once.
+        wanted = {}
+        wanted.setdefault(self.img_dir, {})[IMAGE_EXTENSION] = 'image'
+        wanted.setdefault(self.xml_dir, {})[ANNOTATION_EXTENTION] = 'xml'
+        seen = {}
+        for directory, kinds in wanted.items():
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    stem, ext = os.path.splitext(entry.name)
+                    kind = kinds.get(ext)
+                    if kind is None or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    seen[entry.path] = (stem, kind, st.st_size, st.st_mtime_ns)
+
+        fresh = [path for path, entry in seen.items() if known.get(path) != entry]
+        removed = [path for path in known if path not in seen]
+        rows = [(path,) + seen[path] + (None,) for path in fresh]
+
+        stale = [(path,) for path in fresh + removed]
+        self.connection.executemany('DELETE FROM classes WHERE path = ?', stale)
+        self.connection.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+        self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.connection.commit()
+        # Also the xmls left pending by an earlier refresh that no run has parsed since.
+        self.pending = {path for (path,) in self.connection.execute(
+            'SELECT path FROM files WHERE kind = ? AND status IS NULL', ('xml',))}
+
+        self.images = {}
+        self.xmls = {}
+        self._stats = {}
+        for path, (stem, kind, size, mtime) in sorted(seen.items(), key=lambda item: item[1][0]):
+            (self.images if kind == 'image' else self.xmls)[stem] = path
+            self._stats[path] = (size, mtime)
+        n_added = sum(1 for path in fresh if path not in known)
+        return n_added, len(fresh) - n_added, len(removed)
+
+    def record_classes(self, classes):
+        """
+        Store the class counts of pending xmls from ``{xml path: names}`` as a run parsed them: the class name of
+        every object, [] for an xml without objects and None for one that can't be parsed. Others are ignored.
+        """
+        rows = []
+        class_rows = []
+        for path, names in classes.items():
+            if path not in self.pending:
+                continue
+            if names is None:
+                status = XML_BROKEN
+            elif not names:
+                status = XML_EMPTY
+            else:
+                status = XML_OK
+                class_rows.extend((path, name, count) for name, count in count_names(names).items())
+            rows.append((status, path))
+        self.connection.executemany('UPDATE files SET status = ? WHERE path = ?', rows)
+        self.connection.executemany('INSERT OR REPLACE INTO classes VALUES (?, ?, ?)', class_rows)
+        self.connection.commit()
+        self.pending.difference_update(path for _, path in rows)
+
+    def count_pending(self):
+        """ Parse the pending xmls for their class counts, where no validation run does; returns how many. """
+        pending = sorted(self.pending)
+        self.record_classes({path: _class_names(path) for path in pending})
+        return len(pending)
+
+    def pairs(self):
+        """ (stem, image, xml) like scan_dataset returns them, ordered by stem. """
+        pairs = [(stem, img_file, self.xmls.get(stem)) for stem, img_file in self.images.items()]
+        pairs += [(stem, None, xml_file) for stem, xml_file in self.xmls.items() if stem not in self.images]
+        return pairs
+
+    def stat(self, path):
+        """ (size, mtime in ns) recorded by the last refresh, or None for a file the index doesn't know. """
+        return self._stats.get(path)
+
+    def files_with_class(self, name):
+        """ {stem: number of boxes} of the xmls with at least one ``name`` box. """
+        return dict(self.connection.execute(
+            'SELECT files.stem, classes.count FROM classes JOIN files USING (path) WHERE classes.class = ? '
+            'ORDER BY files.stem', (name,)))
+
+    def files_lacking(self, name):
+        """ Stems of the annotated xmls without a ``name`` box; empty and broken xmls are left out. """
+        return [stem for (stem,) in self.connection.execute(
+            'SELECT stem FROM files WHERE kind = ? AND status = ? AND path NOT IN '
+            '(SELECT path FROM classes WHERE class = ?) ORDER BY stem', ('xml', XML_OK, name))]
+
+    def files_with_more_than(self, name, n_boxes):
+        """ {stem: number of boxes} of the xmls with more than ``n_boxes`` ``name`` boxes. """
+        return dict(self.connection.execute(
+            'SELECT files.stem, classes.count FROM classes JOIN files USING (path) '
+            'WHERE classes.class = ? AND classes.count > ? ORDER BY files.stem', (name, n_boxes)))
+
+    def class_totals(self):
+        """ {class: (files, boxes)} over the whole dataset. """
+        return {name: (n_files, n_boxes) for name, n_files, n_boxes in self.connection.execute(
+            'SELECT class, COUNT(*), SUM(count) FROM classes GROUP BY class ORDER BY class')}
+
+
+def _class_names(path):
+    try:
+        return read_voc(path).names()
+    except Exception:
+        return None
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Build or refresh a dataset index and query it by class.')
+    parser.add_argument('--index',
+                        action='store',
+                        help='The SQLite index file.',
+                        required=True)
+    parser.add_argument('--img_dir',
+                        action='store',
+                        help='The input image directory.',
+                        required=True)
+    parser.add_argument('--xml_dir',
+                        action='store',
+                        help='The input XML directory.',
+                        required=True)
+    parser.add_argument('--lacking',
+                        action='store',
+                        help='List the annotated files without a box of this class.',
+                        default=None)
+    parser.add_argument('--more_than',
+                        action='store',
+                        nargs=2,
+                        metavar=('CLASS', 'N'),
+                        help='List the files with more than N boxes of CLASS.',
+                        default=None)
+    parser.add_argument('--classes',
+                        action='store_true',
+                        help='Print the number of files and boxes of every class.')
+
+    args = parser.parse_args()
+    index = DatasetIndex(args.index, args.img_dir, args.xml_dir)
+    try:
+        added, changed, removed = index.refresh()
+        index.count_pending()
+        print(f'Indexed {len(index.images)} images and {len(index.xmls)} xmls: '
+              f'{added} added, {changed} changed, {removed} removed')
+        if args.lacking:
+            for stem in index.files_lacking(args.lacking):
+                print(stem)
+        if args.more_than:
+            name, n_boxes = args.more_than
+            for stem, count in index.files_with_more_than(name, int(n_boxes)).items():
+                print(f'{stem}: {count}')
+        if args.classes:
+            for name, (n_files, n_boxes) in index.class_totals().items():
+                print(f'{name}: {n_boxes} boxes in {n_files} files')
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import io
+import struct
+
+import cv2
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# JPEG start-of-frame markers carry the frame size. C4 (DHT), C8 (JPG) and CC (DAC) share the range but are not frames.
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers that stand alone, without a length field.
+STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+SOS_MARKER = 0xDA
+APP1_MARKER = 0xE1
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def probe_image_size(path):
+    """
+    (height, width) of an image as cv2.imread would return it, read from the file header when possible.
+
+    Only the JPEG SOF / PNG IHDR bytes are read. EXIF orientations 5-8 (rotated by 90 degrees) swap the two sides,
+    like cv2.imread does when it applies the orientation. Falls back to a full decode when the header can't be
+    parsed and returns None when the image can't be read at all.
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = read_image_size(f)
+    except OSError:
+        size = None
+    if size is not None:
+        return size
+
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    return img.shape[0], img.shape[1]
+
+
+def probe_image_stream(f, header_bytes):
+    """
+    (height, width) of an image in a stream that can't seek, like an archive member; None when it can't be read.
+
+    Only the first ``header_bytes`` are read when the header can be parsed, the rest is decoded like probe_image_size
+    does otherwise.
+    """
+    head = f.read(header_bytes)
+    size = read_image_size(io.BytesIO(head))
+    if size is not None:
+        return size
+    img = cv2.imdecode(np.frombuffer(head + f.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    return img.shape[0], img.shape[1]
+
+
+def read_image_size(f):
+    """
+    (height, width) from the header of an open binary file, or None if the format is not recognised.
+
+    A header with a side of 0 gives None too: such an image does not decode, so the caller's decode decides.
+    """
+    head = f.read(8)
+    if head == PNG_SIGNATURE:
+        size = _read_png_size(f)
+    elif head[:2] == b'\xff\xd8':
+        size = _read_jpeg_size(f, head[2:])
+    else:
+        return None
+    if size is None or size[0] <= 0 or size[1] <= 0:
+        return None
+    return size
+
+
+def _read_png_size(f):
+    # The IHDR chunk always comes first: length (4), type (4), width (4), height (4).
+    chunk = f.read(16)
+    if len(chunk) < 16 or chunk[4:8] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', chunk[8:16])
+    return height, width
+
+
+def _read_jpeg_size(f, buffered):
+    orientation = 1
+    data = buffered
+    while True:
+        # Find the next marker, skipping fill bytes.
+        while len(data) < 2:
+            more = f.read(2)
+            if not more:
+                return None
+            data += more
+        if data[0] != 0xFF:
+            return None
+        marker = data[1]
+        if marker == 0xFF:
+            data = data[1:]
+            continue
+        data = data[2:]
+        if marker in STANDALONE_MARKERS:
+            continue
+
+        while len(data) < 2:
+            more = f.read(2 - len(data))
+            if not more:
+                return None
+            data += more
+        length = struct.unpack('>H', data[:2])[0]
+        data = data[2:]
+        if length < 2:
+            return None
+
+        payload = length - 2
+
+        if marker in SOF_MARKERS or marker == APP1_MARKER:
+            segment = data[:payload]
+            segment += f.read(payload - len(segment))
+            data = data[payload:]
+            if len(segment) < payload:
+                return None
+            if marker == APP1_MARKER:
+                orientation = _exif_orientation(segment) or orientation
+                continue
+            if len(segment) < 5:
+                return None
+            height, width = struct.unpack('>HH', segment[1:5])
+            if orientation in (5, 6, 7, 8):
+                return width, height
+            return height, width
+
+        if marker == SOS_MARKER:
+            # Image data starts here; a file without a frame header before it is not something we can parse.
+            return None
+        if payload >= len(data):
+            f.seek(payload - len(data), 1)
+            data = b''
+        else:
+            data = data[payload:]
+
+
+def _exif_orientation(segment):
+    """ The orientation tag from an APP1 segment, or None. """
+    if segment[:6] != b'Exif\x00\x00':
+        return None
+    tiff = segment[6:]
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    try:
+        ifd_offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+        n_entries = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+        for i in range(n_entries):
+            entry = ifd_offset + 2 + i * 12
+            tag = struct.unpack(endian + 'H', tiff[entry:entry + 2])[0]
+            if tag == EXIF_ORIENTATION_TAG:
+                return struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])[0]
+    except struct.error:
+        return None
+    return None
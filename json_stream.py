@@ -0,0 +1,342 @@
+import json
+import re
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 16
+# Containers up to this size are parsed by json.loads in one go.
+LOOKAHEAD = 1 << 16
+# First window _scan looks at; it grows fourfold while the container stays open.
+SCAN_WINDOW = 1 << 10
+
+QUOTE, BACKSLASH = ord('"'), ord('\\')
+# Depth change of each utf-8 byte; bytes of multi-byte characters are never ascii, so brackets can't be mistaken.
+BRACKET_DELTA = np.zeros(256, dtype=np.int32)
+BRACKET_DELTA[[ord('['), ord('{')]] = 1
+BRACKET_DELTA[[ord(']'), ord('}')]] = -1
+_SPECIAL = BRACKET_DELTA != 0
+_SPECIAL[[QUOTE, BACKSLASH]] = True
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+_SCALAR = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null')
+_DELIMITERS = ',]} \t\n\r'
+
+# Dataloop keeps a full copy of every annotation's geometry per frame under metadata.system.snapshots_.
+DATALOOP_SKIP_KEYS = frozenset(['snapshots_'])
+
+
+class JsonReader:
+    """
+    Incremental reader over a text file holding json (or several json documents, like json lines).
+
+    Only one value at a time is materialised. Kept containers are cut out of the stream and handed to json.loads;
+    values under ``skip_keys`` are scanned past without building anything, and the buffer never holds more than one
+    chunk of a skipped value.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        # Stream offset of buf[0], and of the next skipped key a lookahead has already spotted.
+        self.base = 0
+        self.next_skip = -1
+
+    def _more(self):
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        self.base += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+            return False
+        return True
+
+    def peek(self):
+        """ The next non-whitespace character, or '' at the end of the input. """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} at {self.buf[self.pos:self.pos + 20]!r}')
+        self.pos += 1
+
+    def _read_token(self, pattern):
+        while True:
+            self.peek()
+            m = pattern.match(self.buf, self.pos)
+            # A number running into the end of the buffer might continue in the next chunk ("12" of "12.5"), so a
+            # scalar only counts once the character after it is visible.
+            if m and (self.eof or (m.end() < len(self.buf) and
+                                   (pattern is not _SCALAR or self.buf[m.end()] in _DELIMITERS))):
+                self.pos = m.end()
+                return m.group()
+            if not self._more():
+                if m:
+                    self.pos = m.end()
+                    return m.group()
+                raise ValueError(f'Invalid json at {self.buf[self.pos:self.pos + 20]!r}')
+
+    def read_string(self):
+        return json.loads(self._read_token(_STRING))
+
+    def _scan_container(self, keep):
+        """ Consume one array or object; returns its text when ``keep`` is set. """
+        pieces = []
+        depth = 0
+        in_string = False
+        while True:
+            i, depth, in_string, done = _scan(self.buf, self.pos, depth, in_string)
+            if keep:
+                pieces.append(self.buf[self.pos:i])
+            self.pos = i
+            if done:
+                return ''.join(pieces)
+            if not self._more():
+                raise ValueError('Unexpected end of json')
+
+    def _container_end(self, limit):
+        """ End of the container at the current position if it closes within ``limit`` characters; doesn't consume. """
+        depth = 0
+        in_string = False
+        i = self.pos
+        while True:
+            i, depth, in_string, done = _scan(self.buf, i, depth, in_string, self.pos + limit)
+            if done:
+                return i
+            if len(self.buf) >= self.pos + limit:
+                return None
+            start = self.pos
+            if not self._more():
+                raise ValueError('Unexpected end of json')
+            # _more drops everything before pos, which shifts our index with it.
+            i -= start
+
+    def skip_value(self):
+        char = self.peek()
+        if char in '[{':
+            self._scan_container(keep=False)
+        elif char == '"':
+            self._read_token(_STRING)
+        else:
+            self._read_token(_SCALAR)
+
+    def read_value(self, skip_keys=frozenset()):
+        """ The next value; objects leave out any key in ``skip_keys``, at any depth. """
+        char = self.peek()
+        if char in '[{':
+            if skip_keys:
+                # Small containers without a skipped key go to json.loads in one piece; anything else is walked so
+                # that skipped subtrees are never held in memory. The lookahead stops at a skipped key spotted by an
+                # enclosing container, so nested levels don't rescan the same text.
+                limit = LOOKAHEAD
+                if self.next_skip >= self.base + self.pos:
+                    limit = min(limit, self.next_skip - self.base - self.pos)
+                end = self._container_end(limit)
+                if end is not None:
+                    text = self.buf[self.pos:end]
+                    found = [k for k in (text.find(f'"{key}"') for key in skip_keys) if k >= 0]
+                    if not found:
+                        self.pos = end
+                        return json.loads(text)
+                    self.next_skip = self.base + self.pos + min(found)
+                if char == '{':
+                    return dict(self.iter_object(skip_keys))
+                return list(self.iter_array(skip_keys))
+            return json.loads(self._scan_container(keep=True))
+        if char == '"':
+            return self.read_string()
+        if char == '':
+            raise ValueError('Unexpected end of json')
+        return json.loads(self._read_token(_SCALAR))
+
+    def iter_keys(self):
+        """ Walk an object: yields each key with the reader positioned on its value, which the caller must consume. """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_string()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f'Expected "," or "}}" at {self.buf[self.pos - 1:self.pos + 20]!r}')
+
+    def iter_object(self, skip_keys=frozenset()):
+        """ (key, value) pairs of an object, skipping the keys in ``skip_keys``. """
+        for key in self.iter_keys():
+            if key in skip_keys:
+                self.skip_value()
+            else:
+                yield key, self.read_value(skip_keys)
+
+    def iter_array(self, skip_keys=frozenset()):
+        """ The elements of an array, one at a time. """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value(skip_keys)
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'Expected "," or "]" at {self.buf[self.pos - 1:self.pos + 20]!r}')
+
+    def iter_documents(self, skip_keys=frozenset()):
+        """ Every top level value: one for a plain json file, one per line for json lines. """
+        while self.peek():
+            yield self.read_value(skip_keys)
+
+
+def _scan(buf, i, depth, in_string, end=None):
+    """ Scan a container from ``i``; returns (index, depth, in_string, done), stopping at its end or ``end``. """
+    end = len(buf) if end is None else min(end, len(buf))
+    # A backslash at the end of the buffer escapes a character that is still in the next chunk.
+    while end > i and buf[end - 1] == '\\':
+        end -= 1
+    # Containers are usually small, so look at a short window first and widen it while the container stays open.
+    window = SCAN_WINDOW
+    while i < end:
+        stop = min(end, i + window)
+        while buf[stop - 1] == '\\':
+            stop += 1
+        found, depth, in_string = _scan_window(buf[i:stop], depth, in_string)
+        if found is not None:
+            return i + found, depth, False, True
+        i = stop
+        window *= 4
+    return i, depth, in_string, False
+
+
+def _scan_window(text, depth, in_string):
+    """ One vectorised pass of _scan over ``text``: (end of the container or None, depth, in_string). """
+    raw = text.encode('utf-8', 'surrogatepass')
+    data = np.frombuffer(raw, dtype=np.uint8)
+    if b'\\' in raw:
+        positions = np.arange(len(data))
+        # A quote is escaped when an odd run of backslashes comes right before it.
+        backslashes = data == BACKSLASH
+        last_plain = np.maximum.accumulate(np.where(backslashes, -1, positions))
+        run = positions - 1 - np.concatenate([[-1], last_plain[:-1]])
+        quotes = (data == QUOTE) & (run % 2 == 0)
+    else:
+        # Only quotes and brackets matter, and they are a small part of the text.
+        positions = np.flatnonzero(_SPECIAL[data])
+        data = data[positions]
+        if not len(data):
+            return None, depth, in_string
+        quotes = data == QUOTE
+    outside = (np.cumsum(quotes, dtype=np.int32) + in_string) & 1 == 0
+    delta = np.where(outside, BRACKET_DELTA[data], 0)
+    running = depth + np.cumsum(delta)
+    closed = np.flatnonzero((running == 0) & (delta < 0))
+    if closed.size:
+        end = int(positions[closed[0]]) + 1
+        if len(raw) != len(text):
+            end = len(raw[:end].decode('utf-8', 'surrogatepass'))
+        return end, 0, False
+    return None, int(running[-1]), not bool(outside[-1])
+
+
+def iter_items(f, path, skip_keys=frozenset()):
+    """
+    Stream the elements of the array found under the object keys ``path``, e.g. ``['shapes']`` for LabelMe.
+
+    Everything before the array is skipped and nothing after it is read.
+    """
+    reader = JsonReader(f)
+    for key in path:
+        for found in reader.iter_keys():
+            if found == key:
+                break
+            reader.skip_value()
+        else:
+            return
+    yield from reader.iter_array(skip_keys)
+
+
+def iter_dataloop_items(f, skip_keys=DATALOOP_SKIP_KEYS):
+    """ Dataloop items one at a time from a single item, a dataset export (array of items) or json lines. """
+    reader = JsonReader(f)
+    while reader.peek():
+        if reader.peek() == '[':
+            yield from reader.iter_array(skip_keys)
+        else:
+            yield reader.read_value(skip_keys)
+
+
+def iter_dataloop_annotations(f, skip_keys=DATALOOP_SKIP_KEYS):
+    """
+    (item fields, annotation) pairs, one annotation at a time, even within a single huge item.
+
+    ``item fields`` holds the item's keys that come before its ``annotations`` array, such as ``_id`` and
+    ``filename``.
+    """
+    reader = JsonReader(f)
+
+    def items():
+        while reader.peek():
+            if reader.peek() == '[':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.pos += 1
+                    continue
+                while True:
+                    yield
+                    char = reader.peek()
+                    reader.pos += 1
+                    if char == ']':
+                        break
+            else:
+                yield
+
+    for _ in items():
+        fields = {}
+        for key in reader.iter_keys():
+            if key == 'annotations' and reader.peek() == '[':
+                for annotation in reader.iter_array(skip_keys):
+                    yield fields, annotation
+            elif key in skip_keys:
+                reader.skip_value()
+            else:
+                fields[key] = reader.read_value(skip_keys)
+
+
+class JsonArrayWriter:
+    """ Writes a json array one element at a time, so the whole document never has to be built in memory. """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def __enter__(self):
+        self.f.write('[')
+        return self
+
+    def write(self, value):
+        if self.count:
+            self.f.write(',')
+        self.f.write(json.dumps(value))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.write(']')
+        return False
@@ -0,0 +1,330 @@
+import argparse
+import time
+
+import numpy as np
+
+# Polygons are packed like BoxTable's: float ``vertices`` of shape (V, 2) and int64 ``offsets`` of length P + 1, with
+# polygon ``i`` spanning ``vertices[offsets[i]:offsets[i + 1]]``. Every polygon is a closed ring.
+
+
+def pack(polygons, dtype=np.float32):
+    """ (vertices, offsets) of a sequence of (K, 2) vertex arrays; float32 like a BoxTable unless ``dtype`` says. """
+    polygons = [np.asarray(p, dtype=dtype).reshape(-1, 2) for p in polygons]
+    offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in polygons])
+    vertices = np.concatenate(polygons) if polygons else np.zeros((0, 2), dtype=dtype)
+    return vertices, offsets
+
+
+def unpack(vertices, offsets):
+    """ One (K, 2) view per polygon. """
+    return [vertices[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def polygon_index(offsets):
+    """ Polygon of every vertex. """
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def bounding_boxes(vertices, offsets):
+    """ (P, 4) x1, y1, x2, y2 of every polygon, in the dtype of the vertices; NaN for polygons without vertices. """
+    low = _reduce(np.minimum, vertices, offsets, np.nan)
+    high = _reduce(np.maximum, vertices, offsets, np.nan)
+    return np.concatenate([low, high], axis=1)
+
+
+def signed_areas(vertices, offsets):
+    """ Shoelace area of every polygon; the sign tells the winding, and is negative for clockwise rings in image axes. """
+    v = vertices.astype(np.float64)
+    following = v[_next_vertex(offsets)]
+    cross = v[:, 0] * following[:, 1] - following[:, 0] * v[:, 1]
+    return _reduce(np.add, cross, offsets, 0.0) / 2
+
+
+def areas(vertices, offsets):
+    return np.abs(signed_areas(vertices, offsets))
+
+
+def out_of_bounds(vertices, offsets, width, height, tolerance=0.0):
+    """
+    Bool per polygon with a vertex outside its image, allowing ``tolerance`` of the image size on every side.
+
+    ``width`` and ``height`` are scalars or one value per polygon.
+    """
+    n_polygons = len(offsets) - 1
+    poly = polygon_index(offsets)
+    width = np.broadcast_to(np.asarray(width, dtype=np.float64), (n_polygons,))[poly]
+    height = np.broadcast_to(np.asarray(height, dtype=np.float64), (n_polygons,))[poly]
+    x = vertices[:, 0]
+    y = vertices[:, 1]
+    outside = ((x < -tolerance * width) | (x > width * (1 + tolerance)) |
+               (y < -tolerance * height) | (y > height * (1 + tolerance)))
+    return np.bincount(poly[outside], minlength=n_polygons) > 0
+
+
+def self_intersecting(vertices, offsets, block=1 << 20):
+    """
+    Bool per polygon with two edges that cross each other; edges that only touch or overlap on a line don't count.
+
+    Edges of all polygons are sorted once along x and every edge is only tested against the ones whose x range overlaps
+    its own (sort and sweep), at most ``block`` pairs at a time.
+    """
+    n_polygons = len(offsets) - 1
+    result = np.zeros(n_polygons, dtype=bool)
+    if not len(vertices):
+        return result
+    poly = polygon_index(offsets)
+    following = _next_vertex(offsets)
+    ax = vertices[:, 0].astype(np.float64)
+    ay = vertices[:, 1].astype(np.float64)
+    bx = ax[following]
+    by = ay[following]
+    low_x = np.minimum(ax, bx)
+    high_x = np.maximum(ax, bx)
+
+    # Move every polygon onto its own stretch of the x axis, so one sort groups the edges by polygon and a sweep never
+    # pairs edges of different polygons.
+    poly_low = _reduce(np.minimum, low_x, offsets, 0.0)
+    poly_high = _reduce(np.maximum, high_x, offsets, 0.0)
+    shift = (np.concatenate([[0], np.cumsum(poly_high - poly_low + 1)[:-1]]) - poly_low)[poly]
+    order = np.argsort(low_x + shift, kind='stable')
+    start = (low_x + shift)[order]
+    stop = (high_x + shift)[order]
+    poly, ax, ay, bx, by = poly[order], ax[order], ay[order], bx[order], by[order]
+    low_y = np.minimum(ay, by)
+    high_y = np.maximum(ay, by)
+    # The candidates of the k-th edge in x order are the edges after it that start before it stops.
+    n_candidates = np.searchsorted(start, stop, side='right') - np.arange(len(order)) - 1
+    total = np.cumsum(n_candidates)
+
+    k = 0
+    while k < len(order):
+        done = total[k - 1] if k else 0
+        end = max(k + 1, int(np.searchsorted(total, done + block, side='right')))
+        counts = n_candidates[k:end]
+        i = np.repeat(np.arange(k, end), counts)
+        j = i + 1 + np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        overlap = (low_y[i] <= high_y[j]) & (low_y[j] <= high_y[i])
+        i = i[overlap]
+        j = j[overlap]
+        crosses = ((_orientation(ax[j], ay[j], bx[j], by[j], ax[i], ay[i]) *
+                    _orientation(ax[j], ay[j], bx[j], by[j], bx[i], by[i]) < 0) &
+                   (_orientation(ax[i], ay[i], bx[i], by[i], ax[j], ay[j]) *
+                    _orientation(ax[i], ay[i], bx[i], by[i], bx[j], by[j]) < 0))
+        result[poly[i[crosses]]] = True
+        k = end
+    return result
+
+
+def simplify(vertices, offsets, tolerance):
+    """
+    Douglas-Peucker simplification of every polygon at once; returns the kept (vertices, offsets).
+
+    A vertex is dropped when it lies within ``tolerance`` of the simplified outline. Rings start from their first
+    vertex, which is always kept, and keep at least three vertices, also when they all lie on one line; polygons of
+    fewer are left alone.
+    """
+    n_polygons = len(offsets) - 1
+    lengths = np.diff(offsets)
+    poly = polygon_index(offsets)
+    x = vertices[:, 0].astype(np.float64)
+    y = vertices[:, 1].astype(np.float64)
+    keep = lengths[poly] < 3
+    keep[offsets[:-1][lengths > 0]] = True
+    limit = tolerance * tolerance
+
+    # Open segments between two kept vertices. ``seg_end`` is exclusive of the ring's closing edge: a segment running to
+    # the end of its polygon closes on the first vertex again.
+    rings = np.flatnonzero(lengths >= 3)
+    seg_poly = rings
+    seg_start = offsets[:-1][rings]
+    seg_end = offsets[1:][rings]
+    level = 0
+    while len(seg_poly):
+        inner = seg_end - seg_start - 1
+        active = inner > 0
+        seg_poly, seg_start, seg_end, inner = seg_poly[active], seg_start[active], seg_end[active], inner[active]
+        if not len(seg_poly):
+            break
+        first_inner = np.cumsum(inner) - inner
+        idx = np.arange(inner.sum()) + np.repeat(seg_start + 1 - first_inner, inner)
+        end_vertex = np.where(seg_end == offsets[1:][seg_poly], offsets[:-1][seg_poly], seg_end)
+        distance = _segment_distance2(x[idx], y[idx], x[seg_start], y[seg_start], x[end_vertex], y[end_vertex], inner)
+
+        farthest = np.maximum.reduceat(distance, first_inner)
+        is_max = np.flatnonzero(distance == np.repeat(farthest, inner))
+        # The first farthest vertex of every segment.
+        is_max = is_max[np.searchsorted(is_max, first_inner)]
+        pivot = idx[is_max]
+
+        split = farthest > limit
+        if level == 0:
+            # The first segment runs from the first vertex back to itself: always split it at the farthest vertex.
+            split = farthest > 0
+        elif level == 1:
+            # Split the worse half of any ring that would otherwise end up with only two vertices.
+            has_split = np.bincount(seg_poly[split], minlength=n_polygons) > 0
+            by_distance = np.lexsort((-farthest, seg_poly))
+            worst = by_distance[np.concatenate([[True], seg_poly[by_distance][1:] != seg_poly[by_distance][:-1]])]
+            worst = worst[~has_split[seg_poly[worst]] & (farthest[worst] > 0)]
+            split[worst] = True
+
+        keep[pivot[split]] = True
+        seg_poly = np.concatenate([seg_poly[split], seg_poly[split]])
+        seg_start, seg_end = (np.concatenate([seg_start[split], pivot[split]]),
+                              np.concatenate([pivot[split], seg_end[split]]))
+        level += 1
+
+    # Rings without any area to split on end up as a line: they keep their first vertices not kept yet.
+    kept = np.bincount(poly[keep], minlength=n_polygons)
+    for i in np.flatnonzero((lengths >= 3) & (kept < 3)).tolist():
+        missing = np.flatnonzero(~keep[offsets[i]:offsets[i + 1]])[:3 - kept[i]]
+        keep[offsets[i] + missing] = True
+        kept[i] = 3
+
+    new_offsets = np.zeros(n_polygons + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(kept)
+    return vertices[keep], new_offsets
+
+
+def encode_deltas(vertices, offsets, precision=0.01):
+    """
+    Compact integer copy of the vertices, in units of ``precision``: returns (first, deltas).
+
+    ``first`` holds every polygon's first vertex as int32 and ``deltas`` every vertex as the step from the one before
+    it, zero for first vertices. Steps between neighbouring vertices are small, so ``deltas`` is int16 unless a step
+    doesn't fit.
+    """
+    q = np.rint(vertices.astype(np.float64) / precision).astype(np.int64)
+    filled = np.diff(offsets) > 0
+    starts = offsets[:-1][filled]
+    first = np.zeros((len(offsets) - 1, 2), dtype=np.int64)
+    first[filled] = q[starts]
+    deltas = np.empty_like(q)
+    deltas[1:] = q[1:] - q[:-1]
+    deltas[starts] = 0
+    return _narrow(first, (np.int32,)), _narrow(deltas, (np.int16, np.int32))
+
+
+def decode_deltas(first, deltas, offsets, precision=0.01):
+    """ float32 vertices back from encode_deltas. """
+    lengths = np.diff(offsets)
+    total = np.cumsum(deltas, axis=0, dtype=np.int64)
+    # The running sum goes across polygons: swap what came before each polygon for its first vertex.
+    base = first.astype(np.int64)
+    filled = lengths > 0
+    base[filled] -= total[offsets[:-1][filled]]
+    return ((total + np.repeat(base, lengths, axis=0)) * precision).astype(np.float32)
+
+
+def _narrow(values, dtypes):
+    """ ``values`` in the first of ``dtypes`` that holds them all. """
+    for dtype in dtypes:
+        info = np.iinfo(dtype)
+        if not values.size or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(dtype)
+    raise ValueError(f'Values from {values.min()} to {values.max()} do not fit in {np.dtype(dtypes[-1]).name}')
+
+
+def _reduce(ufunc, values, offsets, empty):
+    """ ``ufunc`` reduced over every polygon's slice of ``values``; ``empty`` for polygons without vertices. """
+    lengths = np.diff(offsets)
+    out = np.full((len(lengths),) + values.shape[1:], empty, dtype=values.dtype)
+    filled = lengths > 0
+    if filled.any():
+        # Empty polygons are left out of the indices, so each slice still ends where the next non-empty one starts.
+        out[filled] = ufunc.reduceat(values, offsets[:-1][filled], axis=0)
+    return out
+
+
+def _next_vertex(offsets):
+    """ Index of the vertex after each one, wrapping around to the first at the end of its polygon. """
+    following = np.arange(1, offsets[-1] + 1)
+    filled = np.diff(offsets) > 0
+    following[offsets[1:][filled] - 1] = offsets[:-1][filled]
+    return following
+
+
+def _orientation(ox, oy, px, py, qx, qy):
+    """ z of (p - o) x (q - o); its sign tells on which side of the line from o to p the point q lies. """
+    return (px - ox) * (qy - oy) - (py - oy) * (qx - ox)
+
+
+def _segment_distance2(px, py, ax, ay, bx, by, counts):
+    """ Squared distance of points (px, py) to segments (ax, ay)-(bx, by); segment ``i`` covers ``counts[i]`` points. """
+    dx = bx - ax
+    dy = by - ay
+    length2 = dx * dx + dy * dy
+    scale = np.repeat(1 / np.where(length2 > 0, length2, 1), counts)
+    dx = np.repeat(dx, counts)
+    dy = np.repeat(dy, counts)
+    rx = px - np.repeat(ax, counts)
+    ry = py - np.repeat(ay, counts)
+    t = np.clip((rx * dx + ry * dy) * scale, 0, 1)
+    rx -= t * dx
+    ry -= t * dy
+    return rx * rx + ry * ry
+
+
+def random_polygons(n_polygons, n_vertices, seed=0):
+    """ Star shaped test polygons of ``n_vertices`` each, with some noise on the radius. """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    radius = rng.uniform(50, 200, (n_polygons, 1)) * rng.uniform(0.9, 1.1, (n_polygons, n_vertices))
+    centres = rng.uniform(200, 1800, (n_polygons, 2))
+    x = centres[:, :1] + radius * np.cos(angles)
+    y = centres[:, 1:] + radius * np.sin(angles)
+    vertices = np.stack([x, y], axis=2).reshape(-1, 2).astype(np.float32)
+    offsets = np.arange(n_polygons + 1, dtype=np.int64) * n_vertices
+    return vertices, offsets
+
+
+def benchmark(n_polygons, n_vertices, tolerance):
+    """ Vertices per second of every operation on random star polygons. """
+    vertices, offsets = random_polygons(n_polygons, n_vertices)
+    operations = [('bounding_boxes', lambda: bounding_boxes(vertices, offsets)),
+                  ('areas', lambda: areas(vertices, offsets)),
+                  ('out_of_bounds', lambda: out_of_bounds(vertices, offsets, 2000, 2000)),
+                  ('self_intersecting', lambda: self_intersecting(vertices, offsets)),
+                  ('simplify', lambda: simplify(vertices, offsets, tolerance)),
+                  ('encode_deltas', lambda: encode_deltas(vertices, offsets)),
+                  ('decode_deltas', lambda: decode_deltas(first, deltas, offsets))]
+    first, deltas = encode_deltas(vertices, offsets)
+    for name, operation in operations:
+        start = time.perf_counter()
+        operation()
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {len(vertices) / elapsed / 1e6:.1f} M vertices/s')
+
+    simple_vertices, simple_offsets = simplify(vertices, offsets, tolerance)
+    error = np.abs(decode_deltas(first, deltas, offsets) - vertices).max(initial=0)
+    print(f'simplify({tolerance}) kept {len(simple_vertices)} of {len(vertices)} vertices, '
+          f'delta encoding takes {first.nbytes + deltas.nbytes} bytes instead of {vertices.nbytes}, '
+          f'{error:.4f} px off at most')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark of the vectorised polygon operations.')
+    parser.add_argument('--polygons',
+                        action='store',
+                        type=int,
+                        help='Number of random polygons.',
+                        default=10000)
+    parser.add_argument('--vertices',
+                        action='store',
+                        type=int,
+                        help='Vertices per polygon.',
+                        default=200)
+    parser.add_argument('--tolerance',
+                        action='store',
+                        type=float,
+                        help='Douglas-Peucker tolerance in pixels.',
+                        default=1.0)
+
+    args = parser.parse_args()
+    benchmark(args.polygons, args.vertices, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
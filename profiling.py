@@ -0,0 +1,127 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MODES = ('cprofile', 'sample')
+# Seconds between two stack samples; a few microseconds of work each, so the run barely slows down.
+DEFAULT_INTERVAL = 0.005
+DEFAULT_TOP = 25
+
+
+def frame_name(code):
+    """ 'file.py:function' of a code object, the way collapsed-stack tools show it. """
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f'{os.path.basename(code.co_filename)}:{name}'.replace(';', ':').replace(' ', '_')
+
+
+class StackSampler:
+    """
+    Samples the stacks of every thread of this process every ``interval`` seconds from a background thread.
+
+    ``stacks`` counts the samples per collapsed stack ('thread;outer.py:f;inner.py:g'), the format flamegraph.pl,
+    speedscope and inferno read.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.n_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)).replace(';', ':').replace(' ', '_'))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.n_samples += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def top(self, n=DEFAULT_TOP):
+        """ [(function, self samples, total samples), ...] of the ``n`` functions with most samples of their own. """
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(n)]
+
+
+class Profiler:
+    """
+    Profiles a validation run with cProfile ('cprofile') or only by sampling stacks ('sample').
+
+    Both modes sample stacks for the collapsed-stack file; cProfile adds exact call counts and times at the price of a
+    slower run. ``write`` leaves ``<prefix>.collapsed`` (and ``<prefix>.pstats`` with cProfile) and prints the hottest
+    functions. Only this process is profiled: with worker processes the parent mostly waits, so profile with one.
+    """
+
+    def __init__(self, mode='sample', interval=DEFAULT_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode}, expected one of {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.sampler = StackSampler(interval)
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+        self.wall = 0.0
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        self.sampler.start()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        self.sampler.stop()
+        self.wall = time.perf_counter() - self._start
+
+    def write(self, prefix, top=DEFAULT_TOP):
+        """ Write the profile files next to ``prefix`` and print the ``top`` hottest functions. """
+        collapsed = prefix + '.collapsed'
+        self.sampler.write_collapsed(collapsed)
+        print(f'Profiled {self.wall:.2f}s, {self.sampler.n_samples} stack samples written to {collapsed}')
+        if self.profile is not None:
+            stats_file = prefix + '.pstats'
+            self.profile.dump_stats(stats_file)
+            print(f'cProfile data written to {stats_file}')
+            text = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=text)
+            stats.sort_stats('tottime').print_stats(top)
+            print(text.getvalue())
+        else:
+            n_samples = max(sum(self.sampler.stacks.values()), 1)
+            print(f'{"self":>7} {"total":>7}  function')
+            for name, own, total in self.sampler.top(top):
+                print(f'{own / n_samples:7.1%} {total / n_samples:7.1%}  {name}')
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from box_overlap import DEFAULT_IOU
+from coordinate_transforms import CoordinateTransform
+from validation_engine import ANNOTATION_EXTENTION
+from validation_engine import DuplicateBoxes
+from validation_engine import EmptyAnnotation
+from validation_engine import InvalidBoxArea
+from validation_engine import InvalidCoordinates
+from validation_engine import MissingImage
+from validation_engine import MissingXml
+from validation_engine import Rule
+
+# Rule files shipped for the projects, next to this module; --rules takes one of these names or a path.
+PROJECT_RULES = OrderedDict([('bol', 'bol_rules.yaml'),
+                             ('fruit', 'fruit_rules.yaml')])
+
+RULE_KEYS = ('project', 'missing_xml', 'missing_image', 'empty_annotation', 'box_area', 'coordinates', 'classes',
+             'key_suffix', 'required', 'max_count', 'key_parity', 'duplicates', 'preprocess')
+
+INVALID_CLASS_NAMES = 'invalid_class_names'
+
+
+class ClassConstraints(Rule):
+    """
+    The class rules of a rule file, compiled once into integer class ids and count-vector constraints.
+
+    Every file is reduced to one vector with its number of boxes per class, and the required classes (OR-groups
+    included), the maximum counts and the Key parity are all evaluated on it at once, so more rules don't mean more
+    passes over the boxes. ``evaluate`` takes a whole matrix of count vectors, which is how the vectorised path runs
+    the same constraints over a dataset. Tags are the names of the output folders, as the separate rules had them.
+    """
+
+    def __init__(self, valid_classes=None, required=(), max_count=None, key_parity=(), key_suffix='Key'):
+        self.valid_classes = list(valid_classes) if valid_classes is not None else None
+        self.required = [list(group) for group in required]
+        self.max_count = OrderedDict(max_count or {})
+        self.key_parity = list(key_parity)
+        self.key_suffix = key_suffix
+
+        valid = [] if self.valid_classes is None else list(self.valid_classes)
+        if self.valid_classes is not None and key_suffix:
+            valid += [name + key_suffix for name in self.valid_classes]
+        names = OrderedDict.fromkeys(valid)
+        for group in self.required:
+            names.update(OrderedDict.fromkeys(group))
+        names.update(OrderedDict.fromkeys(self.max_count))
+        for name in self.key_parity:
+            names.update(OrderedDict.fromkeys([name, name + key_suffix]))
+        # Class id of every name the rules know; all other names share the last id.
+        self.names = list(names)
+        self.ids = {name: class_id for class_id, name in enumerate(self.names)}
+        self.unknown_id = len(self.names)
+
+        valid = set(valid)
+        self.valid_ids = np.array([self.valid_classes is None or name in valid for name in self.names] +
+                                  [self.valid_classes is None], dtype=bool)
+        self.required_ids = np.zeros((len(self.required), len(self.names)), dtype=np.int32)
+        for i, group in enumerate(self.required):
+            self.required_ids[i, [self.ids[name] for name in group]] = 1
+        self.max_ids = np.array([self.ids[name] for name in self.max_count], dtype=np.int64)
+        self.max_limits = np.array(list(self.max_count.values()), dtype=np.int64)
+        self.parity_ids = np.array([self.ids[name] for name in self.key_parity], dtype=np.int64)
+        self.parity_key_ids = np.array([self.ids[name + key_suffix] for name in self.key_parity], dtype=np.int64)
+
+        # The same constraints as plain ints and tuples, for checking one file at a time.
+        self._valid = self.valid_ids.tolist()
+        self._groups = [tuple(np.flatnonzero(row).tolist()) for row in self.required_ids]
+        self._limits = list(zip(self.max_ids.tolist(), self.max_limits.tolist()))
+        self._pairs = list(zip(self.parity_ids.tolist(), self.parity_key_ids.tolist()))
+
+        self.count_tags = ([f"missing_{'|'.join(group)}" for group in self.required] +
+                           [f'more_than_{n_boxes}_{name}' for name, n_boxes in self.max_count.items()] +
+                           [f'inconsistent_number_of_{name}{key_suffix}' for name in self.key_parity])
+
+    def evaluate(self, counts):
+        """ Bool matrix (files, count_tags) of the violated constraints, for a (files, classes) count matrix. """
+        counts = counts[:, :len(self.names)]
+        missing = ((counts > 0).astype(np.int32) @ self.required_ids.T) == 0
+        too_many = counts[:, self.max_ids] > self.max_limits
+        unpaired = counts[:, self.parity_ids] != counts[:, self.parity_key_ids]
+        return np.concatenate([missing, too_many, unpaired], axis=1)
+
+    def check(self, record):
+        if not record.names:
+            return []
+        # A file has a few dozen boxes; plain lists beat numpy's per-call overhead at that size.
+        ids = [self.ids.get(name, self.unknown_id) for name in record.names]
+        counts = [0] * (self.unknown_id + 1)
+        for class_id in ids:
+            counts[class_id] += 1
+        hits = [(INVALID_CLASS_NAMES, name) for name, class_id in zip(record.names, ids)
+                if not self._valid[class_id]]
+        violated = ([not any(counts[class_id] for class_id in group) for group in self._groups] +
+                    [counts[class_id] > n_boxes for class_id, n_boxes in self._limits] +
+                    [counts[class_id] != counts[key_id] for class_id, key_id in self._pairs])
+        hits += [(tag, None) for tag, hit in zip(self.count_tags, violated) if hit]
+        return hits
+
+    def valid_names(self):
+        """ The class names no box may fall outside of, or None when any name is allowed. """
+        return None if self.valid_classes is None else [name for name in self.names if self.valid_ids[self.ids[name]]]
+
+    def copies(self, tag):
+        # A wrong class name is fixed in the xml alone.
+        return tag != INVALID_CLASS_NAMES, True
+
+    def subdir(self, tag):
+        return tag
+
+    def tags(self):
+        return [INVALID_CLASS_NAMES] if self.valid_classes is not None else []
+
+    def summary(self, findings):
+        for stem, name in findings.get(INVALID_CLASS_NAMES, []):
+            print('invalid class name: ', stem + ANNOTATION_EXTENTION, name)
+        for group, tag in zip(self.required, self.count_tags):
+            print(f"Number of files without class {'|'.join(group)}: {len(findings.get(tag, []))}")
+        tags = self.count_tags[len(self.required):]
+        for (name, n_boxes), tag in zip(self.max_count.items(), tags):
+            print(f"Number of files with more than {n_boxes} {name}: {len(findings.get(tag, []))}")
+        for name, tag in zip(self.key_parity, tags[len(self.max_count):]):
+            print(f"Number of files with inconsistent number of {name}{self.key_suffix}: {len(findings.get(tag, []))}")
+
+
+def rule_file(rules):
+    """ The rule file of a project name, or ``rules`` itself when it is a path. """
+    if rules in PROJECT_RULES:
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), PROJECT_RULES[rules])
+    return rules
+
+
+def read_rule_file(path):
+    """ The rules of a YAML or JSON file as a dict. """
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            config = json.load(f)
+        elif yaml is None:
+            raise ImportError(f'PyYAML is needed to read {path}; install it or write the rules as json.')
+        else:
+            config = yaml.safe_load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f'{path} must hold a mapping of rules')
+    unknown = [key for key in config if key not in RULE_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown rules in {path}: {', '.join(unknown)}")
+    return config
+
+
+def compile_rules(config):
+    """ The Rule list of a rule file's dict, in the order the validator always ran them. """
+    rules = []
+    if config.get('missing_xml', True):
+        rules.append(MissingXml())
+    if config.get('missing_image', True):
+        rules.append(MissingImage())
+    if config.get('empty_annotation', True):
+        rules.append(EmptyAnnotation())
+    coordinates = config.get('coordinates', {})
+    if coordinates is not False:
+        rules.append(InvalidCoordinates(tolerance=float((coordinates or {}).get('tolerance', 0.05))))
+    if config.get('box_area', False):
+        rules.append(InvalidBoxArea())
+
+    # An OR-group is a list of classes or, as before, one 'A|B' string.
+    required = [group if isinstance(group, list) else str(group).split('|') for group in config.get('required') or []]
+    max_count = OrderedDict((str(name), int(n_boxes)) for name, n_boxes in (config.get('max_count') or {}).items())
+    if any(n_boxes < 0 for n_boxes in max_count.values()):
+        raise ValueError('max_count must not be negative')
+    key_parity = [str(name) for name in config.get('key_parity') or []]
+    classes = config.get('classes')
+    if classes is not None or required or max_count or key_parity:
+        rules.append(ClassConstraints(valid_classes=[str(name) for name in classes] if classes is not None else None,
+                                      required=[[str(name) for name in group] for group in required],
+                                      max_count=max_count,
+                                      key_parity=key_parity,
+                                      key_suffix=config.get('key_suffix', 'Key') or ''))
+    duplicates = config.get('duplicates', False)
+    if duplicates is not False:
+        rules.append(DuplicateBoxes(iou_threshold=float((duplicates or {}).get('iou', DEFAULT_IOU))))
+    return rules
+
+
+def compile_transform(config):
+    """
+    The CoordinateTransform of a rule file's ``preprocess`` block, or None.
+
+    It takes the arguments of CoordinateTransform, e.g. ``scale: 2`` for xmls annotated on half-size images.
+    """
+    preprocess = config.get('preprocess')
+    if not preprocess:
+        return None
+    if 'target_size' in preprocess:
+        preprocess = dict(preprocess, target_size=[int(size) for size in preprocess['target_size']])
+    return CoordinateTransform(**preprocess)
+
+
+def load_rules(rules):
+    """ The compiled rules of a project name or rule file path. """
+    return compile_rules(read_rule_file(rule_file(rules)))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Check a rule file and print what it compiles to.')
+    parser.add_argument('--rules',
+                        action='store',
+                        help=f"A YAML/JSON rule file or one of the projects: {', '.join(PROJECT_RULES)}.",
+                        required=True)
+
+    args = parser.parse_args()
+    for rule in load_rules(args.rules):
+        print(type(rule).__name__)
+        if isinstance(rule, ClassConstraints):
+            print(f'  {len(rule.names)} classes: {", ".join(rule.names)}')
+            for tag in rule.tags() + rule.count_tags:
+                print(f'  {tag}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import json
+import math
+import os
+import random
+import struct
+
+from json_stream import JsonArrayWriter
+
+BOL_CLASSES = ['Shipper',
+               'Consignee',
+               'Carrier',
+               'NotifyParty',
+               'Issuer',
+               'IssuerLogo',
+               'DestinationAgent',
+               'CompanyName',
+               'Address',
+               'FreightPaymentTerms',
+               'ShippedOnBoardDate',
+               'JobRef',
+               'SCAC',
+               'ExportRef']
+# Classes annotated together with a <class>Key box for the label printed next to them.
+BOL_KEY_CLASSES = ['Shipper', 'Consignee', 'NotifyParty', 'DestinationAgent', 'ShippedOnBoardDate', 'ExportRef']
+# Classes that may appear more than once on a document.
+BOL_REPEATED_CLASSES = ['CompanyName', 'Address']
+BOL_SIZE = (1700, 2200)
+
+FRUIT_CLASS = 'AnjouPears'
+FRUIT_SIZE = (3024, 4032)
+DATALOOP_LABEL = 'CarBox'
+DATALOOP_SIZE = (1200, 1600)
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+# Every corpus has `scale` files, except the fruit one: its files hold hundreds of boxes each.
+FRUIT_FILES_PER_SCALE = 100
+# Share of fruit boxes annotated a second time, stacked on the first or off by a pixel.
+FRUIT_DUPLICATE_RATE = 0.02
+
+# Ways a BOL document is broken, each on about `defect_rate` of the files.
+BOL_DEFECTS = ('missing_class', 'duplicate_class', 'missing_key', 'invalid_name', 'out_of_bounds', 'size_mismatch',
+               'empty', 'missing_image', 'missing_xml')
+
+VOC_HEADER = ('<annotation>\n'
+              '\t<folder>{folder}</folder>\n'
+              '\t<filename>{filename}</filename>\n'
+              '\t<path>{filename}</path>\n'
+              '\t<source>\n'
+              '\t\t<database>Unknown</database>\n'
+              '\t</source>\n'
+              '\t<size>\n'
+              '\t\t<width>{width}</width>\n'
+              '\t\t<height>{height}</height>\n'
+              '\t\t<depth>3</depth>\n'
+              '\t</size>\n'
+              '\t<segmented>0</segmented>\n')
+VOC_OBJECT = ('\t<object>\n'
+              '\t\t<name>{}</name>\n'
+              '\t\t<pose>Unspecified</pose>\n'
+              '\t\t<truncated>0</truncated>\n'
+              '\t\t<difficult>0</difficult>\n'
+              '\t\t<bndbox>\n'
+              '\t\t\t<xmin>{}</xmin>\n'
+              '\t\t\t<ymin>{}</ymin>\n'
+              '\t\t\t<xmax>{}</xmax>\n'
+              '\t\t\t<ymax>{}</ymax>\n'
+              '\t\t</bndbox>\n'
+              '\t</object>\n')
+
+
+def jpeg_stub(width, height):
+    """
+    The smallest JPEG header image_probe reads a size from: SOI, JFIF APP0, a baseline SOF0 frame and EOI.
+
+    There is no scan data, so cv2 can't decode it; the probe never needs to.
+    """
+    app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof0 = b'\xff\xc0\x00\x11\x08' + struct.pack('>HH', height, width) + b'\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    return b'\xff\xd8' + app0 + sof0 + b'\xff\xd9'
+
+
+def voc_xml(filename, width, height, objects, folder='synthetic'):
+    """ labelImg-style VOC xml for ``objects``, (name, xmin, ymin, xmax, ymax) tuples. """
+    parts = [VOC_HEADER.format(folder=folder, filename=filename, width=width, height=height)]
+    parts.extend(VOC_OBJECT.format(*obj) for obj in objects)
+    parts.append('</annotation>\n')
+    return ''.join(parts)
+
+
+def random_box(rng, width, height, min_size=20, max_width=300, max_height=100):
+    w = rng.randint(min_size, max_width)
+    h = rng.randint(min_size, max_height)
+    x = rng.randint(0, width - w)
+    y = rng.randint(0, height - h)
+    return x, y, x + w, y + h
+
+
+def bol_objects(rng, defect=None):
+    """ The boxes of one bill of lading, with ``defect`` (one of BOL_DEFECTS) injected. """
+    width, height = BOL_SIZE
+    if defect == 'empty':
+        return []
+    classes = list(BOL_CLASSES)
+    if defect == 'missing_class':
+        classes.remove(rng.choice(BOL_CLASSES[:11]))
+    classes += [rng.choice(BOL_REPEATED_CLASSES) for _ in range(rng.randint(0, 3))]
+    if defect == 'duplicate_class':
+        classes.append(rng.choice(BOL_CLASSES[:7]))
+    dropped_key = rng.choice(BOL_KEY_CLASSES) if defect == 'missing_key' else None
+
+    objects = []
+    for name in classes:
+        box = random_box(rng, width, height)
+        objects.append((name,) + box)
+        if name in BOL_KEY_CLASSES and name != dropped_key:
+            x1, y1 = box[0], max(0, box[1] - 30)
+            objects.append((name + 'Key', x1, y1, x1 + 120, y1 + 25))
+    if defect == 'invalid_name':
+        index = rng.randrange(len(objects))
+        objects[index] = (objects[index][0].lower(),) + objects[index][1:]
+    if defect == 'out_of_bounds':
+        index = rng.randrange(len(objects))
+        name, x1, y1, _, y2 = objects[index]
+        objects[index] = (name, x1, y1, width + rng.randint(200, 500), y2)
+    rng.shuffle(objects)
+    return objects
+
+
+def generate_bol(out_dir, n_files, seed=0, defect_rate=0.05):
+    """ ``n_files`` BOL image/xml pairs in one directory, like the validator's input. Returns the defect counts. """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    width, height = BOL_SIZE
+    image = jpeg_stub(width, height)
+    mismatched_image = jpeg_stub(width // 2, height // 2)
+    defects = dict.fromkeys(BOL_DEFECTS, 0)
+    for i in range(n_files):
+        stem = f'bol_{i:07d}'
+        defect = rng.choice(BOL_DEFECTS) if rng.random() < defect_rate else None
+        if defect is not None:
+            defects[defect] += 1
+        if defect != 'missing_xml':
+            with open(os.path.join(out_dir, stem + '.xml'), 'w') as f:
+                f.write(voc_xml(stem + '.jpg', width, height, bol_objects(rng, defect)))
+        if defect != 'missing_image':
+            with open(os.path.join(out_dir, stem + '.jpg'), 'wb') as f:
+                f.write(mismatched_image if defect == 'size_mismatch' else image)
+    return defects
+
+
+def generate_fruit(out_dir, n_files, seed=0, min_boxes=200, max_boxes=600, duplicate_rate=FRUIT_DUPLICATE_RATE):
+    """
+    ``n_files`` orchard photos, each with hundreds of small AnjouPears boxes; about ``duplicate_rate`` of them are
+    annotated twice. Returns the number of boxes and of duplicates.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    width, height = FRUIT_SIZE
+    image = jpeg_stub(width, height)
+    n_boxes = 0
+    n_duplicates = 0
+    for i in range(n_files):
+        stem = f'fruit_{i:06d}'
+        objects = [(FRUIT_CLASS,) + random_box(rng, width, height, min_size=40, max_width=80, max_height=80)
+                   for _ in range(rng.randint(min_boxes, max_boxes))]
+        for name, x1, y1, x2, y2 in [obj for obj in objects if rng.random() < duplicate_rate]:
+            if rng.random() < 0.5:
+                objects.append((name, x1, y1, x2, y2))
+            else:
+                objects.append((name, max(0, x1 + rng.randint(-1, 1)), max(0, y1 + rng.randint(-1, 1)),
+                                min(width, x2 + rng.randint(-1, 1)), min(height, y2 + rng.randint(-1, 1))))
+            n_duplicates += 1
+        rng.shuffle(objects)
+        n_boxes += len(objects)
+        with open(os.path.join(out_dir, stem + '.xml'), 'w') as f:
+            f.write(voc_xml(stem + '.jpg', width, height, objects, folder='downloaddump'))
+        with open(os.path.join(out_dir, stem + '.jpg'), 'wb') as f:
+            f.write(image)
+    return n_boxes, n_duplicates
+
+
+def dataloop_item(rng, index, n_annotations=3):
+    """ One item of a Dataloop export, with the per-annotation metadata snapshots real exports carry. """
+    width, height = DATALOOP_SIZE
+    item_id = f'{index:024x}'
+    annotations = []
+    for j in range(n_annotations):
+        x1, y1, x2, y2 = random_box(rng, width, height, max_width=900, max_height=900)
+        snapshot = dict(label=DATALOOP_LABEL,
+                        coordinates=[dict(x=x1, y=y1, z=0), dict(x=x2, y=y2, z=0)],
+                        attributes=[],
+                        updatedBy='annotator@example.com',
+                        updatedAt='2020-08-06T16:01:05.744Z')
+        annotations.append(dict(id=f'{index:016x}{j:08x}',
+                                datasetId='5f2c0a1e9b3a4c0012345678',
+                                itemId=item_id,
+                                type='box',
+                                label=DATALOOP_LABEL,
+                                attributes=[],
+                                coordinates=[dict(x=x1, y=y1, z=0), dict(x=x2, y=y2, z=0)],
+                                metadata=dict(system=dict(status=None,
+                                                          startTime=0,
+                                                          endTime=1,
+                                                          frame=0,
+                                                          endFrame=1,
+                                                          snapshots_=[snapshot] * 3,
+                                                          automated=False,
+                                                          isOpen=False,
+                                                          system=False),
+                                              user={}),
+                                creator='annotator@example.com',
+                                createdAt='2020-08-06T16:01:05.744Z',
+                                updatedBy='annotator@example.com',
+                                updatedAt='2020-08-06T16:01:05.744Z'))
+    return dict(id=item_id,
+                filename=f'/car_{index:07d}.jpg',
+                annotations=annotations,
+                annotationsCount=len(annotations),
+                annotated=True,
+                itemMetadata=dict(system=dict(originalname=f'car_{index:07d}.jpg',
+                                              size=250000 + index % 1000,
+                                              encoding='7bit',
+                                              mimetype='image/jpeg',
+                                              width=width,
+                                              height=height,
+                                              refs=[])))
+
+
+def generate_dataloop(path, n_items, seed=0):
+    """ One Dataloop export file with ``n_items`` items, written item by item. """
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f, JsonArrayWriter(f) as writer:
+        for i in range(n_items):
+            writer.write(dataloop_item(rng, i))
+    return writer.count
+
+
+def labelme_document(rng, index, n_shapes=2, n_vertices=24):
+    """ A LabelMe file with random star-shaped polygons, which stay simple however the vertices fall. """
+    width, height = DATALOOP_SIZE
+    shapes = []
+    for _ in range(n_shapes):
+        cx, cy = rng.uniform(200, width - 200), rng.uniform(200, height - 200)
+        points = []
+        for k in range(n_vertices):
+            angle = 2 * math.pi * k / n_vertices
+            radius = rng.uniform(60, 180)
+            points.append([round(cx + radius * math.cos(angle), 2), round(cy + radius * math.sin(angle), 2)])
+        shapes.append(dict(label=DATALOOP_LABEL, points=points, group_id=None, shape_type='polygon', flags={}))
+    return dict(version='4.5.5',
+                flags={},
+                shapes=shapes,
+                imagePath=f'car_{index:07d}.jpg',
+                imageData=None,
+                imageHeight=height,
+                imageWidth=width)
+
+
+def generate_labelme(out_dir, n_files, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(n_files):
+        with open(os.path.join(out_dir, f'car_{i:07d}.json'), 'w') as f:
+            f.write(json.dumps(labelme_document(rng, i)))
+    return n_files
+
+
+def corpus_dirs(root):
+    """ Where generate() puts each corpus under ``root``. """
+    return dict(bol=os.path.join(root, 'bol'),
+                fruit=os.path.join(root, 'fruit'),
+                dataloop=os.path.join(root, 'dataloop', 'dataloop_export.json'),
+                labelme=os.path.join(root, 'labelme'))
+
+
+def generate(root, scale='1k', seed=0, defect_rate=0.05, corpora=('bol', 'fruit', 'dataloop', 'labelme'),
+             duplicate_rate=FRUIT_DUPLICATE_RATE):
+    """ Every synthetic corpus for ``scale`` (a SCALES key or a number of files) under ``root``. """
+    n_files = SCALES[scale] if scale in SCALES else int(scale)
+    paths = corpus_dirs(root)
+    summary = {}
+    if 'bol' in corpora:
+        summary['bol'] = dict(files=n_files, defects=generate_bol(paths['bol'], n_files, seed, defect_rate))
+    if 'fruit' in corpora:
+        n_fruit = max(10, n_files // FRUIT_FILES_PER_SCALE)
+        n_boxes, n_duplicates = generate_fruit(paths['fruit'], n_fruit, seed, duplicate_rate=duplicate_rate)
+        summary['fruit'] = dict(files=n_fruit, boxes=n_boxes, duplicates=n_duplicates)
+    if 'dataloop' in corpora:
+        summary['dataloop'] = dict(items=generate_dataloop(paths['dataloop'], n_files, seed))
+    if 'labelme' in corpora:
+        summary['labelme'] = dict(files=generate_labelme(paths['labelme'], n_files, seed))
+    with open(os.path.join(root, 'synthetic_dataset.json'), 'w') as f:
+        json.dump(dict(scale=scale, seed=seed, defect_rate=defect_rate, duplicate_rate=duplicate_rate,
+                       corpora=summary), f, indent=2)
+    return summary
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Generate synthetic BOL, fruit, Dataloop and LabelMe corpora.')
+    parser.add_argument('--out_dir',
+                        action='store',
+                        help='The output directory.',
+                        required=True)
+    parser.add_argument('--scale',
+                        action='store',
+                        help=f'Number of files per corpus: one of {", ".join(SCALES)} or a number.',
+                        default='1k')
+    parser.add_argument('--seed',
+                        action='store',
+                        type=int,
+                        default=0)
+    parser.add_argument('--defect_rate',
+                        action='store',
+                        type=float,
+                        help='Share of BOL files with an injected defect.',
+                        default=0.05)
+    parser.add_argument('--duplicate_rate',
+                        action='store',
+                        type=float,
+                        help='Share of fruit boxes annotated twice.',
+                        default=FRUIT_DUPLICATE_RATE)
+    parser.add_argument('--corpora',
+                        action='store',
+                        nargs='+',
+                        choices=['bol', 'fruit', 'dataloop', 'labelme'],
+                        default=['bol', 'fruit', 'dataloop', 'labelme'])
+
+    args = parser.parse_args()
+    summary = generate(args.out_dir, args.scale, seed=args.seed, defect_rate=args.defect_rate, corpora=args.corpora,
+                       duplicate_rate=args.duplicate_rate)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
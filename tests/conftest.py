@@ -0,0 +1,89 @@
+import importlib.util
+import os
+import random
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# The modules live flat in the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BOL_CLASSES = ('Shipper', 'Consignee', 'Carrier', 'NotifyParty', 'Issuer', 'IssuerLogo', 'DestinationAgent',
+               'CompanyName', 'Address', 'FreightPaymentTerms', 'ShippedOnBoardDate', 'JobRef', 'SCAC', 'ExportRef')
+IMAGE_SIZE = (320, 240)
+
+
+def voc_xml(stem, width, height, objects):
+    text = (f'<annotation><folder>bol</folder><filename>{stem}.jpg</filename>'
+            f'<size><width>{width}</width><height>{height}</height><depth>3</depth></size>')
+    for name, (x1, y1, x2, y2) in objects:
+        text += (f'<object><name>{name}</name><pose>Unspecified</pose><truncated>0</truncated>'
+                 f'<difficult>0</difficult><bndbox><xmin>{x1}</xmin><ymin>{y1}</ymin><xmax>{x2}</xmax>'
+                 f'<ymax>{y2}</ymax></bndbox></object>')
+    return text + '</annotation>'
+
+
+def write_bol_corpus(root, n_files=60, seed=1):
+    """
+    A small BOL dataset in ``root`` that hits every rule: missing images and xmls, invalid class names, boxes out of
+    the image, xml sizes that don't match the image, empty annotations, missing, repeated and key classes.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    width, height = IMAGE_SIZE
+    image = np.zeros((height, width, 3), np.uint8)
+    for i in range(n_files):
+        stem = f'doc{i:03d}'
+        objects = []
+        for name in rng.sample(BOL_CLASSES, rng.randint(3, 12)):
+            for _ in range(rng.choice([1, 1, 1, 2])):
+                x, y = rng.randint(0, 250), rng.randint(0, 200)
+                objects.append((name, (x, y, x + rng.randint(-5, 60), y + rng.randint(1, 30))))
+                if rng.random() < 0.5:
+                    objects.append((name + 'Key', (x, y, x + 20, y + 20)))
+        if i % 7 == 0:
+            objects.append(('Bogus', (1, 1, 5, 5)))
+        if i % 9 == 0:
+            objects.append(('Shipper', (1, 1, 900, 5)))
+        if i % 13 == 0:
+            objects = []
+        xml_width = 500 if i % 11 == 0 else width
+        if i % 17 != 3:
+            with open(os.path.join(root, stem + '.xml'), 'w') as f:
+                f.write(voc_xml(stem, xml_width, height, objects))
+        if i % 19 != 5:
+            cv2.imwrite(os.path.join(root, stem + '.jpg'), image)
+    return root
+
+
+@pytest.fixture(scope='session')
+def bol_corpus(tmp_path_factory):
+    return write_bol_corpus(str(tmp_path_factory.mktemp('corpus') / 'bol'))
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def validator():
+    """ The validator script, whose file name is no module name. """
+    return load_module('validation_bol_cogito', os.path.join(ROOT, 'validation_bol_cogito (1).py'))
+
+
+def output_files(out_dir):
+    """ Every file the validator put in the rule folders, relative to ``out_dir``. """
+    files = set()
+    for folder, _, names in os.walk(out_dir):
+        for name in names:
+            path = os.path.relpath(os.path.join(folder, name), out_dir)
+            if os.path.dirname(path):
+                files.add(path)
+    return files
@@ -0,0 +1,71 @@
+import contextlib
+import io
+import os
+
+import pytest
+
+from archive_io import ArchiveWriter
+from archive_io import file_name
+from archive_io import split_member_path
+from conftest import output_files
+from validation_engine import run_archive_rules
+from validation_engine import run_rules
+from validation_engine import scan_dataset
+
+
+def member_name(name):
+    """ Where a corpus file goes in the archive: images and xmls in different, nested folders. """
+    stem, ext = os.path.splitext(name)
+    if ext == '.jpg':
+        return f'scans/batch{int(stem[3:]) % 3}/{name}'
+    return f'labels/part{int(stem[3:]) % 2}/voc/{name}'
+
+
+def write_archives(corpus, paths):
+    """ Pack the corpus into ``paths``: one archive with everything, or images in the first and xmls in the second. """
+    writers = [ArchiveWriter(path) for path in paths]
+    for name in sorted(os.listdir(corpus)):
+        writer = writers[-1] if name.endswith('.xml') else writers[0]
+        writer.add_file(member_name(name), os.path.join(corpus, name))
+    for writer in writers:
+        writer.close()
+    return paths
+
+
+def by_stem(pairs):
+    """ {stem: (image name, xml name)}, so directory and archive pairs compare regardless of where files live. """
+    return {stem: (img_file and file_name(img_file), xml_file and file_name(xml_file))
+            for stem, img_file, xml_file in pairs}
+
+
+LAYOUTS = [['bol.zip'], ['bol.tar.gz'], ['images.zip', 'xmls.tar.gz']]
+
+
+@pytest.mark.parametrize('names', LAYOUTS, ids=lambda names: '+'.join(names))
+def test_archive_pairs_match_directory_scan(validator, bol_corpus, tmp_path, names):
+    archives = write_archives(bol_corpus, [str(tmp_path / name) for name in names])
+    rules = validator.bol_rules()
+    pairs, findings = run_archive_rules(archives, rules)
+
+    expected_pairs = scan_dataset(bol_corpus, bol_corpus)
+    assert len(pairs) == len(expected_pairs)
+    assert by_stem(pairs) == by_stem(expected_pairs)
+    for _, img_file, xml_file in pairs:
+        for path in (img_file, xml_file):
+            if path is not None:
+                archive, member = split_member_path(path)
+                assert archive in archives
+                assert member == member_name(file_name(path))
+
+    expected = run_rules(expected_pairs, rules)
+    assert [{tag: sorted(hits) for tag, hits in rule.items()} for rule in findings] == \
+        [{tag: sorted(hits) for tag, hits in rule.items()} for rule in expected]
+
+
+@pytest.mark.parametrize('names', LAYOUTS, ids=lambda names: '+'.join(names))
+def test_archive_validation_matches_directory(validator, bol_corpus, tmp_path, names):
+    archives = write_archives(bol_corpus, [str(tmp_path / name) for name in names])
+    with contextlib.redirect_stdout(io.StringIO()):
+        validator.validate(img_dir=archives[0], xml_dir=archives[-1], validation_output_dir=str(tmp_path / 'archive'))
+        validator.validate(img_dir=bol_corpus, xml_dir=bol_corpus, validation_output_dir=str(tmp_path / 'directory'))
+    assert output_files(str(tmp_path / 'archive')) == output_files(str(tmp_path / 'directory'))
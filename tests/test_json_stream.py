@@ -0,0 +1,115 @@
+import io
+import json
+import random
+
+import pytest
+
+import json_stream
+from json_stream import JsonReader
+from json_stream import iter_dataloop_items
+from json_stream import iter_items
+
+# Characters that make tokens hard to split: escapes, quotes and brackets inside strings, and multi-byte text.
+STRING_PIECES = ['a', 'bc', ' ', '"', '\\', '\\"', '/', '\n', '\t', '{', '}', '[', ']', ',', ':', 'é', '€', '日本',
+                 '\U0001f600', '\x01', 'snapshots_']
+NUMBERS = [0, -1, 7, 12345678901234567890, -0.5, 3.25, 1e-05, -2.5e+30, 6.02e23, 0.1]
+KEYS = ['a', 'id', 'label', 'coordinates', 'x"y', 'back\\slash', 'é', 'snapshots_']
+
+
+def random_string(rnd):
+    return ''.join(rnd.choice(STRING_PIECES) for _ in range(rnd.randint(0, 8)))
+
+
+def random_value(rnd, depth=0):
+    kind = rnd.randint(0, 7 if depth < 4 else 3)
+    if kind == 0:
+        return random_string(rnd)
+    if kind == 1:
+        return rnd.choice(NUMBERS)
+    if kind == 2:
+        return rnd.choice([True, False, None])
+    if kind == 3:
+        return rnd.uniform(-1000, 1000)
+    if kind in (4, 5):
+        return [random_value(rnd, depth + 1) for _ in range(rnd.randint(0, 5))]
+    return {rnd.choice(KEYS + [random_string(rnd)]): random_value(rnd, depth + 1) for _ in range(rnd.randint(0, 5))}
+
+
+def dumps(rnd, value):
+    """ ``value`` as json in one of the layouts found in real files. """
+    return json.dumps(value, ensure_ascii=rnd.random() < 0.5, indent=rnd.choice([None, 1, 2]),
+                      separators=rnd.choice([None, (',', ':')]))
+
+
+def without(value, keys):
+    if isinstance(value, dict):
+        return {k: without(v, keys) for k, v in value.items() if k not in keys}
+    if isinstance(value, list):
+        return [without(v, keys) for v in value]
+    return value
+
+
+@pytest.fixture(params=range(300))
+def fuzz(request, monkeypatch):
+    """ A seeded random generator, with small random lookahead and scan windows so they run out mid-token. """
+    rnd = random.Random(request.param)
+    monkeypatch.setattr(json_stream, 'LOOKAHEAD', rnd.choice([1, 2, 5, 16, 64, 1 << 16]))
+    monkeypatch.setattr(json_stream, 'SCAN_WINDOW', rnd.choice([1, 2, 3, 8, 1 << 10]))
+    return rnd
+
+
+def chunk_size(rnd):
+    return rnd.choice([1, 2, 3, 5, 7, 16, 64, 1 << 16])
+
+
+def test_documents_match_json_load(fuzz):
+    value = random_value(fuzz)
+    reader = JsonReader(io.StringIO(dumps(fuzz, value)), chunk_size=chunk_size(fuzz))
+    assert list(reader.iter_documents()) == [value]
+
+
+def test_json_lines_match_json_load(fuzz):
+    values = [random_value(fuzz) for _ in range(fuzz.randint(1, 4))]
+    text = '\n'.join(json.dumps(value, ensure_ascii=fuzz.random() < 0.5) for value in values)
+    reader = JsonReader(io.StringIO(text), chunk_size=chunk_size(fuzz))
+    assert list(reader.iter_documents()) == values
+
+
+def test_skip_keys_leave_out_snapshots(fuzz):
+    items = [random_value(fuzz) for _ in range(fuzz.randint(0, 4))]
+    value = {'snapshots_': random_value(fuzz), 'items': items, 'tail': random_value(fuzz)}
+    reader = JsonReader(io.StringIO(dumps(fuzz, value)), chunk_size=chunk_size(fuzz))
+    assert list(reader.iter_documents(frozenset(['snapshots_']))) == [without(value, {'snapshots_'})]
+
+
+def test_iter_items_match_json_load(fuzz):
+    items = [random_value(fuzz) for _ in range(fuzz.randint(0, 5))]
+    value = {'version': random_string(fuzz), 'flags': random_value(fuzz), 'shapes': items, 'after': [1, 2]}
+    f = io.StringIO(dumps(fuzz, value))
+    assert list(iter_items(f, ['shapes'])) == items
+
+
+@pytest.mark.parametrize('layout', ['item', 'array', 'lines'])
+def test_dataloop_items_skip_snapshots(fuzz, monkeypatch, layout):
+    items = []
+    for _ in range(fuzz.randint(1, 4)):
+        item = {'filename': random_string(fuzz), 'annotations': [random_value(fuzz) for _ in range(3)]}
+        item['snapshots_'] = [{'annotations': random_value(fuzz), 'snapshots_': random_value(fuzz)}]
+        item['metadata'] = {'system': random_value(fuzz), 'snapshots_': random_value(fuzz)}
+        items.append(item)
+    if layout == 'item':
+        items = items[:1]
+        text = dumps(fuzz, items[0])
+    elif layout == 'array':
+        text = dumps(fuzz, items)
+    else:
+        text = '\n'.join(json.dumps(item) for item in items)
+    size = chunk_size(fuzz)
+    monkeypatch.setattr(json_stream, 'JsonReader', lambda f: JsonReader(f, chunk_size=size))
+    found = list(iter_dataloop_items(io.StringIO(text)))
+    assert found == [without(item, {'snapshots_'}) for item in items]
+
+
+def test_truncated_input_raises():
+    with pytest.raises(ValueError):
+        list(JsonReader(io.StringIO('{"a": [1, 2'), chunk_size=3).iter_documents())
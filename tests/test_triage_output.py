@@ -0,0 +1,72 @@
+import errno
+import os
+from collections import Counter
+
+import pytest
+
+import triage_output
+from triage_output import TriageOutput
+
+
+def make_jobs(tmp_path, n_files):
+    src_dir = tmp_path / 'src'
+    out_dir = tmp_path / 'out'
+    src_dir.mkdir()
+    out_dir.mkdir()
+    jobs = []
+    for i in range(n_files):
+        src = src_dir / f'doc{i}.xml'
+        src.write_text(f'<annotation>{i}</annotation>')
+        jobs.append(('rule', f'doc{i}', str(src), str(out_dir / src.name)))
+    return jobs
+
+
+@pytest.mark.parametrize('error', [errno.EXDEV, errno.EPERM])
+@pytest.mark.parametrize('threads', [1, 4])
+def test_failed_links_are_copied_once(tmp_path, monkeypatch, error, threads):
+    def failing_link(src, dst):
+        raise OSError(error, os.strerror(error))
+
+    copies = Counter()
+    real_copy = triage_output.copy
+
+    def counting_copy(src, dst):
+        copies[dst] += 1
+        return real_copy(src, dst)
+
+    monkeypatch.setitem(triage_output.LINKERS, 'hardlink', failing_link)
+    monkeypatch.setattr(triage_output, 'copy', counting_copy)
+    jobs = make_jobs(tmp_path, 5)
+    output = TriageOutput(mode='hardlink', threads=threads)
+    output.write(jobs)
+
+    assert copies == Counter({dst: 1 for _, _, _, dst in jobs})
+    assert output.linked == 0
+    assert output.copied == len(jobs)
+    for _, _, src, dst in jobs:
+        assert open(dst).read() == open(src).read()
+
+
+def test_some_links_fail(tmp_path, monkeypatch):
+    real_link = triage_output.LINKERS['hardlink']
+
+    def flaky_link(src, dst):
+        if src.endswith(('1.xml', '3.xml')):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        real_link(src, dst)
+
+    copies = Counter()
+    real_copy = triage_output.copy
+    monkeypatch.setitem(triage_output.LINKERS, 'hardlink', flaky_link)
+    monkeypatch.setattr(triage_output, 'copy', lambda src, dst: copies.update([dst]) or real_copy(src, dst))
+    jobs = make_jobs(tmp_path, 5)
+    output = TriageOutput(mode='hardlink', threads=4)
+    output.write(jobs)
+
+    assert output.linked == 3
+    assert output.copied == 2
+    assert output.linked + output.copied == len(jobs)
+    assert sorted(copies.values()) == [1, 1]
+    for _, _, src, dst in jobs:
+        linked = os.path.samefile(src, dst)
+        assert linked == (dst not in copies)
@@ -0,0 +1,71 @@
+import contextlib
+import io
+import json
+import os
+
+from conftest import output_files
+from conftest import write_bol_corpus
+
+
+def run(validator, corpus, out_dir, **options):
+    """ (output files, report) of one validation run. """
+    with contextlib.redirect_stdout(io.StringIO()):
+        validator.validate(img_dir=corpus, xml_dir=corpus, validation_output_dir=out_dir, **options)
+    with open(os.path.join(out_dir, 'validation_report.json')) as f:
+        return output_files(out_dir), json.load(f)
+
+
+def add_bogus_box(xml_file):
+    with open(xml_file) as f:
+        text = f.read()
+    bogus = ('<object><name>Bogus</name><bndbox><xmin>1</xmin><ymin>1</ymin><xmax>5</xmax><ymax>5</ymax></bndbox>'
+             '</object></annotation>')
+    with open(xml_file, 'w') as f:
+        f.write(text.replace('</annotation>', bogus))
+
+
+def test_edited_and_deleted_xmls_are_checked_again(validator, tmp_path):
+    corpus = write_bol_corpus(str(tmp_path / 'bol'))
+    cache_file = str(tmp_path / 'cache.db')
+    out_dir = str(tmp_path / 'out')
+    files, report = run(validator, corpus, out_dir, cache_file=cache_file)
+    assert 'invalid_class_names/doc001.xml' not in files
+    assert 'missing_xml/doc002.jpg' not in files
+
+    add_bogus_box(os.path.join(corpus, 'doc001.xml'))
+    os.remove(os.path.join(corpus, 'doc002.xml'))
+    files, report = run(validator, corpus, out_dir, cache_file=cache_file)
+
+    assert report['files']['checked'] == 2
+    assert report['files']['cached'] == report['files']['pairs'] - 2
+    assert 'invalid_class_names/doc001.xml' in files
+    assert 'missing_xml/doc002.jpg' in files
+    # Nothing else differs from a run without the cache.
+    assert files == run(validator, corpus, str(tmp_path / 'fresh'))[0]
+
+
+def test_content_hash_decides_when_the_stat_changed(validator, tmp_path):
+    corpus = write_bol_corpus(str(tmp_path / 'bol'))
+    cache_file = str(tmp_path / 'cache.db')
+    out_dir = str(tmp_path / 'out')
+    run(validator, corpus, out_dir, cache_file=cache_file)
+
+    # Touched without a change: the hash still matches, the findings are reused.
+    touched = os.path.join(corpus, 'doc004.xml')
+    st = os.stat(touched)
+    os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    # Changed without changing size: only the hash tells.
+    edited = os.path.join(corpus, 'doc006.xml')
+    with open(edited) as f:
+        text = f.read()
+    name = text.split('<name>', 1)[1].split('</name>', 1)[0]
+    with open(edited, 'w') as f:
+        f.write(text.replace(f'<name>{name}</name>', '<name>' + 'X' * len(name) + '</name>', 1))
+    os.utime(edited, ns=(st.st_atime_ns, os.stat(edited).st_mtime_ns + 2 * 10 ** 9))
+    assert os.path.getsize(edited) == len(text)
+
+    files, report = run(validator, corpus, out_dir, cache_file=cache_file)
+    assert report['files']['checked'] == 1
+    assert report['files']['cached'] == report['files']['pairs'] - 1
+    assert 'invalid_class_names/doc006.xml' in files
+    assert files == run(validator, corpus, str(tmp_path / 'fresh'))[0]
@@ -0,0 +1,94 @@
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+from conftest import ROOT
+from conftest import load_module
+from conftest import output_files
+
+# The lines both the baseline and the engine print, per finding and per rule.
+FINDING_PREFIXES = ('Number of ', 'invalid class name:')
+
+MODES = [dict(),
+         dict(workers=2),
+         dict(workers=3),
+         dict(vectorized=True),
+         dict(io_concurrency=4)]
+
+
+def run(validate, corpus, out_dir, **options):
+    """ (output files, finding lines, report, stdout) of one validation run. """
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        validate(img_dir=corpus, xml_dir=corpus, validation_output_dir=out_dir, **options)
+    lines = sorted(line for line in stdout.getvalue().splitlines() if line.startswith(FINDING_PREFIXES))
+    report_file = os.path.join(out_dir, 'validation_report.json')
+    report = None
+    if os.path.isfile(report_file):
+        with open(report_file) as f:
+            report = json.load(f)
+    return output_files(out_dir), lines, report, stdout.getvalue()
+
+
+@pytest.fixture(scope='module')
+def baseline(bol_corpus, tmp_path_factory):
+    """ Output files and finding lines of the validator before the rule engine. """
+    module = load_module('baseline_validator', os.path.join(ROOT, 'tests', 'baseline_validator.py'))
+    files, lines, _, _ = run(module.validate, bol_corpus, str(tmp_path_factory.mktemp('baseline') / 'out'))
+    return files, lines
+
+
+def test_corpus_has_findings(baseline):
+    files, lines = baseline
+    folders = {os.path.dirname(path) for path in files}
+    # empty_annotation stays empty: an xml without objects fails the baseline's check before it counts classes.
+    assert {'missing_xml', 'missing_image', 'invalid_coordinates', 'invalid_class_names'} <= folders
+    assert any(folder.startswith('more_than_1_') for folder in folders)
+    assert any(folder.startswith('inconsistent_number_of_') for folder in folders)
+
+
+@pytest.mark.parametrize('options', MODES, ids=lambda options: ','.join(f'{k}={v}' for k, v in options.items()) or
+                         'default')
+def test_matches_baseline(validator, bol_corpus, baseline, tmp_path, options):
+    files, lines, _, _ = run(validator.validate, bol_corpus, str(tmp_path / 'out'), **options)
+    assert (files, lines) == baseline
+
+
+@pytest.mark.parametrize('options', [dict(), dict(workers=2)], ids=['serial', 'workers=2'])
+def test_cache_matches_baseline(validator, bol_corpus, baseline, tmp_path, options):
+    cache_file = str(tmp_path / 'cache.db')
+    out_dir = str(tmp_path / 'out')
+    files, lines, _, stdout = run(validator.validate, bol_corpus, out_dir, cache_file=cache_file, **options)
+    assert (files, lines) == baseline
+    assert 'Reusing cached results for 0 of' in stdout
+    # The second run takes every finding from the cache.
+    files, lines, report, stdout = run(validator.validate, bol_corpus, out_dir, cache_file=cache_file, **options)
+    assert (files, lines) == baseline
+    assert report['files']['cached'] == report['files']['pairs']
+
+
+@pytest.mark.parametrize('options, cache', [(dict(), False), (dict(workers=2), False), (dict(vectorized=True), False),
+                                            (dict(), True)],
+                         ids=['serial', 'workers=2', 'vectorized', 'cache'])
+def test_index_matches_baseline(validator, bol_corpus, baseline, tmp_path, options, cache):
+    if cache:
+        options = dict(options, cache_file=str(tmp_path / 'cache.db'))
+    index_file = str(tmp_path / 'index.db')
+    for run_dir in ('first', 'second'):
+        files, lines, _, _ = run(validator.validate, bol_corpus, str(tmp_path / run_dir), index_file=index_file,
+                                 **options)
+        assert (files, lines) == baseline
+
+
+def test_findings_do_not_depend_on_worker_count(validator, bol_corpus, tmp_path):
+    results = []
+    for workers in (1, 2, 4):
+        files, lines, report, _ = run(validator.validate, bol_corpus, str(tmp_path / f'workers_{workers}'),
+                                      workers=workers)
+        findings = [(rule['rule'], rule['findings']) for rule in report['rules']]
+        results.append((files, lines, findings, report['errors']))
+    assert results[1] == results[0]
+    assert results[2] == results[0]
@@ -0,0 +1,22 @@
+import os
+import time
+
+from validation_watch import change_time
+
+
+def test_change_time_is_the_mtime_of_a_write(tmp_path):
+    path = tmp_path / 'doc000.xml'
+    path.write_text('<annotation/>')
+    written = time.time() - 0.5
+    os.utime(path, (written, written))
+    assert change_time(str(path), written - 1) == os.stat(path).st_mtime
+
+
+def test_files_moved_in_and_deleted_count_from_now(tmp_path):
+    path = tmp_path / 'doc000.xml'
+    path.write_text('<annotation/>')
+    # Moved in from somewhere else with yesterday's mtime.
+    os.utime(path, (time.time() - 86400, time.time() - 86400))
+    before = time.time()
+    assert change_time(str(path), before - 1) >= before
+    assert change_time(str(tmp_path / 'deleted.xml'), before - 1) >= before
@@ -0,0 +1,200 @@
+import csv
+import errno
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copy
+
+from archive_io import ArchiveWriter
+from archive_io import iter_members
+from archive_io import member_path
+from archive_io import split_member_path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TRIAGE_MODES = ('copy', 'hardlink', 'reflink', 'symlink', 'manifest')
+MANIFEST_FILE = 'triage_manifest.jsonl'
+MANIFEST_FIELDS = ('rule', 'stem', 'file', 'target')
+
+# ioctl that shares a file's extents with another one (copy on write) on btrfs, xfs and others; from linux/fs.h.
+FICLONE = 0x40049409
+
+
+def hardlink(src, dst):
+    os.link(src, dst)
+
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported on this platform')
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+
+LINKERS = {'hardlink': hardlink,
+           'reflink': reflink,
+           'symlink': symlink}
+
+
+def try_link(src, dst, mode):
+    """
+    Make ``dst`` a link to ``src`` the way ``mode`` says; False where that can't be done, leaving no ``dst`` behind.
+
+    Links fail across filesystems (hardlink), on filesystems without copy on write (reflink) or without the right to
+    create them (symlink).
+    """
+    # Never write through an old link into the source file.
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        LINKERS[mode](src, dst)
+        return True
+    except OSError:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        return False
+
+
+def place(src, dst, mode='copy'):
+    """ Make ``dst`` show the content of ``src``, linked the way ``mode`` says if possible and copied otherwise. """
+    if mode in LINKERS and try_link(src, dst, mode):
+        return mode
+    if os.path.lexists(dst):
+        os.remove(dst)
+    copy(src, dst)
+    return 'copy'
+
+
+class TriageOutput:
+    """
+    How flagged files end up in the rule folders of the validation output.
+
+    ``mode`` is one of TRIAGE_MODES: 'copy' copies every file like the validator always did, the link modes fall back
+    to copying where a link can't be made, and 'manifest' only lists the files and creates no folders at all. A
+    ``manifest`` (.jsonl or .csv, by extension) can be written in any mode. Copies run on ``threads`` threads.
+    """
+
+    def __init__(self, mode='copy', manifest=None, threads=1):
+        if mode not in TRIAGE_MODES:
+            raise ValueError(f'Unknown triage mode {mode}, expected one of {", ".join(TRIAGE_MODES)}')
+        self.mode = mode
+        self.manifest = manifest
+        self.threads = threads
+        self.linked = 0
+        self.copied = 0
+        self.listed = 0
+
+    @property
+    def folders(self):
+        """ Whether rule folders are created and filled. """
+        return self.mode != 'manifest'
+
+    def write(self, jobs):
+        """ Materialise ``jobs``, (rule folder, stem, source file, target file) tuples, and list them. """
+        if self.manifest:
+            self._write_manifest(jobs)
+        if not self.folders:
+            return
+
+        # Links are cheap and made here; whatever can't be linked is copied once, on the thread pool.
+        to_copy = []
+        for _, _, src, dst in jobs:
+            if self.mode == 'copy' or not try_link(src, dst, self.mode):
+                to_copy.append((src, dst))
+        self.linked += len(jobs) - len(to_copy)
+        if self.threads > 1 and len(to_copy) > 1:
+            with ThreadPoolExecutor(self.threads) as pool:
+                for _ in pool.map(lambda job: place(*job), to_copy):
+                    pass
+        else:
+            for src, dst in to_copy:
+                place(src, dst)
+        self.copied += len(to_copy)
+
+    def _write_manifest(self, jobs):
+        rows = [dict(zip(MANIFEST_FIELDS, (rule, stem, src, self._target(rule, dst))))
+                for rule, stem, src, dst in jobs]
+        with open(self.manifest, 'w', newline='') as f:
+            if self.manifest.endswith('.csv'):
+                writer = csv.DictWriter(f, MANIFEST_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row) + '\n')
+        self.listed += len(rows)
+
+    def _target(self, rule, dst):
+        """ Where a flagged file ends up, as listed in the manifest. """
+        return dst if self.folders else None
+
+    def summary(self):
+        if self.mode not in ('copy', 'manifest'):
+            print(f'Triage output: {self.linked} files linked ({self.mode}), {self.copied} copied')
+        if self.manifest:
+            print(f'Triage manifest: {self.listed} files listed in {self.manifest}')
+
+
+class ArchiveOutput(TriageOutput):
+    """
+    Triage output for pairs read from zip or tar archives, whose files are archive!member paths.
+
+    The flagged members are extracted in one sequential pass over every input archive, into the rule folders or, with
+    ``out_archive``, straight into a new zip or tar with one directory per rule; nothing else is unpacked.
+    """
+
+    def __init__(self, out_archive=None, manifest=None):
+        super().__init__(mode='copy', manifest=manifest)
+        self.out_archive = out_archive
+
+    @property
+    def folders(self):
+        return self.out_archive is None
+
+    def write(self, jobs):
+        if self.manifest:
+            self._write_manifest(jobs)
+        # archive: {member: [(rule folder, target file), ...]}
+        targets = {}
+        for rule, _, src, dst in jobs:
+            archive, name = split_member_path(src)
+            targets.setdefault(archive, {}).setdefault(name, []).append((rule, dst))
+
+        writer = ArchiveWriter(self.out_archive) if self.out_archive else None
+        try:
+            for archive, members in targets.items():
+                for name, f in iter_members(archive):
+                    member_targets = members.get(name)
+                    if not member_targets:
+                        continue
+                    data = f.read()
+                    for rule, dst in member_targets:
+                        if writer is not None:
+                            writer.add(self._member_name(rule, dst), data)
+                        else:
+                            with open(dst, 'wb') as target:
+                                target.write(data)
+                    self.copied += len(member_targets)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    @staticmethod
+    def _member_name(rule, dst):
+        return rule + '/' + os.path.basename(dst)
+
+    def _target(self, rule, dst):
+        return dst if self.folders else member_path(self.out_archive, self._member_name(rule, dst))
+
+    def summary(self):
+        where = self.out_archive or 'the rule folders'
+        print(f'Archive output: {self.copied} files extracted into {where}')
+        if self.manifest:
+            print(f'Triage manifest: {self.listed} files listed in {self.manifest}')
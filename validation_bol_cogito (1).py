@@ -1,459 +1,155 @@
 import argparse
 import os
-from collections import defaultdict
+import shutil
+import time
 from collections import OrderedDict
-from shutil import copy
 
-import cv2
-import xmltodict
-
-ANNOTATION_EXTENTION = '.xml'
-IMAGE_EXTENSION = '.jpg'
-
-
-def load_annotation(folder, filename_without_extension):
-    file = os.path.join(folder, filename_without_extension + '.xml')
-    if os.path.isfile(file):
-        with open(file) as file:
-            ann = xmltodict.parse(file.read())
-        ann = ann['annotation']
-        # Invert the coordinates (labelImg has origin on hte left top corner and we want it on the left bottom one).
-        h = int(ann['size']['height'])
-        # If the annotation was done with labelImg, then this object is an OrderedDict or a list of OrderedDicts.
-        if 'object' in ann:
-            ann_object = ann['object']
-            assert isinstance(ann_object, list) or isinstance(ann_object, OrderedDict)
-            if isinstance(ann_object, OrderedDict):
-                ann_object = [ann_object]
-                ann['object'] = ann_object
-            for obj in ann_object:
-                y1 = int(obj['bndbox']['ymin'])
-                y2 = int(obj['bndbox']['ymax'])
-                x1 = int(obj['bndbox']['xmin'])
-                x2 = int(obj['bndbox']['xmax'])
-                x1, y1, x2, y2 = invert_image_coordinates(x1, y1, x2, y2, h)
-                obj['bndbox']['xmin'] = str(x1)
-                obj['bndbox']['ymin'] = str(y1)
-                obj['bndbox']['xmax'] = str(x2)
-                obj['bndbox']['ymax'] = str(y2)
-            return ann
-    else:
-        print('No annotation found for this file: ', filename_without_extension)
-        return None
-
-
-def invert_image_coordinates(x1, y1, x2, y2, h):
-    """ Image coordinates have origin on the top left corner and we want the origin to be on the bottom left corner. """
-    return x1, h - y2, x2, h - y1
-
-
-def check_image_without_xml(img_dir, xml_dir, validation_output_dir):
-    """ Any files without annotation? """
-
-    subdir = os.path.join(validation_output_dir, f'missing_xml')
-    if not os.path.isdir(subdir):
-        os.mkdir(subdir)
-
-    rogue = []
-    for file in os.listdir(img_dir):
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != IMAGE_EXTENSION:
-            continue
-        xml_file = os.path.join(xml_dir, file_without_ext + ANNOTATION_EXTENTION)
-        if not os.path.isfile(xml_file):
-            rogue.append(file)
-
-    for f in rogue:
-        copy(os.path.join(img_dir, f), os.path.join(subdir, f))
-
-    print(f'Number of images missing xml: {len(rogue)}')
-
-
-def check_xml_without_image(img_dir, xml_dir, validation_output_dir):
-    """ Any stray annotation lying around? """
-
-    subdir = os.path.join(validation_output_dir, f'missing_image')
-    if not os.path.isdir(subdir):
-        os.mkdir(subdir)
-
-    rogue = []
-    for file in os.listdir(xml_dir):
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != ANNOTATION_EXTENTION:
-            continue
-        image_file = os.path.join(img_dir, file_without_ext + IMAGE_EXTENSION)
-        if not os.path.isfile(image_file):
-            rogue.append(file)
-
-    for f in rogue:
-        copy(os.path.join(xml_dir, f), os.path.join(subdir, f))
-
-    print(f'Number of xmls missing image: {len(rogue)}')
-
-
-def check_xml_content(xml_dir, validation_output_dir):
-
-    subdir = os.path.join(validation_output_dir, f'empty_annotation')
-    if not os.path.isdir(subdir):
-        os.mkdir(subdir)
-
-    rogue = []
-    for file in os.listdir(xml_dir):
-
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != ANNOTATION_EXTENTION:
-            continue
-
-        ann = load_annotation(xml_dir, file_without_ext)
-        if not ann:
-            # Files with missing annotation will be handled by a different method.
-            continue
-        else:
-            try:
-                ann = ann['object']
-            except Exception as e:
-                print(e)
-                print(f'Error loading annotation xml for file {file}')
-                continue
-
-            file_classes = set()
-            for annotation_box in ann:
-                file_classes.add(annotation_box['name'])
-
-            if not file_classes:
-                rogue.append(file)
-
-    for f in rogue:
-        copy(os.path.join(xml_dir, f), os.path.join(subdir, f))
-
-
-def check_class_names(xml_dir, validation_output_dir, valid_classes):
-
-    valid_classes = set(valid_classes + [v + 'Key' for v in valid_classes])
-
-    subdir = os.path.join(validation_output_dir, f'invalid_class_names')
-    if not os.path.isdir(subdir):
-        os.mkdir(subdir)
-
-    rogue = []
-    for file in os.listdir(xml_dir):
-
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != ANNOTATION_EXTENTION:
-            continue
-
-        ann = load_annotation(xml_dir, file_without_ext)
-        if not ann:
-            # Files with missing annotation will be handled by a different method.
-            continue
-        else:
-            try:
-                ann = ann['object']
-            except Exception as e:
-                print(e)
-                print(f'Error loading annotation xml for file {file}')
-                continue
-
-            for annotation_box in ann:
-                if annotation_box['name'] not in valid_classes:
-                    rogue.append(file)
-                    print('invalid class name: ', file, annotation_box['name'])
-
-    for f in rogue:
-        copy(os.path.join(xml_dir, f), os.path.join(subdir, f))
-
-
-def check_xml_coordinates(img_dir, xml_dir, validation_output_dir):
-    """ Any files without annotation? """
-
-    subdir = os.path.join(validation_output_dir, f'invalid_coordinates')
-    if not os.path.isdir(subdir):
-        os.mkdir(subdir)
-
-    rogue = []
-    for file in os.listdir(img_dir):
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != IMAGE_EXTENSION:
-            continue
-        xml_file = os.path.join(xml_dir, file_without_ext + ANNOTATION_EXTENTION)
-        if not os.path.isfile(xml_file):
-            continue
-
-        ann = load_annotation(xml_dir, file_without_ext)
-        if not ann:
-            # Files with missing annotation will be handled by a different method.
-            continue
-        else:
-            try:
-                ann_w = int(ann['size']['width'])
-                ann_h = int(ann['size']['height'])
-                ann = ann['object']
-            except Exception as e:
-                print(e)
-                print(f'Error loading annotation xml for file {file}')
-                continue
-
-            img = cv2.imread(os.path.join(img_dir, file))
-            img_w = img.shape[1]
-            img_h = img.shape[0]
-
-            if abs(img_h - ann_h) / img_h > 0.05 or abs(img_w - ann_w) / img_w > 0.05:
-                rogue.append(file)
-                continue
-
-            for annotation_box in ann:
-                y1 = int(annotation_box['bndbox']['ymin'])
-                y2 = int(annotation_box['bndbox']['ymax'])
-                x1 = int(annotation_box['bndbox']['xmin'])
-                x2 = int(annotation_box['bndbox']['xmax'])
-                if x1 > img_w * 1.05 or x2 > img_w * 1.05 or y1 > img_h * 1.05 or y2 > img_h * 1.05:
-                    rogue.append(file)
-                    continue
-
-    for f in rogue:
-        copy(os.path.join(img_dir, f), os.path.join(subdir, f))
-
-    print(f'Number of xml files with invalid coordinates: {len(rogue)}')
-
-
-def check_missing_boxes(img_dir, xml_dir, validation_output_dir, classes_to_check):
-
-    rogue = defaultdict(list)
-    for file in os.listdir(xml_dir):
-
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != ANNOTATION_EXTENTION:
-            continue
-
-        ann = load_annotation(xml_dir, file_without_ext)
-        if not ann:
-            # Files with missing annotation will be handled by a different method.
-            continue
-        else:
-            try:
-                ann = ann['object']
-            except Exception as e:
-                print(e)
-                print(f'Error loading annotation xml for file {file}')
-                continue
-
-            file_classes = set()
-            for annotation_box in ann:
-                file_classes.add(annotation_box['name'])
-            if not file_classes:
-                # This was handled by a different method.
-                continue
-
-            for check_class in classes_to_check:
-                if '|' not in check_class:
-                    if check_class not in file_classes:
-                        rogue[check_class].append(file_without_ext)
-                else:
-                    split_classes = check_class.split('|')
-                    if all(check_split_class not in file_classes for check_split_class in split_classes):
-                        if file_without_ext not in rogue[check_class]:
-                            rogue[check_class].append(file_without_ext)
-
-    for check_class in rogue:
-        dir_c = os.path.join(validation_output_dir, f'missing_{check_class}')
-        os.mkdir(dir_c)
-        for file_without_ext in rogue[check_class]:
-            copy(os.path.join(img_dir, file_without_ext + IMAGE_EXTENSION), os.path.join(dir_c, file_without_ext + IMAGE_EXTENSION))
-            copy(os.path.join(xml_dir, file_without_ext + ANNOTATION_EXTENTION), os.path.join(dir_c, file_without_ext + ANNOTATION_EXTENTION))
-
-    for check_class in classes_to_check:
-        print(f"Number of files without class {check_class}: {len(rogue[check_class])}")
-
-
-def check_more_than_n_boxes(img_dir, xml_dir, validation_output_dir, n_boxes, classes_to_check):
-
-    rogue = defaultdict(list)
-    for file in os.listdir(xml_dir):
-
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != ANNOTATION_EXTENTION:
-            continue
-
-        ann = load_annotation(xml_dir, file_without_ext)
-        if not ann:
-            # Files with missing annotation will be handled by a different method.
-            continue
-        else:
-            try:
-                ann = ann['object']
-            except Exception as e:
-                print(e)
-                print(f'Error loading annotation xml for file {file}')
-
-            file_classes = list()
-            for annotation_box in ann:
-                file_classes.append(annotation_box['name'])
-            if not file_classes:
-                # This was handled by a different method.
-                continue
-
-            for check_class in classes_to_check:
-
-                n_check_class = sum(1 for c in file_classes if c == check_class)
-
-                if n_check_class > n_boxes:
-                    rogue[check_class].append(file_without_ext)
-
-    for check_class in rogue:
-        dir_c = os.path.join(validation_output_dir, f'more_than_{n_boxes}_{check_class}')
-        os.mkdir(dir_c)
-        for file_without_ext in rogue[check_class]:
-            copy(os.path.join(img_dir, file_without_ext + IMAGE_EXTENSION), os.path.join(dir_c, file_without_ext + IMAGE_EXTENSION))
-            copy(os.path.join(xml_dir, file_without_ext + ANNOTATION_EXTENTION), os.path.join(dir_c, file_without_ext + ANNOTATION_EXTENTION))
-
-    for check_class in classes_to_check:
-        print(f"Number of files with more than {n_boxes} {check_class}: {len(rogue[check_class])}")
-
-
-def check_key_classes(img_dir, xml_dir, validation_output_dir, classes_to_check):
-
-    rogue = defaultdict(list)
-    for file in os.listdir(xml_dir):
-
-        file_without_ext, ext = os.path.splitext(file)
-        if ext != ANNOTATION_EXTENTION:
-            continue
-
-        ann = load_annotation(xml_dir, file_without_ext)
-        if not ann:
-            # Files with missing annotation will be handled by a different method.
-            continue
-        else:
-            try:
-                ann = ann['object']
-            except Exception as e:
-                print(e)
-                print(f'Error loading annotation xml for file {file}')
-
-            file_classes = list()
-            for annotation_box in ann:
-                file_classes.append(annotation_box['name'])
-            if not file_classes:
-                # This was handled by a different method.
-                continue
-
-            for check_class in classes_to_check:
-
-                n_check_class = sum(1 for c in file_classes if c == check_class)
-                key_class = check_class + 'Key'
-                n_key_class = sum(1 for c in file_classes if c == key_class)
-
-                if n_check_class != n_key_class:
-                    rogue[check_class].append(file_without_ext)
-
-    for check_class in rogue:
-        key_class = check_class + 'Key'
-        dir_c = os.path.join(validation_output_dir, f'inconsistent_number_of_{key_class}')
-        os.mkdir(dir_c)
-        for file_without_ext in rogue[check_class]:
-            copy(os.path.join(img_dir, file_without_ext + IMAGE_EXTENSION), os.path.join(dir_c, file_without_ext + IMAGE_EXTENSION))
-            copy(os.path.join(xml_dir, file_without_ext + ANNOTATION_EXTENTION), os.path.join(dir_c, file_without_ext + ANNOTATION_EXTENTION))
-
-    for check_class in classes_to_check:
-        key_class = check_class + 'Key'
-        print(f"Number of files with inconsistent number of {key_class}: {len(rogue[check_class])}")
-
-
-def validate(img_dir, xml_dir, validation_output_dir):
+from annotation_store import STORE_SUFFIX
+from archive_io import is_archive
+from validation_engine import list_pairs
+from validation_engine import run_archive_rules
+from validation_engine import run_validation
+from validation_engine import write_findings
+from dataset_index import DatasetIndex
+from profiling import DEFAULT_TOP
+from profiling import PROFILE_MODES
+from profiling import Profiler
+from rule_config import PROJECT_RULES
+from rule_config import compile_rules
+from rule_config import compile_transform
+from rule_config import load_rules
+from rule_config import read_rule_file
+from rule_config import rule_file
+from validation_cache import ValidationCache
+from triage_output import ArchiveOutput
+from triage_output import MANIFEST_FILE
+from triage_output import TRIAGE_MODES
+from triage_output import TriageOutput
+from validation_report import REPORT_FILE
+from validation_report import RunStats
+from validation_report import build_report
+from validation_report import clock
+from validation_report import write_prometheus
+from validation_report import write_report
+from validation_watch import DEFAULT_POLL_INTERVAL
+from validation_watch import watch
+from vectorized_checks import run_vectorized
+
+
+# Written into every output directory so an incremental run knows it may rebuild it.
+OUTPUT_MARKER = '.validation_output'
+
+
+def bol_rules():
+    """ The checks run over the BOL dataset, as bol_rules.yaml states them. """
+    return load_rules('bol')
+
+
+def validate(img_dir, xml_dir, validation_output_dir, workers=1, cache_file=None, vectorized=False, triage='copy',
+             manifest=None, copy_threads=4, report_file=None, prometheus_file=None, index_file=None,
+             io_concurrency=None, out_archive=None, rules='bol', slowest_files=None, store_file=None):
 
     # Delete any old validation content and create a new folder.
     if os.path.isdir(validation_output_dir):
-        print('The output directory already exists. Please delete the existing directory.')
-        return
+        if cache_file and os.path.isfile(os.path.join(validation_output_dir, OUTPUT_MARKER)):
+            # Incremental runs rebuild the report from the cache, so the previous one can go.
+            shutil.rmtree(validation_output_dir)
+        else:
+            print('The output directory already exists. Please delete the existing directory.')
+            return
+    started = time.time()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    os.mkdir(validation_output_dir)
+    open(os.path.join(validation_output_dir, OUTPUT_MARKER), 'w').close()
+
+    # Zip and tar inputs are validated in place, without extracting them.
+    archives = [path for path in OrderedDict.fromkeys([img_dir, xml_dir]) if is_archive(path)]
+    if archives:
+        if len(archives) < len({img_dir, xml_dir}):
+            print('Images and xmls must either both be in archives or both be in directories.')
+            return
     else:
-        os.mkdir(validation_output_dir)
-
-    # Validate all other input directories.
-    if not os.path.isdir(img_dir):
-        print(f'Invalid directory: {img_dir}')
-        return
-    if not os.path.isdir(xml_dir):
-        print(f'Invalid directory: {xml_dir}')
-        return
-
-    check_image_without_xml(img_dir=img_dir, xml_dir=xml_dir, validation_output_dir=validation_output_dir)
-    check_xml_without_image(img_dir=img_dir, xml_dir=xml_dir, validation_output_dir=validation_output_dir)
-    check_xml_content(xml_dir=xml_dir, validation_output_dir=validation_output_dir)
-    check_xml_coordinates(img_dir=img_dir, xml_dir=xml_dir, validation_output_dir=validation_output_dir)
+        # Validate all other input directories.
+        if not os.path.isdir(img_dir):
+            print(f'Invalid directory: {img_dir}')
+            return
+        if not os.path.isdir(xml_dir):
+            print(f'Invalid directory: {xml_dir}')
+            return
+
+    # A project name or a YAML/JSON rule file, compiled once for the whole run.
+    rules_option = rules
+    config = read_rule_file(rule_file(rules_option))
+    rules = compile_rules(config)
+    # Annotations are rescaled, clipped or rounded before the checks when the rule file has a preprocess block.
+    transform = compile_transform(config)
+
+    # Flagged files are copied, linked or only listed in a manifest.
+    if triage == 'manifest' and not manifest:
+        manifest = os.path.join(validation_output_dir, MANIFEST_FILE)
+    if archives and triage != 'manifest':
+        # Flagged members are extracted in one pass over the archives, into the folders or another archive.
+        output = ArchiveOutput(out_archive=out_archive, manifest=manifest)
+    else:
+        output = TriageOutput(mode=triage, manifest=manifest, threads=copy_threads)
+    stats = RunStats(len(rules), slowest_files=slowest_files)
+    # A persistent index replaces the directory listing and the per-file stats with one incremental scandir.
+    index = DatasetIndex(index_file, img_dir, xml_dir) if index_file and not archives else None
+
+    try:
+        if archives:
+            if workers > 1 or cache_file or index_file or vectorized or store_file:
+                print('Archives are read in a single sequential pass: --workers, --cache, --index, --vectorized and '
+                      '--store are ignored.')
+            pairs, findings = run_archive_rules(archives, rules, stats=stats, transform=transform)
+            write_findings(pairs, rules, findings, validation_output_dir, output=output, stats=stats)
+        elif vectorized or store_file:
+            # The whole dataset is loaded into one BoxTable, mapped from the annotation store when it is current,
+            # and every box rule runs as a few array operations.
+            scan_start = clock()
+            pairs = list_pairs(img_dir, xml_dir, index)
+            stats.add('scan', scan_start, files=len(pairs))
+            findings = run_vectorized(pairs, rules, stats=stats, io_concurrency=io_concurrency,
+                                      transform=transform, store_file=store_file, index=index)
+            write_findings(pairs, rules, findings, validation_output_dir, output=output, stats=stats)
+        else:
+            cache = ValidationCache(cache_file, rules, index=index, transform=transform) if cache_file else None
 
-    check_class_names(xml_dir=xml_dir,
-                      validation_output_dir=validation_output_dir,
-                      valid_classes=['Shipper',
-                                     'Consignee',
-                                     'Carrier',
-                                     'NotifyParty',
-                                     'Issuer',
-                                     'IssuerLogo',
-                                     'DestinationAgent',
-                                     'CompanyName',
-                                     'Address',
-                                     'FreightPaymentTerms',
-                                     'ShippedOnBoardDate',
-                                     'JobRef',
-                                     'SCAC',
-                                     'ExportRef'
-                                     ])
-    
-    check_missing_boxes(img_dir=img_dir,
-                        xml_dir=xml_dir,
-                        validation_output_dir=validation_output_dir,
-                        classes_to_check=['Shipper',
-                                          'Consignee'
-    ,                                     'Carrier',
-                                          'NotifyParty',
-                                          'Issuer',
-                                          'IssuerLogo',
-                                          'DestinationAgent',
-                                          'CompanyName',
-                                          'Address',
-                                          'FreightPaymentTerms',
-                                          'ShippedOnBoardDate',
-                                          # 'JobRef',
-                                          # 'SCAC',
-                                          'ExportRef'
-                                          ])
-    check_more_than_n_boxes(img_dir=img_dir,
-                            xml_dir=xml_dir,
-                            validation_output_dir=validation_output_dir,
-                            n_boxes=1,
-                            classes_to_check=['Shipper',
-                                              'Consignee',
-                                              'Carrier',
-                                              'NotifyParty',
-                                              'Issuer',
-                                              'IssuerLogo',
-                                              'DestinationAgent',
-                                              # 'CompanyName',
-                                              # 'Address',
-                                              'FreightPaymentTerms',
-                                              'ShippedOnBoardDate',
-                                              # 'JobRef',
-                                              'SCAC',
-                                              'ExportRef'
-                                              ])
-    check_key_classes(img_dir=img_dir,
-                      xml_dir=xml_dir,
-                      validation_output_dir=validation_output_dir,
-                      classes_to_check=['Shipper',
-                                        'Consignee',
-                                        # 'Carrier',
-                                        'NotifyParty',
-                                        # 'Issuer',
-                                        # 'IssuerLogo',
-                                        'DestinationAgent',
-                                        # 'CompanyName',
-                                        # 'Address',
-                                        # 'FreightPaymentTerms',
-                                        'ShippedOnBoardDate',
-                                        # 'JobRef',
-                                        # 'SCAC',
-                                        'ExportRef'
-                                        ])
+            # Every xml is parsed once and all rules run over it in a single pass.
+            try:
+                pairs, findings = run_validation(img_dir=img_dir,
+                                                 xml_dir=xml_dir,
+                                                 validation_output_dir=validation_output_dir,
+                                                 rules=rules,
+                                                 workers=workers,
+                                                 cache=cache,
+                                                 output=output,
+                                                 stats=stats,
+                                                 index=index,
+                                                 io_concurrency=io_concurrency,
+                                                 transform=transform)
+            finally:
+                if cache is not None:
+                    cache.close()
+    finally:
+        if index is not None:
+            index.close()
+
+    # A machine readable summary of every run, for dashboards.
+    report = build_report(pairs, rules, findings, stats, started, time.perf_counter() - start,
+                          time.process_time() - cpu_start,
+                          options=dict(workers=workers, cache=bool(cache_file), vectorized=vectorized, triage=triage,
+                                       index=bool(index_file), store=bool(store_file), io_concurrency=io_concurrency,
+                                       archives=archives, rules=rules_option,
+                                       preprocess=vars(transform) if transform is not None else None))
+    write_report(report, report_file or os.path.join(validation_output_dir, REPORT_FILE))
+    if slowest_files:
+        print(f'Slowest {len(stats.file_times)} files:')
+        for wall, stem, file in stats.slowest():
+            print(f'{wall:9.4f}s  {file}')
+    if prometheus_file:
+        write_prometheus(report, prometheus_file)
 
 
 def main():
@@ -461,11 +157,11 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--img_dir',
                         action='store',
-                        help='The input image directory.',
+                        help='The input image directory, or a zip/tar(.gz) archive with the images and xmls.',
                         default='/ANNOTATION/BOL/requirements/sample_bol_v1')
     parser.add_argument('--xml_dir',
                         action='store',
-                        help='The input XML directory.',
+                        help='The input XML directory, or a zip/tar(.gz) archive.',
                         required=False,
                         default='ANNOTATION/BOL/requirements/sample_bol_v1')
     parser.add_argument('--out_dir',
@@ -473,12 +169,166 @@ def main():
                         help='The output directory.',
                         required=False,
                         default='/ANNOTATION/BOL/requirements/val')
+    parser.add_argument('--workers',
+                        action='store',
+                        type=int,
+                        help='Number of worker processes used to parse and check the files.',
+                        required=False,
+                        default=1)
+    parser.add_argument('--cache',
+                        action='store',
+                        help='SQLite file with per-file results. Enables incremental validation: only new or changed '
+                             'files are checked and an existing output directory is rebuilt.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--index',
+                        action='store',
+                        help='SQLite dataset index, refreshed incrementally on every run, used instead of listing and '
+                             'stat-ing every file. Can be queried by class with dataset_index.py.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--vectorized',
+                        action='store_true',
+                        help='Load the whole dataset into memory and run the box checks vectorised. '
+                             'Ignores --workers and --cache.')
+    parser.add_argument('--store',
+                        action='store',
+                        help=f'Binary annotation store ({STORE_SUFFIX}) the xmls are loaded from in milliseconds with '
+                             f'the vectorised checks; written on the first run and whenever an xml changed. Implies '
+                             f'--vectorized.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--triage',
+                        action='store',
+                        choices=TRIAGE_MODES,
+                        help='How flagged files go into the rule folders: copied, linked (falling back to a copy '
+                             'where a link is not possible), or only listed in a manifest.',
+                        required=False,
+                        default='copy')
+    parser.add_argument('--manifest',
+                        action='store',
+                        help=f'Jsonl or csv file listing every flagged file and its rule folder. Defaults to '
+                             f'{MANIFEST_FILE} in the output directory with --triage manifest.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--report',
+                        action='store',
+                        help=f'Where the json report of the run goes. Defaults to {REPORT_FILE} in the output '
+                             f'directory.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--prometheus',
+                        action='store',
+                        help='Also write the report as a Prometheus textfile (e.g. for the node exporter).',
+                        required=False,
+                        default=None)
+    parser.add_argument('--io_concurrency',
+                        action='store',
+                        type=int,
+                        help='Read xmls and image headers ahead with this many concurrent reads (per worker), for '
+                             'datasets on network storage. Off by default.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--out_archive',
+                        action='store',
+                        help='With archive inputs, write the flagged files into this zip/tar(.gz), one folder per '
+                             'rule, instead of into the output directory.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--rules',
+                        action='store',
+                        help=f"A YAML/JSON rule file with the classes to check, or the one of a project: "
+                             f"{', '.join(PROJECT_RULES)}.",
+                        required=False,
+                        default='bol')
+    parser.add_argument('--profile',
+                        action='store',
+                        choices=PROFILE_MODES,
+                        help="Profile the run: 'sample' samples stacks with little overhead, 'cprofile' adds exact "
+                             "call counts. Writes profile.collapsed (for flamegraph.pl or speedscope) and, with "
+                             "cProfile, profile.pstats to the output directory and prints the hottest functions.",
+                        required=False,
+                        default=None)
+    parser.add_argument('--profile_top',
+                        action='store',
+                        type=int,
+                        help='Number of hottest functions printed with --profile.',
+                        required=False,
+                        default=DEFAULT_TOP)
+    parser.add_argument('--slowest_files',
+                        action='store',
+                        type=int,
+                        help='Time every file and list this many of the slowest ones, e.g. giant xmls or corrupt '
+                             'images.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help='Keep running and validate every image/xml pair again as soon as one of its files is '
+                             'saved, moved or deleted, instead of one run writing the output directory.')
+    parser.add_argument('--events',
+                        action='store',
+                        help="With --watch, append every result as a json line to this file ('-' for stdout) "
+                             "instead of printing a summary line.",
+                        required=False,
+                        default=None)
+    parser.add_argument('--port',
+                        action='store',
+                        type=int,
+                        help='With --watch, serve the running totals per rule and class on '
+                             'http://127.0.0.1:PORT/status and the flagged files on /findings.',
+                        required=False,
+                        default=None)
+    parser.add_argument('--poll',
+                        action='store_true',
+                        help=f'With --watch, scan the folders every {DEFAULT_POLL_INTERVAL}s instead of using '
+                             f'inotify, e.g. on network mounts; results then take up to that much longer. Polling is '
+                             f'the default without inotify_simple.')
+    parser.add_argument('--copy_threads',
+                        action='store',
+                        type=int,
+                        help='Number of threads copying files.',
+                        required=False,
+                        default=4)
 
     args = parser.parse_args()
-    if args.img_dir and args.xml_dir and args.out_dir:
-        validate(img_dir=args.img_dir,
-                 xml_dir=args.xml_dir,
-                 validation_output_dir=args.out_dir)
+    if args.watch:
+        for path in (args.img_dir, args.xml_dir):
+            if not os.path.isdir(path):
+                print(f'Invalid directory: {path}')
+                return
+        config = read_rule_file(rule_file(args.rules))
+        watch(args.img_dir, args.xml_dir, compile_rules(config), transform=compile_transform(config),
+              events=args.events, port=args.port, poll=args.poll)
+    elif args.img_dir and args.xml_dir and args.out_dir:
+        profiler = Profiler(args.profile) if args.profile else None
+        if profiler is not None:
+            if args.workers > 1:
+                print('Only the main process is profiled; use --workers 1 to see the parsing and checks.')
+            profiler.start()
+        try:
+            validate(img_dir=args.img_dir,
+                     xml_dir=args.xml_dir,
+                     validation_output_dir=args.out_dir,
+                     workers=args.workers,
+                     cache_file=args.cache,
+                     vectorized=args.vectorized,
+                     triage=args.triage,
+                     manifest=args.manifest,
+                     copy_threads=args.copy_threads,
+                     report_file=args.report,
+                     prometheus_file=args.prometheus,
+                     index_file=args.index,
+                     io_concurrency=args.io_concurrency,
+                     out_archive=args.out_archive,
+                     rules=args.rules,
+                     slowest_files=args.slowest_files,
+                     store_file=args.store)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                out_dir = args.out_dir if os.path.isdir(args.out_dir) else '.'
+                profiler.write(os.path.join(out_dir, 'profile'), top=args.profile_top)
 
 
 if __name__ == "__main__":
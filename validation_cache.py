@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+# Bump when a change to the rules or the record loading makes previously cached findings wrong.
+CACHE_VERSION = 1
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def rules_fingerprint(rules):
+    """ A stable key for the rule configuration; cached findings are only valid for the same rules in the same order. """
+
+    def normalise(value):
+        if isinstance(value, (set, frozenset)):
+            return sorted(normalise(v) for v in value)
+        if isinstance(value, (list, tuple)):
+            return [normalise(v) for v in value]
+        if isinstance(value, dict):
+            return sorted((str(k), normalise(v)) for k, v in value.items())
+        if hasattr(value, 'tolist'):
+            # Compiled numpy arrays.
+            return value.tolist()
+        return value
+
+    config = [CACHE_VERSION] + [(type(rule).__name__, normalise(vars(rule))) for rule in rules]
+    return hashlib.blake2b(repr(config).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ValidationCache:
+    """
+    Per-file validation findings stored in SQLite.
+
+    A pair is keyed by its stem and image/xml paths. Its findings are reused when the size and mtime of both files are
+    unchanged or, failing that, when their content hashes still match, so only new and edited files are re-checked.
+    With a DatasetIndex the sizes and mtimes come from its last refresh instead of another stat per file. Findings
+    made with another ``transform`` (the CoordinateTransform preprocessing the annotations) are not reused.
+    """
+
+    def __init__(self, path, rules, index=None, transform=None):
+        self.path = path
+        self.rules_key = rules_fingerprint(list(rules) + ([transform] if transform is not None else []))
+        self.index = index
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS findings (
+                stem TEXT PRIMARY KEY,
+                img_path TEXT,
+                xml_path TEXT,
+                img_size INTEGER,
+                img_mtime INTEGER,
+                img_hash TEXT,
+                xml_size INTEGER,
+                xml_mtime INTEGER,
+                xml_hash TEXT,
+                rules_key TEXT,
+                hits TEXT
+            )''')
+        self.connection.commit()
+        self._fingerprints = {}
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, pairs):
+        """
+        Split pairs into cached results and pairs that have to be checked again.
+
+        Returns ``({stem: hits}, stale_pairs)``.
+        """
+        rows = {row[0]: row for row in self.connection.execute(
+            'SELECT stem, img_path, xml_path, img_size, img_mtime, img_hash, xml_size, xml_mtime, xml_hash, '
+            'rules_key, hits FROM findings')}
+
+        cached = {}
+        stale = []
+        touched = []
+        for stem, img_file, xml_file in pairs:
+            row = rows.get(stem)
+            img_stat = self._stat(img_file)
+            xml_stat = self._stat(xml_file)
+            if row is None or row[1] != img_file or row[2] != xml_file or row[9] != self.rules_key:
+                stale.append((stem, img_file, xml_file))
+                self._fingerprints[stem] = (img_stat, None, xml_stat, None)
+                continue
+
+            img_hash = row[5]
+            xml_hash = row[8]
+            if img_stat != (row[3], row[4]):
+                img_hash = file_hash(img_file) if img_file is not None else None
+            if xml_stat != (row[6], row[7]):
+                xml_hash = file_hash(xml_file) if xml_file is not None else None
+
+            self._fingerprints[stem] = (img_stat, img_hash, xml_stat, xml_hash)
+            if img_hash != row[5] or xml_hash != row[8]:
+                stale.append((stem, img_file, xml_file))
+                continue
+
+            cached[stem] = [tuple(hit) for hit in json.loads(row[10])]
+            if img_stat != (row[3], row[4]) or xml_stat != (row[6], row[7]):
+                # Touched but not changed: remember the new stat so the hash isn't computed again next time.
+                touched.append((img_stat[0], img_stat[1], xml_stat[0], xml_stat[1], stem))
+
+        if touched:
+            self.connection.executemany(
+                'UPDATE findings SET img_size = ?, img_mtime = ?, xml_size = ?, xml_mtime = ? WHERE stem = ?', touched)
+            self.connection.commit()
+        return cached, stale
+
+    def update(self, stale_pairs, results):
+        """ Store the findings of freshly checked pairs. ``results`` is ``{stem: hits}``. """
+        rows = []
+        for stem, img_file, xml_file in stale_pairs:
+            img_stat, img_hash, xml_stat, xml_hash = self._fingerprints.get(stem, ((None, None), None, (None, None), None))
+            if img_hash is None and img_file is not None:
+                img_hash = file_hash(img_file)
+            if xml_hash is None and xml_file is not None:
+                xml_hash = file_hash(xml_file)
+            rows.append((stem, img_file, xml_file, img_stat[0], img_stat[1], img_hash, xml_stat[0], xml_stat[1],
+                         xml_hash, self.rules_key, json.dumps(results.get(stem, []))))
+        self.connection.executemany('INSERT OR REPLACE INTO findings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.connection.commit()
+
+    def prune(self, pairs):
+        """ Forget files that are no longer part of the dataset. """
+        stems = set(stem for stem, _, _ in pairs)
+        gone = [(stem,) for (stem,) in self.connection.execute('SELECT stem FROM findings') if stem not in stems]
+        if gone:
+            self.connection.executemany('DELETE FROM findings WHERE stem = ?', gone)
+            self.connection.commit()
+
+    def _stat(self, path):
+        stat = self.index.stat(path) if self.index is not None and path is not None else None
+        return stat if stat is not None else _stat(path)
+
+
+def _stat(path):
+    if path is None:
+        return None, None
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
@@ -0,0 +1,570 @@
+import io
+import os
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from archive_io import file_name
+from archive_io import iter_members
+from archive_io import member_path
+from async_io import iter_reads
+from box_overlap import DEFAULT_IOU
+from box_overlap import duplicate_rows
+from image_probe import probe_image_size
+from image_probe import probe_image_stream
+from image_probe import read_image_size
+from triage_output import TriageOutput
+from validation_report import RunStats
+from validation_report import clock
+from voc_reader import invert_boxes
+from voc_reader import read_voc
+
+ANNOTATION_EXTENTION = '.xml'
+IMAGE_EXTENSION = '.jpg'
+# Prefix of an image read ahead for its size; enough for the frame header behind a large EXIF block.
+IMAGE_HEADER_BYTES = 1 << 17
+
+
+class AnnotationRecord:
+    """ One image/xml pair, parsed exactly once and shared by every rule. """
+
+    __slots__ = ('stem', 'img_file', 'xml_file', 'width', 'height', 'names', 'boxes', 'error', 'stats', 'probed',
+                 '_image_size')
+
+    def __init__(self, stem, img_file=None, xml_file=None, stats=None):
+        self.stem = stem
+        self.img_file = img_file
+        self.xml_file = xml_file
+        self.width = None
+        self.height = None
+        # None means "no usable annotation" (no objects or a broken xml), which most rules skip.
+        self.names = None
+        self.boxes = None
+        self.error = None
+        # RunStats the probe time and errors go to, if any.
+        self.stats = stats
+        # Whether _image_size is final, also when it is None because the image can't be read.
+        self.probed = False
+        self._image_size = None
+
+    def image_size(self):
+        """ (height, width) of the image, read lazily and only once from the file header. """
+        if not self.probed and self.img_file is not None:
+            start = clock()
+            self._image_size = probe_image_size(self.img_file)
+            self.probed = True
+            if self.stats is not None:
+                self.stats.add('probe', start)
+                if self._image_size is None:
+                    self.stats.error(self.stem, self.img_file, 'probe', 'unreadable image')
+        return self._image_size
+
+
+def scan_dataset(img_dir, xml_dir):
+    """ List both directories once and pair images with annotations by file stem. """
+
+    images = OrderedDict()
+    for file in os.listdir(img_dir):
+        file_without_ext, ext = os.path.splitext(file)
+        if ext == IMAGE_EXTENSION:
+            images[file_without_ext] = os.path.join(img_dir, file)
+
+    xmls = OrderedDict()
+    for file in os.listdir(xml_dir):
+        file_without_ext, ext = os.path.splitext(file)
+        if ext == ANNOTATION_EXTENTION:
+            xmls[file_without_ext] = os.path.join(xml_dir, file)
+
+    pairs = [(stem, img_file, xmls.get(stem)) for stem, img_file in images.items()]
+    pairs += [(stem, None, xml_file) for stem, xml_file in xmls.items() if stem not in images]
+    return pairs
+
+
+def load_record(stem, img_file, xml_file, stats=None, xml_data=None, image_header=None, transform=None):
+    """
+    Parse one pair; ``xml_data`` and ``image_header`` are its bytes when they were already read ahead.
+
+    ``transform`` is a CoordinateTransform applied to the annotation (boxes and size) before the rules see it.
+    """
+    record = AnnotationRecord(stem, img_file, xml_file, stats)
+    if image_header is not None:
+        start = clock()
+        record._image_size = read_image_size(io.BytesIO(image_header))
+        # A header that can't be parsed falls back to the probe from the file.
+        record.probed = record._image_size is not None
+        if stats is not None:
+            stats.add('probe', start)
+    if xml_file is None:
+        return record
+
+    start = clock()
+    try:
+        ann = read_voc(io.BytesIO(xml_data) if xml_data is not None else xml_file)
+        # Like labelImg files without any <object>, these have no usable annotation.
+        if len(ann.class_ids):
+            boxes, record.width, record.height = ann.boxes, ann.width, ann.height
+            if transform is not None and ann.width is not None and ann.height is not None:
+                boxes, width, height = transform.apply_boxes(ann.boxes, ann.width, ann.height)
+                record.width, record.height = int(width), int(height)
+            record.names = ann.names()
+            # labelImg has the origin on the left top corner and we want it on the left bottom one.
+            record.boxes = invert_boxes(boxes, record.height)
+    except Exception as e:
+        print(e)
+        print(f'Error loading annotation xml for file {stem + ANNOTATION_EXTENTION}')
+        record.error = str(e)
+        record.names = None
+        record.boxes = None
+        if stats is not None:
+            stats.error(stem, xml_file, 'parse', e)
+    if stats is not None:
+        stats.add('parse', start)
+    return record
+
+
+class Rule:
+    """
+    A validation check over single records.
+
+    ``check`` returns a list of ``(tag, detail)`` hits for one record; the engine collects them per tag and
+    ``subdir`` names the output folder the flagged files are copied to.
+    """
+
+    copy_image = True
+    copy_xml = True
+
+    def check(self, record):
+        raise NotImplementedError
+
+    def subdir(self, tag):
+        raise NotImplementedError
+
+    def tags(self):
+        """ Tags whose output folder is created even when nothing was flagged. """
+        return []
+
+    def copies(self, tag):
+        """ Whether the (image, xml) of a file flagged with ``tag`` go into its folder. """
+        return self.copy_image, self.copy_xml
+
+    def summary(self, findings):
+        pass
+
+
+class MissingXml(Rule):
+    """ Any files without annotation? """
+
+    copy_xml = False
+
+    def check(self, record):
+        if record.img_file is not None and record.xml_file is None:
+            return [(None, None)]
+        return []
+
+    def subdir(self, tag):
+        return 'missing_xml'
+
+    def tags(self):
+        return [None]
+
+    def summary(self, findings):
+        print(f'Number of images missing xml: {len(findings.get(None, []))}')
+
+
+class MissingImage(Rule):
+    """ Any stray annotation lying around? """
+
+    copy_image = False
+
+    def check(self, record):
+        if record.xml_file is not None and record.img_file is None:
+            return [(None, None)]
+        return []
+
+    def subdir(self, tag):
+        return 'missing_image'
+
+    def tags(self):
+        return [None]
+
+    def summary(self, findings):
+        print(f'Number of xmls missing image: {len(findings.get(None, []))}')
+
+
+class EmptyAnnotation(Rule):
+
+    copy_image = False
+
+    def check(self, record):
+        if record.names is not None and not set(record.names):
+            return [(None, None)]
+        return []
+
+    def subdir(self, tag):
+        return 'empty_annotation'
+
+    def tags(self):
+        return [None]
+
+
+class InvalidCoordinates(Rule):
+    """ Image size and boxes must agree with the actual image, with a 5% tolerance. """
+
+    copy_xml = False
+
+    def __init__(self, tolerance=0.05):
+        self.tolerance = tolerance
+
+    def check(self, record):
+        if record.img_file is None or record.xml_file is None or record.names is None:
+            return []
+
+        size = record.image_size()
+        # A side of 0 can't be compared against, like in vectorized_checks.invalid_coordinates.
+        if size is None or size[0] <= 0 or size[1] <= 0:
+            return [(None, 'unreadable image')]
+        img_h, img_w = size
+
+        if abs(img_h - record.height) / img_h > self.tolerance or abs(img_w - record.width) / img_w > self.tolerance:
+            return [(None, 'size')]
+
+        hits = []
+        max_w = img_w * (1 + self.tolerance)
+        max_h = img_h * (1 + self.tolerance)
+        for x1, y1, x2, y2 in record.boxes:
+            if x1 > max_w or x2 > max_w or y1 > max_h or y2 > max_h:
+                hits.append((None, 'box'))
+        return hits
+
+    def subdir(self, tag):
+        return 'invalid_coordinates'
+
+    def tags(self):
+        return [None]
+
+    def summary(self, findings):
+        print(f'Number of xml files with invalid coordinates: {len(findings.get(None, []))}')
+
+
+class InvalidBoxArea(Rule):
+    """ Boxes with zero or negative width or height. """
+
+    copy_image = False
+
+    def check(self, record):
+        if record.names is None:
+            return []
+        return [(None, 'area') for x1, y1, x2, y2 in record.boxes if x2 <= x1 or y2 <= y1]
+
+    def subdir(self, tag):
+        return 'invalid_box_area'
+
+    def tags(self):
+        return [None]
+
+    def summary(self, findings):
+        print(f'Number of boxes with zero or negative area: {len(findings.get(None, []))}')
+
+
+class DuplicateBoxes(Rule):
+    """ Boxes of one class stacked on top of each other, found with a sort and sweep instead of all pairs. """
+
+    copy_image = False
+
+    def __init__(self, iou_threshold=DEFAULT_IOU):
+        self.iou_threshold = iou_threshold
+
+    def check(self, record):
+        if not record.names:
+            return []
+        class_ids = {}
+        groups = [class_ids.setdefault(name, len(class_ids)) for name in record.names]
+        n_duplicates = int(duplicate_rows(record.boxes, groups, self.iou_threshold).sum())
+        if not n_duplicates:
+            return []
+        return [(None, (n_duplicates, len(record.names)))]
+
+    def subdir(self, tag):
+        return 'duplicate_boxes'
+
+    def tags(self):
+        return [None]
+
+    def summary(self, findings):
+        hits = findings.get(None, [])
+        n_duplicates = sum(n for _, (n, _) in hits)
+        n_boxes = sum(total for _, (_, total) in hits)
+        print(f'Number of files with duplicate boxes (IoU > {self.iou_threshold}): {len(hits)}, '
+              f'{n_duplicates} of their {n_boxes} boxes')
+        for stem, (n, total) in hits:
+            print('duplicate boxes: ', stem + ANNOTATION_EXTENTION, f'{n} of {total} ({n / total:.1%})')
+
+
+def count_names(names):
+    counts = {}
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def iter_records(pairs, stats=None, io_concurrency=None, transform=None):
+    """
+    Load the records of ``pairs`` in order.
+
+    With ``io_concurrency`` the xmls and image headers are read ahead by that many concurrent reads while earlier
+    records are parsed, which hides the latency of network storage.
+    """
+    if not io_concurrency:
+        for stem, img_file, xml_file in pairs:
+            yield load_record(stem, img_file, xml_file, stats, transform=transform)
+        return
+    jobs = (((xml_file, None), (img_file, IMAGE_HEADER_BYTES)) for _, img_file, xml_file in pairs)
+    for (stem, img_file, xml_file), (xml_data, image_header) in zip(pairs, iter_reads(jobs, io_concurrency)):
+        # A missing or unparseable header falls back to the lazy probe from the file.
+        yield load_record(stem, img_file, xml_file, stats, xml_data, image_header, transform)
+
+
+def check_pairs(pairs, rules, stats=None, io_concurrency=None, transform=None, classes=None):
+    """
+    Parse and check a chunk of pairs.
+
+    Only the hits are returned, as compact ``(stem, [(rule_index, tag, detail), ...])`` tuples, so worker
+    processes send back a few bytes per flagged file instead of whole records. Timings and errors go to ``stats``.
+    """
+    return check_records(iter_records(pairs, stats, io_concurrency, transform), rules, stats, classes)
+
+
+def check_records(records, rules, stats=None, classes=None):
+    """
+    Run all rules over already loaded records; returns the hits like check_pairs.
+
+    A ``classes`` dict gets the class names of every parsed xml, for DatasetIndex.record_classes.
+    """
+    stats = stats if stats is not None else RunStats(len(rules))
+    results = []
+    n_checked = 0
+    # The time between two records is what loading and checking the later one took.
+    file_start = time.perf_counter()
+    for record in records:
+        hits = []
+        for rule_index, rule in enumerate(rules):
+            start = clock()
+            for tag, detail in rule.check(record):
+                hits.append((rule_index, tag, detail))
+            stats.add_rule(rule_index, start)
+        if hits:
+            results.append((record.stem, hits))
+        if classes is not None and record.xml_file is not None:
+            classes[record.xml_file] = None if record.error is not None else record.names or []
+        n_checked += 1
+        if stats.slowest_files:
+            now = time.perf_counter()
+            stats.add_file(record.stem, record.xml_file or record.img_file, now - file_start)
+            file_start = now
+    stats.count('checked', n_checked)
+    return results
+
+
+_worker_rules = None
+_worker_io_concurrency = None
+_worker_transform = None
+_worker_slowest_files = None
+_worker_classes = False
+
+
+def _init_worker(rules, io_concurrency=None, transform=None, slowest_files=None, classes=False):
+    global _worker_rules, _worker_io_concurrency, _worker_transform, _worker_slowest_files, _worker_classes
+    _worker_rules = rules
+    _worker_io_concurrency = io_concurrency
+    _worker_transform = transform
+    _worker_slowest_files = slowest_files
+    _worker_classes = classes
+
+
+def _check_chunk(pairs):
+    start = time.process_time()
+    stats = RunStats(len(_worker_rules), slowest_files=_worker_slowest_files)
+    classes = {} if _worker_classes else None
+    results = check_pairs(pairs, _worker_rules, stats, _worker_io_concurrency, _worker_transform, classes)
+    stats.worker_cpu = time.process_time() - start
+    return results, stats, classes
+
+
+def run_rules(pairs, rules, workers=1, cache=None, stats=None, io_concurrency=None, transform=None, index=None):
+    """
+    Parse every pair once and run all rules over it, optionally spread over a pool of ``workers`` processes.
+
+    With a ``ValidationCache`` only new or changed pairs are checked; the findings of the others come from the cache.
+    ``io_concurrency`` reads files ahead asynchronously, in every worker. ``transform`` preprocesses every annotation.
+    The class counts of the xmls a DatasetIndex has pending are taken from the records parsed here into ``index``.
+
+    Returns one ``{tag: [(stem, detail), ...]}`` dict per rule, in the order the pairs were given, so the result
+    does not depend on the number of workers. Timings and errors go to ``stats``, merged over the workers.
+    """
+    stats = stats if stats is not None else RunStats(len(rules))
+    classes = {} if index is not None and index.pending else None
+    if cache is not None:
+        hits_by_stem, stale = cache.lookup(pairs)
+        if classes is not None:
+            # An xml the index has no counts for yet is parsed again even when its findings are cached.
+            stale_stems = {stem for stem, _, _ in stale}
+            stale = [pair for pair in pairs if pair[0] in stale_stems or pair[2] in index.pending]
+            for stem, _, _ in stale:
+                hits_by_stem.pop(stem, None)
+        print(f'Reusing cached results for {len(hits_by_stem)} of {len(pairs)} files')
+        stats.count('cached', len(hits_by_stem))
+    else:
+        hits_by_stem, stale = {}, pairs
+
+    if workers > 1 and len(stale) > 1:
+        chunk_size = max(1, min(256, len(stale) // (workers * 4)))
+        chunks = [stale[i:i + chunk_size] for i in range(0, len(stale), chunk_size)]
+        results = []
+        with Pool(processes=workers, initializer=_init_worker,
+                  initargs=(rules, io_concurrency, transform, stats.slowest_files, classes is not None)) as pool:
+            # imap keeps the chunk order, which is what makes the merge deterministic.
+            for chunk_results, chunk_stats, chunk_classes in pool.imap(_check_chunk, chunks):
+                results.extend(chunk_results)
+                stats.merge(chunk_stats)
+                if classes is not None:
+                    classes.update(chunk_classes)
+    else:
+        results = check_pairs(stale, rules, stats, io_concurrency, transform, classes)
+    fresh = dict(results)
+    if classes is not None:
+        index.record_classes(classes)
+
+    if cache is not None:
+        cache.update(stale, fresh)
+        cache.prune(pairs)
+    hits_by_stem.update(fresh)
+    return collect_findings(pairs, rules, hits_by_stem)
+
+
+def collect_findings(pairs, rules, hits_by_stem):
+    """ One ``{tag: [(stem, detail), ...]}`` dict per rule from the hits per stem, in the order of ``pairs``. """
+    findings = [OrderedDict() for _ in rules]
+    for stem, _, _ in pairs:
+        for rule_index, tag, detail in hits_by_stem.get(stem, []):
+            findings[rule_index].setdefault(tag, []).append((stem, detail))
+    return findings
+
+
+def iter_archive_records(archives, stats=None, transform=None):
+    """
+    Records of the image/xml pairs in zip or tar ``archives``, read in one sequential pass without extracting them.
+
+    Members are paired by stem across all archives and a record is yielded as soon as both halves of a pair have been
+    seen; the rest follow at the end. Only xmls and the first IMAGE_HEADER_BYTES of images are kept until then.
+    File names are archive!member paths.
+    """
+    # stem: [image member path, image size, xml member path, xml bytes]
+    pending = OrderedDict()
+    for archive in archives:
+        for name, f in iter_members(archive, (IMAGE_EXTENSION, ANNOTATION_EXTENTION)):
+            stem, ext = os.path.splitext(os.path.basename(name))
+            entry = pending.setdefault(stem, [None, None, None, None])
+            if ext == IMAGE_EXTENSION:
+                start = clock()
+                entry[0] = member_path(archive, name)
+                entry[1] = probe_image_stream(f, IMAGE_HEADER_BYTES)
+                if stats is not None:
+                    stats.add('probe', start)
+                    if entry[1] is None:
+                        stats.error(stem, entry[0], 'probe', 'unreadable image')
+            else:
+                entry[2] = member_path(archive, name)
+                entry[3] = f.read()
+            if entry[0] is not None and entry[2] is not None:
+                del pending[stem]
+                yield _archive_record(stem, entry, stats, transform)
+    for stem, entry in pending.items():
+        yield _archive_record(stem, entry, stats, transform)
+
+
+def _archive_record(stem, entry, stats, transform):
+    img_file, image_size, xml_file, xml_data = entry
+    record = load_record(stem, img_file, xml_file, stats, xml_data=xml_data, transform=transform)
+    record._image_size = image_size
+    record.probed = True
+    return record
+
+
+def run_archive_rules(archives, rules, stats=None, transform=None):
+    """ Check the pairs of ``archives`` in one pass over them; returns the pairs and the findings like run_rules. """
+    stats = stats if stats is not None else RunStats(len(rules))
+    pairs = []
+
+    def records():
+        for record in iter_archive_records(archives, stats, transform):
+            pairs.append((record.stem, record.img_file, record.xml_file))
+            yield record
+
+    hits_by_stem = dict(check_records(records(), rules, stats))
+    stats.stages['scan'][2] += len(pairs)
+    return pairs, collect_findings(pairs, rules, hits_by_stem)
+
+
+def write_findings(pairs, rules, findings, validation_output_dir, output=None, stats=None):
+    """
+    Put flagged files into one folder per rule/tag and print the counts.
+
+    ``output`` is a TriageOutput saying whether files are copied, linked or only listed; by default they are copied.
+    The time spent placing files goes to ``stats``.
+    """
+
+    output = output if output is not None else TriageOutput()
+    files = {stem: (img_file, xml_file) for stem, img_file, xml_file in pairs}
+    jobs = []
+    for rule, rule_findings in zip(rules, findings):
+        if output.folders:
+            for tag in rule.tags():
+                subdir = os.path.join(validation_output_dir, rule.subdir(tag))
+                if not os.path.isdir(subdir):
+                    os.mkdir(subdir)
+
+        for tag, hits in rule_findings.items():
+            subdir = os.path.join(validation_output_dir, rule.subdir(tag))
+            if output.folders and not os.path.isdir(subdir):
+                os.mkdir(subdir)
+            copy_image, copy_xml = rule.copies(tag)
+            copied = set()
+            for stem, _ in hits:
+                if stem in copied:
+                    continue
+                copied.add(stem)
+                img_file, xml_file = files[stem]
+                if copy_image and img_file is not None:
+                    jobs.append((rule.subdir(tag), stem, img_file, os.path.join(subdir, file_name(img_file))))
+                if copy_xml and xml_file is not None:
+                    jobs.append((rule.subdir(tag), stem, xml_file, os.path.join(subdir, file_name(xml_file))))
+
+        rule.summary(rule_findings)
+
+    start = clock()
+    output.write(jobs)
+    if stats is not None:
+        stats.add('copy', start, files=len(jobs))
+    output.summary()
+
+
+def list_pairs(img_dir, xml_dir, index=None):
+    """ The pairs of a dataset, from a refreshed DatasetIndex when there is one and else from scanning both folders. """
+    if index is None:
+        return scan_dataset(img_dir, xml_dir)
+    added, changed, removed = index.refresh()
+    print(f'Dataset index: {added} files added, {changed} changed, {removed} removed')
+    return index.pairs()
+
+
+def run_validation(img_dir, xml_dir, validation_output_dir, rules, workers=1, cache=None, output=None, stats=None,
+                   index=None, io_concurrency=None, transform=None):
+    """ Scan (or refresh ``index``), check and write the findings; returns the pairs and the findings. """
+    start = clock()
+    pairs = list_pairs(img_dir, xml_dir, index)
+    if stats is not None:
+        stats.add('scan', start, files=len(pairs))
+    findings = run_rules(pairs, rules, workers=workers, cache=cache, stats=stats, io_concurrency=io_concurrency,
+                         transform=transform, index=index)
+    write_findings(pairs, rules, findings, validation_output_dir, output=output, stats=stats)
+    return pairs, findings
@@ -0,0 +1,220 @@
+import heapq
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPORT_VERSION = 1
+REPORT_FILE = 'validation_report.json'
+# 'check' is the time spent in rules minus the image probes they triggered.
+STAGES = ('scan', 'parse', 'probe', 'check', 'copy')
+
+
+def clock():
+    """ (wall, cpu) now, to pass back to RunStats.add. """
+    return time.perf_counter(), time.process_time()
+
+
+class RunStats:
+    """
+    Wall and CPU time per stage and per rule, counters and per-file errors of one validation run.
+
+    Cheap enough to be always on. Worker processes fill their own and the parent merges them, so with workers the
+    times are summed over all processes. With ``slowest_files`` the wall time of every file (loading and checks) is
+    also kept for the that many slowest ones, e.g. to find giant xmls or corrupt images.
+    """
+
+    def __init__(self, n_rules=0, slowest_files=None):
+        # stage: [wall, cpu, files]
+        self.stages = OrderedDict((stage, [0.0, 0.0, 0]) for stage in STAGES)
+        # [wall, cpu] per rule index
+        self.rules = [[0.0, 0.0] for _ in range(n_rules)]
+        self.counters = OrderedDict()
+        # (stem, file, stage, reason)
+        self.errors = []
+        self.slowest_files = slowest_files
+        # Min-heap of (wall, stem, file), at most slowest_files long.
+        self.file_times = []
+        # CPU time of worker processes, which the process clock of this one doesn't see.
+        self.worker_cpu = 0.0
+
+    def add(self, stage, start, files=1):
+        wall, cpu = start
+        entry = self.stages[stage]
+        entry[0] += time.perf_counter() - wall
+        entry[1] += time.process_time() - cpu
+        entry[2] += files
+
+    def add_rule(self, rule_index, start):
+        wall, cpu = start
+        while len(self.rules) <= rule_index:
+            self.rules.append([0.0, 0.0])
+        entry = self.rules[rule_index]
+        entry[0] += time.perf_counter() - wall
+        entry[1] += time.process_time() - cpu
+
+    def add_file(self, stem, file, wall):
+        """ Time one file took, kept only while it is among the slowest; does nothing unless enabled. """
+        if not self.slowest_files:
+            return
+        if len(self.file_times) < self.slowest_files:
+            heapq.heappush(self.file_times, (wall, stem, file))
+        elif wall > self.file_times[0][0]:
+            heapq.heapreplace(self.file_times, (wall, stem, file))
+
+    def slowest(self):
+        """ [(wall, stem, file), ...] of the slowest files, slowest first. """
+        return sorted(self.file_times, reverse=True)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def error(self, stem, file, stage, reason):
+        self.errors.append((stem, file, stage, str(reason)))
+
+    def merge(self, other, rule_indices=None):
+        """ Add ``other`` in; ``rule_indices`` maps its rule indices to ours when it ran a subset of the rules. """
+        for stage, (wall, cpu, files) in other.stages.items():
+            entry = self.stages[stage]
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] += files
+        for local_index, (wall, cpu) in enumerate(other.rules):
+            rule_index = local_index if rule_indices is None else rule_indices[local_index]
+            while len(self.rules) <= rule_index:
+                self.rules.append([0.0, 0.0])
+            self.rules[rule_index][0] += wall
+            self.rules[rule_index][1] += cpu
+        for name, n in other.counters.items():
+            self.count(name, n)
+        self.errors.extend(other.errors)
+        self.worker_cpu += other.worker_cpu
+        for wall, stem, file in other.file_times:
+            self.add_file(stem, file, wall)
+
+
+def peak_rss():
+    """ Peak resident memory in bytes of this process and of its largest finished child, None where unknown. """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def build_report(pairs, rules, findings, stats, started, wall, cpu, options=None):
+    """
+    The report of a run as a json-ready dict; ``started`` is the epoch time the run began, ``wall`` its length and
+    ``cpu`` the CPU time this process spent on it. The CPU time of the workers, from ``stats``, is added to that.
+    """
+    stages = OrderedDict((stage, list(entry)) for stage, entry in stats.stages.items())
+    rule_wall = sum(wall_time for wall_time, _ in stats.rules)
+    rule_cpu = sum(cpu_time for _, cpu_time in stats.rules)
+    stages['check'] = [max(0.0, rule_wall - stages['probe'][0]), max(0.0, rule_cpu - stages['probe'][1]),
+                       stats.counters.get('checked', 0)]
+
+    rule_reports = []
+    for rule_index, (rule, rule_findings) in enumerate(zip(rules, findings)):
+        wall_time, cpu_time = stats.rules[rule_index] if rule_index < len(stats.rules) else (0.0, 0.0)
+        folders = OrderedDict()
+        for tag in list(rule.tags()) + [tag for tag in rule_findings if tag not in rule.tags()]:
+            hits = rule_findings.get(tag, [])
+            folders[rule.subdir(tag)] = OrderedDict([('files', len({stem for stem, _ in hits})),
+                                                     ('hits', len(hits))])
+        rule_reports.append(OrderedDict([('rule', type(rule).__name__),
+                                         ('wall_s', round(wall_time, 6)),
+                                         ('cpu_s', round(cpu_time, 6)),
+                                         ('findings', folders)]))
+
+    self_rss, children_rss = peak_rss()
+    return OrderedDict([
+        ('version', REPORT_VERSION),
+        ('started', datetime.fromtimestamp(started, timezone.utc).isoformat()),
+        ('wall_s', round(wall, 6)),
+        ('cpu_s', round(cpu + stats.worker_cpu, 6)),
+        ('options', options or {}),
+        ('files', OrderedDict([('pairs', len(pairs)),
+                               ('images', sum(1 for _, img_file, _ in pairs if img_file is not None)),
+                               ('xmls', sum(1 for _, _, xml_file in pairs if xml_file is not None))] +
+                              list(stats.counters.items()))),
+        ('stages', OrderedDict((stage, OrderedDict([('wall_s', round(wall_time, 6)),
+                                                    ('cpu_s', round(cpu_time, 6)),
+                                                    ('files', files),
+                                                    ('files_per_s', round(files / wall_time, 1) if wall_time else None)]))
+                               for stage, (wall_time, cpu_time, files) in stages.items())),
+        ('rules', rule_reports),
+        ('errors', [OrderedDict([('stem', stem), ('file', file), ('stage', stage), ('error', reason)])
+                    for stem, file, stage, reason in stats.errors]),
+        ('slowest_files', [OrderedDict([('stem', stem), ('file', file), ('wall_s', round(wall, 6))])
+                           for wall, stem, file in stats.slowest()]),
+        ('peak_rss_bytes', self_rss),
+        ('peak_rss_workers_bytes', children_rss),
+    ])
+
+
+def write_report(report, path):
+    _write_atomic(path, json.dumps(report, indent=2) + '\n')
+
+
+def prometheus_text(report):
+    """ The report as Prometheus text exposition, for the node exporter's textfile collector. """
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ','.join(f'{key}="{_escape(str(v))}"' for key, v in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+    metric('validation_last_run_timestamp_seconds', 'When the last validation run finished.',
+           [({}, round(time.time(), 3))])
+    metric('validation_run_seconds', 'Wall time of the last validation run.', [({}, report['wall_s'])])
+    metric('validation_files', 'Files seen by the last validation run.',
+           [({'kind': kind}, n) for kind, n in report['files'].items()])
+    metric('validation_stage_seconds', 'Time per stage, summed over worker processes.',
+           [({'stage': stage, 'clock': clock_name}, values[f'{clock_name}_s'])
+            for stage, values in report['stages'].items() for clock_name in ('wall', 'cpu')])
+    metric('validation_stage_files_per_second', 'Files per second of wall time per stage.',
+           [({'stage': stage}, values['files_per_s']) for stage, values in report['stages'].items()])
+    metric('validation_rule_seconds', 'Time spent in every rule, summed over worker processes.',
+           [({'rule': rule['rule'], 'index': i, 'clock': clock_name}, rule[f'{clock_name}_s'])
+            for i, rule in enumerate(report['rules']) for clock_name in ('wall', 'cpu')])
+    metric('validation_findings_files', 'Files flagged per rule folder.',
+           [({'rule': rule['rule'], 'folder': folder}, counts['files'])
+            for rule in report['rules'] for folder, counts in rule['findings'].items()])
+    errors = OrderedDict()
+    for error in report['errors']:
+        errors[error['stage']] = errors.get(error['stage'], 0) + 1
+    metric('validation_errors', 'Files that failed to load, per stage.',
+           [({'stage': stage}, n) for stage, n in errors.items()] or [({'stage': 'parse'}, 0)])
+    metric('validation_peak_rss_bytes', 'Peak resident memory.',
+           [({'process': 'main'}, report['peak_rss_bytes']), ({'process': 'workers'}, report['peak_rss_workers_bytes'])])
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(report, path):
+    _write_atomic(path, prometheus_text(report))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path, text):
+    """ Write through a temporary file, so readers like the textfile collector never see half a file. """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,310 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+try:
+    from inotify_simple import INotify
+    from inotify_simple import flags
+except ImportError:
+    INotify = None
+
+from validation_engine import ANNOTATION_EXTENTION
+from validation_engine import IMAGE_EXTENSION
+from validation_engine import check_records
+from validation_engine import iter_records
+from validation_engine import load_record
+from validation_engine import scan_dataset
+from validation_report import RunStats
+
+# Changes to a pair are validated once its files were quiet this many seconds: an image and its xml saved together,
+# or an editor writing a file in several goes, give one validation.
+DEFAULT_DEBOUNCE = 0.05
+# Seconds between two directory scans without inotify; each scan stats every file, so not much lower on big datasets.
+# A change then shows after up to DEFAULT_POLL_INTERVAL + DEFAULT_DEBOUNCE, well above the ~0.1s of inotify: polling
+# is the fallback for network mounts and machines without inotify_simple, not the way to get interactive latency.
+DEFAULT_POLL_INTERVAL = 0.25
+WATCHED_EXTENSIONS = (IMAGE_EXTENSION, ANNOTATION_EXTENTION)
+
+
+class PollingWatcher:
+    """ Finds changed, new and deleted files by scanning the directories every ``interval`` seconds. """
+
+    def __init__(self, dirs, interval=DEFAULT_POLL_INTERVAL):
+        self.dirs = list(OrderedDict.fromkeys(dirs))
+        self.interval = interval
+        self.files = self._scan()
+        self.next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        files = {}
+        for path in self.dirs:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(WATCHED_EXTENSIONS):
+                        st = entry.stat()
+                        files[entry.path] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    def changes(self, timeout):
+        """ Paths changed since the last call, waiting at most ``timeout`` seconds (None: until the next scan). """
+        wait = self.next_scan - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(wait, 0))
+        self.next_scan = time.monotonic() + self.interval
+        files = self._scan()
+        changed = [path for path, st in files.items() if self.files.get(path) != st]
+        changed += [path for path in self.files if path not in files]
+        self.files = files
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """ Gets the files written, moved in or out and deleted from inotify, as soon as it happens. """
+
+    def __init__(self, dirs):
+        self.inotify = INotify()
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+        self.dirs = {self.inotify.add_watch(path, mask): path for path in OrderedDict.fromkeys(dirs)}
+
+    def changes(self, timeout):
+        events = self.inotify.read(timeout=None if timeout is None else max(int(timeout * 1000), 0))
+        return [os.path.join(self.dirs[event.wd], event.name) for event in events
+                if event.name.endswith(WATCHED_EXTENSIONS)]
+
+    def close(self):
+        self.inotify.close()
+
+
+def make_watcher(dirs, poll=False, interval=DEFAULT_POLL_INTERVAL):
+    """ An InotifyWatcher where inotify_simple is installed and ``poll`` is off, else a PollingWatcher. """
+    if INotify is not None and not poll:
+        return InotifyWatcher(dirs)
+    return PollingWatcher(dirs, interval)
+
+
+def change_time(path, since):
+    """
+    Wall clock time ``path`` was changed, from its mtime, so that latencies count from the write and not from when the
+    watcher noticed it. Deleted files, and files moved in with an mtime from before ``since`` (when the watcher last
+    looked), count from now.
+    """
+    now = time.time()
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return now
+    return mtime if since <= mtime <= now else now
+
+
+class WatchState:
+    """
+    The findings and class counts of every pair of a watched dataset, updated one pair at a time.
+
+    ``validate`` re-checks a single pair with the same rules as a full run and moves the running totals, per rule
+    folder and per class, from its old result to its new one. Read from the HTTP endpoint's threads under ``lock``.
+    """
+
+    def __init__(self, img_dir, xml_dir, rules, transform=None):
+        self.img_dir = img_dir
+        self.xml_dir = xml_dir
+        self.rules = rules
+        self.transform = transform
+        self.lock = threading.Lock()
+        # stem: [(folder, detail), ...] of the flagged pairs, and stem: {class: count} of the annotated ones.
+        self.findings = {}
+        self.classes = {}
+        self.finding_totals = Counter()
+        self.class_totals = Counter()
+        self.stems = set()
+
+    def pair(self, stem):
+        """ (stem, image, xml) as they are on disk now, None for a missing file. """
+        img_file = os.path.join(self.img_dir, stem + IMAGE_EXTENSION)
+        xml_file = os.path.join(self.xml_dir, stem + ANNOTATION_EXTENTION)
+        return stem, img_file if os.path.isfile(img_file) else None, xml_file if os.path.isfile(xml_file) else None
+
+    def load(self, pairs):
+        """ Check every pair of the dataset once, to start the totals from. """
+        stats = RunStats(len(self.rules))
+        records = iter_records(pairs, stats, transform=self.transform)
+        with self.lock:
+            for record in records:
+                hits = check_records([record], self.rules, stats)
+                self._update(record.stem, record.names, hits[0][1] if hits else [])
+        return stats
+
+    def validate(self, stem):
+        """ Check one pair as it is now and return its event; a pair whose files are both gone is dropped. """
+        stem, img_file, xml_file = self.pair(stem)
+        event = OrderedDict([('time', time.time()), ('stem', stem), ('img_file', img_file), ('xml_file', xml_file)])
+        if img_file is None and xml_file is None:
+            with self.lock:
+                self._update(stem, None, None)
+            event['removed'] = True
+            return event
+        stats = RunStats(len(self.rules))
+        record = load_record(stem, img_file, xml_file, stats, transform=self.transform)
+        hits = check_records([record], self.rules, stats)
+        with self.lock:
+            findings, classes = self._update(stem, record.names, hits[0][1] if hits else [])
+        event['findings'] = [OrderedDict([('rule', folder), ('detail', detail)]) for folder, detail in findings]
+        event['classes'] = classes
+        event['errors'] = [OrderedDict([('file', file), ('stage', stage), ('error', reason)])
+                           for _, file, stage, reason in stats.errors]
+        return event
+
+    def _update(self, stem, names, hits):
+        """ Replace the result of ``stem``; ``hits`` None removes it. Callers hold the lock. """
+        self.finding_totals.subtract(folder for folder, _ in self.findings.pop(stem, []))
+        self.class_totals.subtract(self.classes.pop(stem, {}))
+        if hits is None:
+            self.stems.discard(stem)
+            return [], {}
+        self.stems.add(stem)
+        findings = [(self.rules[rule_index].subdir(tag), detail) for rule_index, tag, detail in hits]
+        classes = dict(Counter(names or ()))
+        if findings:
+            self.findings[stem] = findings
+            self.finding_totals.update(folder for folder, _ in findings)
+        if classes:
+            self.classes[stem] = classes
+            self.class_totals.update(classes)
+        return findings, classes
+
+    def snapshot(self):
+        """ The running totals, as the endpoint serves them. """
+        with self.lock:
+            return OrderedDict([('files', len(self.stems)),
+                                ('flagged_files', len(self.findings)),
+                                ('findings', OrderedDict(sorted((k, v) for k, v in self.finding_totals.items() if v))),
+                                ('classes', OrderedDict(sorted((k, v) for k, v in self.class_totals.items() if v)))])
+
+
+class EventLog:
+    """ Publishes every event as one json line, to a file or to stdout for '-', flushed straight away. """
+
+    def __init__(self, path):
+        self.file = sys.stdout if path == '-' else open(path, 'a')
+
+    def publish(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def print_event(event):
+    """ One readable line per validated pair, for an annotator watching the terminal. """
+    if event.get('removed'):
+        result = 'removed'
+    elif event['findings']:
+        result = ', '.join(f['rule'] if f['detail'] is None else f"{f['rule']} ({f['detail']})"
+                           for f in event['findings'])
+    else:
+        result = 'ok'
+    print(f"{event['stem']}: {result} [{event['latency_ms']} ms]")
+
+
+def serve_state(state, port, host='127.0.0.1'):
+    """
+    Serve the running totals on http://host:port/status and the findings of the flagged pairs on /findings, from a
+    background thread. Returns the server, to shut down.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path == '/status':
+                body = state.snapshot()
+            elif self.path == '/findings':
+                with state.lock:
+                    body = OrderedDict(sorted(state.findings.items()))
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='watch-endpoint', daemon=True).start()
+    return server
+
+
+def watch(img_dir, xml_dir, rules, transform=None, events=None, port=None, debounce=DEFAULT_DEBOUNCE, poll=False,
+          poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Validate a dataset as files land in it, until interrupted.
+
+    Every pair is checked once at the start; after that a pair is checked again whenever its image or xml is written,
+    moved or deleted and then left alone for ``debounce`` seconds. Each result goes out as an event: a json line to
+    ``events`` ('-' for stdout), or else a readable line on stdout. With ``port`` the totals per rule folder and per
+    class, and the current findings, are served on localhost.
+    """
+    watcher = make_watcher([img_dir, xml_dir], poll, poll_interval)
+    if isinstance(watcher, PollingWatcher):
+        reason = 'inotify_simple is not installed' if INotify is None and not poll else '--poll is set'
+        print(f'Warning: {reason}, so the folders are scanned every {watcher.interval}s; results can take up '
+              f'to {watcher.interval + debounce:.2f}s after a change instead of about {debounce:.2f}s with inotify.')
+    state = WatchState(img_dir, xml_dir, rules, transform)
+    log = EventLog(events) if events else None
+    server = None
+    try:
+        looked = time.time()
+        start = time.perf_counter()
+        # The watcher runs first, so nothing written while the dataset is loaded is missed.
+        stats = state.load(scan_dataset(img_dir, xml_dir))
+        print(f'Watching {img_dir} and {xml_dir} ({type(watcher).__name__}): {len(state.stems)} files checked in '
+              f'{time.perf_counter() - start:.2f}s, {len(state.findings)} flagged, {len(stats.errors)} errors')
+        if port:
+            server = serve_state(state, port)
+            print(f'Totals on http://127.0.0.1:{server.server_address[1]}/status')
+
+        # stem: wall clock time of its first change not validated yet, and monotonic time of its last one.
+        first_change = {}
+        last_change = {}
+        while True:
+            timeout = min(last_change.values()) + debounce - time.monotonic() if last_change else None
+            since, looked = looked, time.time()
+            for path in watcher.changes(timeout):
+                stem = os.path.splitext(os.path.basename(path))[0]
+                changed = change_time(path, since)
+                first_change[stem] = min(first_change.get(stem, changed), changed)
+                last_change[stem] = time.monotonic()
+            now = time.monotonic()
+            for stem in [stem for stem, changed in last_change.items() if now - changed >= debounce]:
+                del last_change[stem]
+                event = state.validate(stem)
+                event['latency_ms'] = round((time.time() - first_change.pop(stem)) * 1000, 1)
+                if log is not None:
+                    log.publish(event)
+                else:
+                    print_event(event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if server is not None:
+            server.shutdown()
+        if log is not None:
+            log.close()
+    return state
@@ -0,0 +1,373 @@
+import io
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from annotation_store import write_store
+from async_io import DEFAULT_CONCURRENCY
+from async_io import iter_reads
+from box_overlap import table_duplicates
+from box_table import BoxTable
+from box_table import open_store
+from image_probe import probe_image_size
+from image_probe import read_image_size
+from rule_config import ClassConstraints
+from rule_config import INVALID_CLASS_NAMES
+from validation_engine import ANNOTATION_EXTENTION
+from validation_engine import DuplicateBoxes
+from validation_engine import EmptyAnnotation
+from validation_engine import IMAGE_HEADER_BYTES
+from validation_engine import InvalidBoxArea
+from validation_engine import InvalidCoordinates
+from validation_engine import MissingImage
+from validation_engine import MissingXml
+from validation_engine import check_pairs
+from validation_report import RunStats
+from validation_report import clock
+from voc_reader import read_voc
+
+# Reasons returned by invalid_coordinates, per image.
+COORDINATES_OK = 0
+COORDINATES_UNREADABLE_IMAGE = 1
+COORDINATES_SIZE = 2
+COORDINATES_BOX = 3
+
+
+def boxes_per_image(table):
+    return np.bincount(table.boxes['image_idx'], minlength=len(table.images))
+
+
+def class_counts(table):
+    """ (n_images, n_classes) matrix of how many boxes of each class every image has. """
+    n_images = len(table.images)
+    n_classes = max(len(table.classes), 1)
+    boxes = table.boxes
+    flat = boxes['image_idx'].astype(np.int64) * n_classes + boxes['class_id']
+    return np.bincount(flat, minlength=n_images * n_classes).reshape(n_images, n_classes)
+
+
+def table_classes(table, pairs, pair_images, xml_files):
+    """ {xml: class names} of the pairs whose xml is in ``xml_files``, as check_records collects them; None: unreadable. """
+    offsets = table.image_offsets()
+    class_ids = table.boxes['class_id']
+    classes = {}
+    for (_, _, xml_file), image_idx in zip(pairs, pair_images.tolist()):
+        if xml_file not in xml_files:
+            continue
+        if image_idx < 0:
+            classes[xml_file] = None
+        else:
+            rows = class_ids[offsets[image_idx]:offsets[image_idx + 1]].tolist()
+            classes[xml_file] = [table.classes.names[c] for c in rows]
+    return classes
+
+
+def class_columns(table, counts, names):
+    """ Count columns for ``names``; classes the dataset has never seen count as zero everywhere. """
+    columns = np.zeros((counts.shape[0], len(names)), dtype=counts.dtype)
+    for i, name in enumerate(names):
+        class_id = table.classes.ids.get(name)
+        if class_id is not None:
+            columns[:, i] = counts[:, class_id]
+    return columns
+
+
+def invalid_class_rows(table, valid_classes):
+    """ Bool mask of box rows whose class is not in ``valid_classes``. """
+    valid_ids = [table.classes.ids[name] for name in valid_classes if name in table.classes.ids]
+    return ~np.isin(table.boxes['class_id'], valid_ids)
+
+
+def invalid_area_rows(table):
+    """ Bool mask of box rows with zero or negative width or height. """
+    boxes = table.boxes
+    return (boxes['x2'] <= boxes['x1']) | (boxes['y2'] <= boxes['y1'])
+
+
+def invalid_coordinates(table, img_height, img_width, tolerance=0.05, invert=True):
+    """
+    Compare every image's boxes against its real size, like InvalidCoordinates.
+
+    ``img_height``/``img_width`` hold the real image size per image, 0 when the image could not be read. With
+    ``invert`` the y coordinates are first flipped with the annotated height, as the validator does.
+
+    Returns ``(reason, hits)`` arrays per image: one of the COORDINATES_* codes and the number of hits.
+    """
+    ann_width, ann_height = table.image_sizes()
+    img_height = np.asarray(img_height, dtype=np.float64)
+    img_width = np.asarray(img_width, dtype=np.float64)
+    n_images = len(table.images)
+
+    unreadable = (img_height <= 0) | (img_width <= 0)
+    safe_h = np.where(unreadable, 1, img_height)
+    safe_w = np.where(unreadable, 1, img_width)
+    size_bad = ~unreadable & ((np.abs(safe_h - ann_height) / safe_h > tolerance) |
+                              (np.abs(safe_w - ann_width) / safe_w > tolerance))
+
+    boxes = table.boxes
+    image_idx = boxes['image_idx']
+    x1 = boxes['x1'].astype(np.float64)
+    x2 = boxes['x2'].astype(np.float64)
+    y1 = boxes['y1'].astype(np.float64)
+    y2 = boxes['y2'].astype(np.float64)
+    if invert:
+        h = ann_height[image_idx]
+        y1, y2 = h - y2, h - y1
+    max_w = (safe_w * (1 + tolerance))[image_idx]
+    max_h = (safe_h * (1 + tolerance))[image_idx]
+    out = (x1 > max_w) | (x2 > max_w) | (y1 > max_h) | (y2 > max_h)
+    box_hits = np.bincount(image_idx[out], minlength=n_images)
+
+    reason = np.full(n_images, COORDINATES_OK, dtype=np.int8)
+    hits = np.zeros(n_images, dtype=np.int64)
+    box_bad = ~unreadable & ~size_bad & (box_hits > 0)
+    reason[box_bad] = COORDINATES_BOX
+    hits[box_bad] = box_hits[box_bad]
+    reason[size_bad] = COORDINATES_SIZE
+    reason[unreadable] = COORDINATES_UNREADABLE_IMAGE
+    hits[size_bad | unreadable] = 1
+    return reason, hits
+
+
+def load_pairs(pairs, table=None, stats=None, io_concurrency=None, transform=None):
+    """
+    Fill a BoxTable from the xml side of validation pairs; image names are the pair stems.
+
+    Returns the table and, per pair, its image index in the table (-1 when it has no readable xml). Parse time and
+    errors go to ``stats``. ``io_concurrency`` reads the xmls ahead asynchronously. ``transform`` is applied to the
+    new images once they are all loaded.
+    """
+    first_image = len(table.images) if table is not None else 0
+    table = table if table is not None else BoxTable()
+    pair_images = []
+    if io_concurrency:
+        reads = iter_reads((((xml_file, None),) for _, _, xml_file in pairs), io_concurrency)
+    else:
+        reads = ((None,) for _ in pairs)
+    for (stem, img_file, xml_file), (xml_data,) in zip(pairs, reads):
+        if xml_file is None:
+            pair_images.append(-1)
+            continue
+        start = clock()
+        try:
+            ann = read_voc(io.BytesIO(xml_data) if xml_data is not None else xml_file, table.classes)
+            if ann.height is None and len(ann.class_ids):
+                raise ValueError(f'{xml_file} has no <size>')
+        except Exception as e:
+            print(e)
+            print(f'Error loading annotation xml for file {stem + ANNOTATION_EXTENTION}')
+            pair_images.append(-1)
+            if stats is not None:
+                stats.error(stem, xml_file, 'parse', e)
+                stats.add('parse', start)
+            continue
+        pair_images.append(table.add_image(stem, ann.width, ann.height, ann.class_ids, ann.boxes, source=xml_file))
+        if stats is not None:
+            stats.add('parse', start)
+            # The checks run over the whole table, so a file's own time is its parse.
+            stats.add_file(stem, xml_file, time.perf_counter() - start[0])
+    if transform is not None:
+        start = clock()
+        transform.apply_table(table, first_image)
+        if stats is not None:
+            stats.add('parse', start)
+    return table, np.array(pair_images, dtype=np.int64)
+
+
+def load_store_pairs(pairs, store_file, stats=None, io_concurrency=None, transform=None):
+    """
+    load_pairs through an annotation store: a cold load in milliseconds once the xmls have been parsed.
+
+    The table is mapped from ``store_file`` when the store holds exactly the xmls of ``pairs``, each at the size and
+    mtime it has now; unreadable xmls are kept with their error, which is reported again. Otherwise every xml is
+    parsed and the store rewritten for the next run. ``transform`` is applied after loading, the store keeps the
+    annotations as they are in the xmls.
+    """
+    stats = stats if stats is not None else RunStats()
+    start = clock()
+    xml_stats = OrderedDict()
+    for stem, _, xml_file in pairs:
+        if xml_file:
+            st = os.stat(xml_file)
+            xml_stats[xml_file] = (stem, st.st_size, st.st_mtime_ns)
+
+    table = None
+    if os.path.isfile(store_file):
+        try:
+            table = open_store(store_file)
+        except ValueError as e:
+            print(e)
+    if table is not None:
+        sections = table.store.sections
+        current = dict(zip(sections['sources'].tolist(), zip(sections['source_sizes'].tolist(),
+                                                              sections['source_mtimes'].tolist())))
+        unreadable = table.store.meta.get('unreadable', {})
+        current.update((xml_file, (size, mtime)) for xml_file, (size, mtime, _) in unreadable.items())
+        if current == {xml_file: (size, mtime) for xml_file, (_, size, mtime) in xml_stats.items()}:
+            image_of_source = {source: i for i, source in enumerate(sections['sources'].tolist())}
+            pair_images = np.array([image_of_source.get(xml_file, -1) if xml_file else -1
+                                    for _, _, xml_file in pairs], dtype=np.int64)
+            for xml_file, (_, _, reason) in unreadable.items():
+                stem = xml_stats[xml_file][0]
+                print(reason)
+                print(f'Error loading annotation xml for file {stem + ANNOTATION_EXTENTION}')
+                stats.error(stem, xml_file, 'parse', reason)
+            if transform is not None:
+                transform.apply_table(table)
+            stats.add('parse', start, files=len(xml_stats))
+            return table, pair_images
+        print(f'Annotation store {store_file} is out of date, it is rebuilt from the xmls')
+
+    table, pair_images = load_pairs(pairs, stats=stats, io_concurrency=io_concurrency)
+    start = clock()
+    errors = {file: reason for _, file, stage, reason in stats.errors if stage == 'parse'}
+    unreadable = OrderedDict((xml_file, xml_stats[xml_file][1:] + (errors.get(xml_file, ''),))
+                             for (_, _, xml_file), image_idx in zip(pairs, pair_images) if xml_file and image_idx < 0)
+    sources = [header.source for header in table.images]
+    write_store(store_file, table,
+                source_sizes=[xml_stats[source][1] for source in sources],
+                source_mtimes=[xml_stats[source][2] for source in sources],
+                meta=OrderedDict([('unreadable', unreadable)]))
+    if transform is not None:
+        transform.apply_table(table)
+    stats.add('parse', start, files=0)
+    return table, pair_images
+
+
+def run_vectorized(pairs, rules, stats=None, io_concurrency=None, transform=None, store_file=None, index=None):
+    """
+    Same result as validation_engine.run_rules, with the box-level rules evaluated over the whole dataset at once.
+
+    Rules without a vectorised version are still run per record. Timings and errors go to ``stats``. ``transform``
+    preprocesses the annotations, like in the engine. With ``store_file`` the xmls are loaded through an annotation
+    store, see load_store_pairs. The class counts of the xmls a DatasetIndex has pending go to ``index`` from the table.
+    """
+    stats = stats if stats is not None else RunStats(len(rules))
+    if store_file:
+        table, pair_images = load_store_pairs(pairs, store_file, stats=stats, io_concurrency=io_concurrency,
+                                              transform=transform)
+    else:
+        table, pair_images = load_pairs(pairs, stats=stats, io_concurrency=io_concurrency, transform=transform)
+    if index is not None and index.pending:
+        index.record_classes(table_classes(table, pairs, pair_images, index.pending))
+    stats.count('checked', len(pairs))
+    stems = [stem for stem, _, _ in pairs]
+    n_boxes = boxes_per_image(table)
+    # Pairs whose xml has objects; files without any are skipped by the box rules, like in the engine.
+    annotated = np.zeros(len(pairs), dtype=bool)
+    annotated[pair_images >= 0] = n_boxes[pair_images[pair_images >= 0]] > 0
+    image_of_pair = np.where(pair_images >= 0, pair_images, 0)
+    counts = None
+
+    findings = []
+    fallback = []
+    for rule_index, rule in enumerate(rules):
+        rule_findings = OrderedDict()
+        findings.append(rule_findings)
+        start = clock()
+
+        if isinstance(rule, MissingXml):
+            flagged = [(i, None) for i, (_, img_file, xml_file) in enumerate(pairs) if img_file and not xml_file]
+        elif isinstance(rule, MissingImage):
+            flagged = [(i, None) for i, (_, img_file, xml_file) in enumerate(pairs) if xml_file and not img_file]
+        elif isinstance(rule, EmptyAnnotation):
+            # Files without objects count as "no annotation" and are never flagged here, as in the engine.
+            flagged = []
+        elif isinstance(rule, ClassConstraints):
+            counts = class_counts(table) if counts is None else counts
+            valid_names = rule.valid_names()
+            if valid_names is not None:
+                flagged = _row_findings(table, pairs, pair_images, annotated, invalid_class_rows(table, valid_names),
+                                        detail=lambda row: table.classes.names[row['class_id']])
+                for i, detail in flagged:
+                    rule_findings.setdefault(INVALID_CLASS_NAMES, []).append((stems[i], detail))
+            # Every constraint of the rule file in one evaluation over the dataset's count matrix.
+            violated = rule.evaluate(class_columns(table, counts, rule.names))[image_of_pair] & annotated[:, np.newaxis]
+            for column, tag in enumerate(rule.count_tags):
+                hit = violated[:, column]
+                if hit.any():
+                    rule_findings[tag] = [(stems[i], None) for i in np.flatnonzero(hit)]
+            stats.add_rule(rule_index, start)
+            continue
+        elif isinstance(rule, InvalidBoxArea):
+            flagged = _row_findings(table, pairs, pair_images, annotated, invalid_area_rows(table),
+                                    detail=lambda row: 'area')
+        elif isinstance(rule, DuplicateBoxes):
+            # One sweep over every box of the dataset, grouped by image and class.
+            n_duplicates = np.bincount(table.boxes['image_idx'][table_duplicates(table, rule.iou_threshold)],
+                                       minlength=len(table.images))
+            flagged = [(i, (int(n_duplicates[pair_images[i]]), int(n_boxes[pair_images[i]])))
+                       for i in np.flatnonzero(annotated) if n_duplicates[pair_images[i]]]
+        elif isinstance(rule, InvalidCoordinates):
+            flagged = _coordinate_findings(table, pairs, pair_images, annotated, rule.tolerance, stats,
+                                           io_concurrency)
+        else:
+            fallback.append(rule_index)
+            continue
+
+        for i, detail in flagged:
+            rule_findings.setdefault(None, []).append((stems[i], detail))
+        stats.add_rule(rule_index, start)
+
+    if fallback:
+        fallback_rules = [rules[i] for i in fallback]
+        fallback_stats = RunStats(len(fallback_rules))
+        for stem, hits in check_pairs(pairs, fallback_rules, fallback_stats, io_concurrency, transform):
+            for local_index, tag, detail in hits:
+                findings[fallback[local_index]].setdefault(tag, []).append((stem, detail))
+        # Every pair was already counted as checked above.
+        fallback_stats.counters.pop('checked', None)
+        stats.merge(fallback_stats, rule_indices=fallback)
+    return findings
+
+
+def _row_findings(table, pairs, pair_images, annotated, row_mask, detail):
+    offsets = table.image_offsets()
+    boxes = table.boxes
+    flagged = []
+    bad_images = set(np.unique(boxes['image_idx'][row_mask]).tolist())
+    for i in np.flatnonzero(annotated):
+        image_idx = pair_images[i]
+        if image_idx not in bad_images:
+            continue
+        start = offsets[image_idx]
+        for row in np.flatnonzero(row_mask[start:offsets[image_idx + 1]]):
+            flagged.append((i, detail(boxes[start + row])))
+    return flagged
+
+
+def _coordinate_findings(table, pairs, pair_images, annotated, tolerance, stats, io_concurrency=None):
+    n_images = len(table.images)
+    img_height = np.zeros(n_images, dtype=np.int64)
+    img_width = np.zeros(n_images, dtype=np.int64)
+    checked = np.zeros(n_images, dtype=bool)
+    probed = [i for i in np.flatnonzero(annotated) if pairs[i][1] is not None]
+    # The image headers are all read ahead concurrently, whether or not the xmls were; this is the only per-file I/O
+    # left once the table is loaded.
+    jobs = (((pairs[i][1], IMAGE_HEADER_BYTES),) for i in probed)
+    headers = iter_reads(jobs, io_concurrency or DEFAULT_CONCURRENCY)
+    for i, (header,) in zip(probed, headers):
+        img_file = pairs[i][1]
+        image_idx = pair_images[i]
+        checked[image_idx] = True
+        start = clock()
+        size = read_image_size(io.BytesIO(header)) if header is not None else None
+        if size is None:
+            # A header that can't be parsed falls back to the probe from the file, like in the engine.
+            size = probe_image_size(img_file)
+        stats.add('probe', start)
+        if size is not None:
+            img_height[image_idx], img_width[image_idx] = size
+        else:
+            stats.error(pairs[i][0], img_file, 'probe', 'unreadable image')
+
+    reason, hits = invalid_coordinates(table, img_height, img_width, tolerance=tolerance)
+    details = {COORDINATES_UNREADABLE_IMAGE: 'unreadable image', COORDINATES_SIZE: 'size', COORDINATES_BOX: 'box'}
+    flagged = []
+    for i in np.flatnonzero(annotated):
+        image_idx = pair_images[i]
+        if checked[image_idx] and reason[image_idx] != COORDINATES_OK:
+            flagged.extend([(i, details[reason[image_idx]])] * int(hits[image_idx]))
+    return flagged
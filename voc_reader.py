@@ -0,0 +1,171 @@
+import argparse
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+BOX_FIELDS = ('xmin', 'ymin', 'xmax', 'ymax')
+
+# Small reads keep the number of parsed-but-unhandled elements low.
+READ_CHUNK_SIZE = 4096
+
+
+class ClassTable:
+    """ Interns class names to small integer ids, shared by every file of a dataset. """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        class_id = self.ids.get(name)
+        if class_id is None:
+            class_id = len(self.names)
+            self.ids[name] = class_id
+            self.names.append(name)
+        return class_id
+
+    def __len__(self):
+        return len(self.names)
+
+
+class VocAnnotation:
+    """ The parts of a VOC xml the tools use: file name, image size, class ids and (N, 4) int32 xmin/ymin/xmax/ymax boxes. """
+
+    __slots__ = ('filename', 'width', 'height', 'class_ids', 'boxes', 'classes')
+
+    def __init__(self, filename, width, height, class_ids, boxes, classes):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.class_ids = class_ids
+        self.boxes = boxes
+        self.classes = classes
+
+    def names(self):
+        return [self.classes.names[c] for c in self.class_ids]
+
+
+def read_voc(source, classes=None):
+    """
+    Stream a VOC xml (path or binary file object) with a pull parser and return a VocAnnotation.
+
+    Each <object> is turned into a class id and a box as soon as it has been parsed and is then cleared, so memory
+    doesn't grow with the document. A file with a single <object> needs no special casing. ``classes`` is the
+    ClassTable new names are interned into; a fresh one is used when it is not given.
+    """
+    if classes is None:
+        classes = ClassTable()
+
+    filename = None
+    width = None
+    height = None
+    class_ids = []
+    coords = []
+    root = None
+    depth = 0
+    for event, elem in _iter_events(source):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        tag = elem.tag
+        if tag == 'object':
+            bndbox = elem.find('bndbox')
+            class_ids.append(classes.intern((elem.findtext('name') or '').strip()))
+            coords.extend(int(float(bndbox.findtext(field))) for field in BOX_FIELDS)
+        elif tag == 'size':
+            width = int(float(elem.findtext('width')))
+            height = int(float(elem.findtext('height')))
+        elif tag == 'filename':
+            filename = elem.text
+        # Everything we need from this child has been read; drop it so the tree never holds more than one object.
+        root.clear()
+
+    boxes = np.array(coords, dtype=np.int32).reshape(-1, 4)
+    return VocAnnotation(filename, width, height, np.array(class_ids, dtype=np.int32), boxes, classes)
+
+
+def _iter_events(source):
+    """ iterparse, fed in small chunks so a big document is never queued up as a whole. """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    f = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            parser.feed(chunk)
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+    finally:
+        if f is not source:
+            f.close()
+
+
+def invert_boxes(boxes, height):
+    """ Image coordinates have origin on the top left corner and we want the origin to be on the bottom left corner. """
+    inverted = boxes.copy()
+    inverted[:, 1] = height - boxes[:, 3]
+    inverted[:, 3] = height - boxes[:, 1]
+    return inverted
+
+
+def benchmark(files, repeat=20):
+    """ Parse time and peak Python memory per file for read_voc, and for xmltodict when it is installed. """
+
+    def measure(parse):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for file in files:
+                parse(file)
+        elapsed = (time.perf_counter() - start) / (repeat * len(files))
+
+        peak = 0
+        for file in files:
+            tracemalloc.start()
+            parse(file)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        return elapsed, peak
+
+    parsers = [('read_voc', read_voc)]
+    try:
+        import xmltodict
+
+        def parse_xmltodict(file):
+            with open(file) as f:
+                return xmltodict.parse(f.read())
+
+        parsers.append(('xmltodict', parse_xmltodict))
+    except ImportError:
+        print('xmltodict is not installed, only timing read_voc.')
+
+    for name, parse in parsers:
+        elapsed, peak = measure(parse)
+        print(f'{name}: {elapsed * 1000:.3f} ms/file, peak memory {peak / 1024:.1f} KiB/file')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the streaming VOC reader.')
+    parser.add_argument('files',
+                        nargs='+',
+                        help='VOC xml files to parse.')
+    parser.add_argument('--repeat',
+                        action='store',
+                        type=int,
+                        help='How many times each file is parsed for the timing.',
+                        default=20)
+
+    args = parser.parse_args()
+    benchmark(args.files, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import io
+import json
+import os
+from multiprocessing import Pool
+
+from annotation_formats import DEFAULT_CLASS_ID
+from annotation_formats import annotate_online_file
+from annotation_formats import iter_inputs
+from annotation_formats import voc_annotation
+from annotation_formats import write_file
+from archive_io import ArchiveWriter
+from archive_io import file_name
+from archive_io import is_archive_name
+from voc_reader import ClassTable
+
+# The images these files belong to are named <lookup name or xml stem>.JPG, as the shell script always named them;
+# with the annotate-online suffix that gives the <name>.JPG___objects.json files downstream tools expect.
+IMAGE_EXTENSION = '.JPG'
+
+
+def load_filename_mapping(path):
+    """ The 'a' lookup file: one 'xml file name|image name' pair per line. """
+    mapping = {}
+    if not path:
+        return mapping
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('|')
+            if len(fields) >= 2 and fields[0]:
+                mapping[fields[0]] = fields[1]
+    return mapping
+
+
+def load_class_ids(path):
+    """ className -> classId from a json object, e.g. {"Mandarins": 12698, "AnjouPears": 12699}. """
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+_config = None
+
+
+def _init_worker(out_dir, mapping, class_ids, default_class_id):
+    global _config
+    _config = (out_dir, mapping, class_ids, default_class_id)
+
+
+def _convert(job):
+    """
+    Convert one xml, given as (path, bytes read ahead or None). Returns (xml name, error, document).
+
+    Without an output directory nothing is written and the document comes back as (file name, text), for the parent
+    to put into an archive; otherwise it is None.
+    """
+    out_dir, mapping, class_ids, default_class_id = _config
+    file, data = job
+    xml_name = file_name(file)
+    try:
+        ann = voc_annotation(io.BytesIO(data) if data is not None else file, ClassTable(), name=xml_name)
+        # The output is named after the image like by any annotate-online writer.
+        ann.filename = (mapping.get(xml_name) or os.path.splitext(xml_name)[0]) + IMAGE_EXTENSION
+        document = annotate_online_file(ann, class_ids, default_class_id)
+        if out_dir is None:
+            return xml_name, None, document
+        write_file(out_dir, *document)
+    except Exception as e:
+        return xml_name, str(e), None
+    return xml_name, None, None
+
+
+def _collect(results, archive, errors):
+    """ Count the converted files, add their documents to ``archive`` and the failures to ``errors``. """
+    n_converted = 0
+    for xml_name, error, document in results:
+        if error:
+            errors.append((xml_name, error))
+            continue
+        if document is not None:
+            archive.add(*document)
+        n_converted += 1
+    return n_converted
+
+
+def convert(source, out_dir, mapping=None, class_ids=None, default_class_id=DEFAULT_CLASS_ID, workers=1,
+            io_concurrency=None):
+    """
+    Convert every VOC xml in a directory, zip or tarball to an annotate-online objects json in ``out_dir``.
+
+    An ``out_dir`` named like an archive (.zip, .tar.gz, ...) is written as one, sequentially by this process.
+    ``io_concurrency`` reads the xmls of a directory ahead asynchronously, so the workers don't wait on storage.
+    """
+    archive = ArchiveWriter(out_dir) if is_archive_name(out_dir) else None
+    if archive is None and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    initargs = (None if archive is not None else out_dir, mapping or {}, class_ids or {}, default_class_id)
+
+    errors = []
+    jobs = iter_inputs(source, '.xml', io_concurrency)
+    try:
+        if workers > 1:
+            with Pool(processes=workers, initializer=_init_worker, initargs=initargs) as pool:
+                n_converted = _collect(pool.imap_unordered(_convert, jobs, chunksize=64), archive, errors)
+        else:
+            _init_worker(*initargs)
+            n_converted = _collect((_convert(job) for job in jobs), archive, errors)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    for xml_name, error in errors:
+        print(f'Error converting {xml_name}: {error}')
+    print(f'Number of converted files: {n_converted}')
+    return n_converted, errors
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Convert VOC xml files to annotate-online ___objects.json files.')
+    parser.add_argument('--xml_dir',
+                        action='store',
+                        help='Directory, zip or tarball (.tar, .tar.gz) with the VOC xml files.',
+                        default='.')
+    parser.add_argument('--out_dir',
+                        action='store',
+                        help='The output directory, or a .zip/.tar/.tar.gz file to write an archive.',
+                        default='.')
+    parser.add_argument('--mapping',
+                        action='store',
+                        help="Lookup file with 'xml file name|image name' lines used to name the output files.",
+                        default=None)
+    parser.add_argument('--class_ids',
+                        action='store',
+                        help='Json file mapping className to classId.',
+                        default=None)
+    parser.add_argument('--default_class_id',
+                        action='store',
+                        type=int,
+                        help='classId for class names missing from --class_ids.',
+                        default=DEFAULT_CLASS_ID)
+    parser.add_argument('--workers',
+                        action='store',
+                        type=int,
+                        help='Number of worker processes.',
+                        default=os.cpu_count() or 1)
+    parser.add_argument('--io_concurrency',
+                        action='store',
+                        type=int,
+                        help='Read the xmls ahead with this many concurrent reads, for network storage.',
+                        default=None)
+
+    args = parser.parse_args()
+    convert(args.xml_dir,
+            args.out_dir,
+            mapping=load_filename_mapping(args.mapping),
+            class_ids=load_class_ids(args.class_ids),
+            default_class_id=args.default_class_id,
+            workers=args.workers,
+            io_concurrency=args.io_concurrency)
+
+
+if __name__ == "__main__":
+    main()